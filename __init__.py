@@ -1,2 +1,22 @@
-from .sqlhandler import BookDTO
-from .sqlhandler import SQLHandler
+# The names of the package are imported on first use, so importing the package loads neither tkinter
+# nor a database driver. Scripts and services only pay for what they use.
+_LAZY_NAMES = {'BookDTO': 'bookrecords.booksdto',
+               'BookRepository': 'bookrecords.bookrepository',
+               'create_handler': 'bookrecords.bookrepository',
+               'SQLHandler': 'bookrecords.sqlhandler',
+               'SQLiteHandler': 'bookrecords.sqlitehandler'}
+
+
+def __getattr__(name):
+    module_name = _LAZY_NAMES.get(name)
+    if module_name is None:
+        raise AttributeError("module 'bookrecords' has no attribute " + repr(name))
+    import importlib
+    value = getattr(importlib.import_module(module_name), name)
+    # Keep the value in the package so that the next access does not come here again.
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_NAMES))
@@ -1,4 +1,11 @@
+import sys
+
+# Run the command line tool when arguments are given, otherwise open the screens.
+if len(sys.argv) > 1:
+    from .cli import main
+    sys.exit(main())
+
 from .bookmanagement import *
 
-# Initiate method to display screen components
-show_fields()
\ No newline at end of file
+# Initiate method to display screen components and run the Tk main loop
+main()
@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+from bookrecords import dbconfig
+from bookrecords.bookrepository import create_handler
+
+
+class AsyncSQLHandler:
+    """This class offers the methods of the handlers as coroutines, for applications running on asyncio.
+    It keeps its own small pool of handlers of the configured backend, each used by one call at a time on a
+    bounded set of threads, so any number of coroutines can call it while at most max_connections calls
+    reach the database at the same time. The others wait for a free handler without blocking the event loop.
+    The methods have the same names, arguments and outcomes as those of the handlers,
+    e.g. the store_flag of the DTOs set to "inserted" or "duplicate" by the inserts. """
+
+    def __init__(self, backend=None, max_connections=None, **handler_kwargs):
+        """This is the constructor method. Handlers are created when first needed.
+        backend and the keyword arguments are passed to create_handler. max_connections is the number of calls
+        run at the same time, by default the size of the connection pool. """
+        self.backend = backend
+        self.handler_kwargs = handler_kwargs
+        self.max_connections = max_connections or dbconfig.POOL_SIZE
+        self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='bookrecords-async')
+        # Handlers not used by a call. A call takes one, or creates one if none is idle.
+        self.idle_handlers = []
+        # Number of calls allowed to run at the same time. The others wait here.
+        self.slots = asyncio.Semaphore(self.max_connections)
+        self.closed = False
+
+    def call_handler(self, sql_handler, method_name, args, kwargs):
+        """This method runs on a thread of the executor. It calls a method of a handler and returns the handler
+        and the outcome of the call, as (handler, result, error). A generator result is read to the end here,
+        so that the event loop never touches the database. """
+        try:
+            if sql_handler is None:
+                sql_handler = create_handler(self.backend, **self.handler_kwargs)
+            result = getattr(sql_handler, method_name)(*args, **kwargs)
+            if inspect.isgenerator(result):
+                result = list(result)
+            return sql_handler, result, None
+        except Exception as e:
+            return sql_handler, None, e
+        finally:
+            # Return the connection to the pool between calls so that every call starts a fresh transaction
+            # and sees the records committed meanwhile.
+            if sql_handler is not None:
+                sql_handler.close_connection()
+
+    async def run(self, method_name, *args, **kwargs):
+        """This method calls a method of a free handler on the executor and returns its result.
+        It waits for a free handler first if max_connections calls are already running. """
+        if self.closed:
+            raise RuntimeError('AsyncSQLHandler is closed')
+        async with self.slots:
+            sql_handler = self.idle_handlers.pop() if self.idle_handlers else None
+            loop = asyncio.get_running_loop()
+            sql_handler, result, error = await loop.run_in_executor(self.executor, self.call_handler, sql_handler,
+                                                                     method_name, args, kwargs)
+            if sql_handler is not None:
+                self.idle_handlers.append(sql_handler)
+        if error is not None:
+            raise error
+        return result
+
+    async def insert_book_to_db(self, book_data):
+        """This method inserts a new record passed as a DTO and returns the DTO with its flag set. """
+        return await self.run('insert_book_to_db', book_data)
+
+    async def insert_books_to_db(self, books, batch_size=1000):
+        """This method inserts many new records passed as DTOs in batches and returns the list of DTOs,
+        in the same order, with their flags set. """
+        return await self.run('insert_books_to_db', books, batch_size)
+
+    async def merge_books_to_db(self, books, batch_size=1000, skip_unchanged=True):
+        """This method inserts or updates many records passed as DTOs in batches and returns the list of DTOs,
+        in the same order, with their flags set. """
+        return await self.run('merge_books_to_db', books, batch_size, skip_unchanged)
+
+    async def search_book_on_db(self, book_data):
+        """This method returns the result set of the records matching the search criteria passed as a DTO. """
+        return await self.run('search_book_on_db', book_data)
+
+    async def keyword_search_on_db(self, keywords, limit=100):
+        """This method returns the result set of the records whose name or writer contain the keywords. """
+        return await self.run('keyword_search_on_db', keywords, limit)
+
+    async def get_books_page(self, page_token=None, page_size=500):
+        """This method returns one page of records ordered by ISBN and the token for the next page. """
+        return await self.run('get_books_page', page_token, page_size)
+
+    async def get_all_books(self):
+        """This method returns the result set of the first page of records. """
+        return await self.run('get_all_books')
+
+    async def count_books(self, book_data=None):
+        """This method returns the exact number of records matching the criteria, or of all records. """
+        return await self.run('count_books', book_data)
+
+    async def estimate_book_count(self):
+        """This method returns the estimated number of all records from the statistics of the database. """
+        return await self.run('estimate_book_count')
+
+    async def get_change_token(self):
+        """This method returns the token of the changes made so far. """
+        return await self.run('get_change_token')
+
+    async def get_changes_since(self, change_token, limit=1000):
+        """This method returns the records changed after the change token, the token of the last change and
+        whether more changes are waiting. """
+        return await self.run('get_changes_since', change_token, limit)
+
+    async def get_book_stats(self, stat_kind, limit=None):
+        """This method returns the number of records per genre or per writer as (value, count) pairs. """
+        return await self.run('get_book_stats', stat_kind, limit)
+
+    async def rebuild_book_stats(self):
+        """This method counts the records per genre and per writer again from the books table. """
+        return await self.run('rebuild_book_stats')
+
+    async def iter_book_pages(self, page_token=None, page_size=500):
+        """This method works as an async generator yielding the result sets of the pages one at a time.
+        Each page is read when the previous one was taken, so only the current page is held in memory. """
+        while True:
+            all_books, page_token = await self.get_books_page(page_token, page_size)
+            yield all_books
+            if page_token is None:
+                break
+
+    async def close(self):
+        """This method waits for the running calls and returns the connections of the handlers to the pool. """
+        self.closed = True
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
+        self.idle_handlers = []
+
+    async def __aenter__(self):
+        """This method supports "async with", which closes the handler at the end of the block. """
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,183 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.catalogue import CatalogueGenerator
+from bookrecords.querycache import QueryCache
+from bookrecords.sqlitehandler import SQLiteHandler
+
+# Catalogue sizes benchmarked when none are passed.
+DEFAULT_SIZES = (10000, 100000)
+# Number of times each timed read or single insert is repeated.
+DEFAULT_REPEAT = 50
+
+
+def percentile(sorted_values, fraction):
+    """This method returns the value below which the fraction of the sorted values lies. """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(operation, size, durations, rows):
+    """This method turns the durations of the runs of an operation, in seconds, into one result record. """
+    durations = sorted(durations)
+    total = sum(durations)
+    return {'operation': operation,
+            'catalogue_size': size,
+            'runs': len(durations),
+            'rows': rows,
+            'total_s': round(total, 6),
+            'mean_ms': round(total / len(durations) * 1000, 3),
+            'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+            'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+            'max_ms': round(durations[-1] * 1000, 3),
+            'rows_per_s': round(rows / total, 1) if total else None}
+
+
+def time_runs(function, arguments):
+    """This method calls the function once per argument and returns the durations and the rows returned. """
+    durations = []
+    rows = 0
+    for argument in arguments:
+        started = time.perf_counter()
+        result = function(argument)
+        durations.append(time.perf_counter() - started)
+        rows += result
+    return durations, rows
+
+
+def criteria(**values):
+    """This method returns a DTO with the search criteria given as keyword arguments. """
+    book_data = BookDTO()
+    for field, value in values.items():
+        setattr(book_data, field, value)
+    return book_data
+
+
+class Benchmark:
+    """This class times the operations of a handler against a synthetic catalogue in a fresh database.
+    The query cache is turned off so that every read reaches the database. """
+
+    def __init__(self, directory, repeat=DEFAULT_REPEAT, batch_size=1000, page_size=500, seed=0):
+        """This is the constructor method. The database files are created in the directory. """
+        self.directory = directory
+        self.repeat = repeat
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.seed = seed
+
+    def run(self, size):
+        """This method benchmarks a catalogue of size records and returns the list of result records. """
+        path = os.path.join(self.directory, 'benchmark-{}.db'.format(size))
+        sql_handler = SQLiteHandler(path=path, cache=QueryCache(max_entries=0))
+        results = []
+        try:
+            # Bulk insert of the whole catalogue, timed as one run.
+            generator = CatalogueGenerator(seed=self.seed)
+            started = time.perf_counter()
+            inserted = sum(1 for book_data in sql_handler.insert_books_to_db(generator.generate(size), self.batch_size)
+                           if book_data.store_flag == 'inserted')
+            results.append(summarize('bulk_insert', size, [time.perf_counter() - started], inserted))
+
+            # Sample records of the catalogue, used as search criteria. The generator gives the same records again.
+            samples = list(CatalogueGenerator(seed=self.seed).generate(min(size, self.repeat)))
+
+            # Single inserts of new records, each with its own commit.
+            new_books = CatalogueGenerator(seed=self.seed).generate(self.repeat, start=size)
+            results.append(summarize('single_insert', size, *time_runs(
+                lambda book_data: int(sql_handler.insert_book_to_db(book_data).store_flag == 'inserted'), new_books)))
+
+            # Listing of the first page, as shown by the monitor.
+            results.append(summarize('list_first_page', size, *time_runs(
+                lambda _: len(sql_handler.get_all_books()), range(self.repeat))))
+
+            # Listing of every record page by page, timed as one run.
+            # The token of the last page is kept to time a page deep into the table.
+            deep_page_token = None
+            started = time.perf_counter()
+            listed = 0
+            for books, next_page_token in sql_handler.iter_book_pages(page_size=self.page_size):
+                listed += len(books)
+                if next_page_token is not None:
+                    deep_page_token = next_page_token
+            results.append(summarize('list_all_pages', size, [time.perf_counter() - started], listed))
+            results.append(summarize('list_deep_page', size, *time_runs(
+                lambda _: len(sql_handler.get_books_page(deep_page_token, self.page_size)[0]), range(self.repeat))))
+
+            # Each kind of search, with criteria taken from the catalogue.
+            searches = [('search_isbn', lambda book_data: criteria(book_ISBN=book_data.book_ISBN)),
+                        ('search_name', lambda book_data: criteria(book_name=book_data.book_name)),
+                        ('search_writer', lambda book_data: criteria(book_writer=book_data.book_writer)),
+                        ('search_genre', lambda book_data: criteria(book_genre=book_data.book_genre)),
+                        ('search_writer_genre', lambda book_data: criteria(book_writer=book_data.book_writer,
+                                                                           book_genre=book_data.book_genre))]
+            for operation, make_criteria in searches:
+                results.append(summarize(operation, size, *time_runs(
+                    lambda book_data: len(sql_handler.search_book_on_db(make_criteria(book_data))), samples)))
+            results.append(summarize('search_keyword', size, *time_runs(
+                lambda book_data: len(sql_handler.keyword_search_on_db(book_data.book_name.split()[0])), samples)))
+        finally:
+            sql_handler.close_connection()
+            sql_handler.pool.close_all()
+        return results
+
+
+def main(argv=None):
+    """This method is the command line entry point for running the benchmark.
+    The results are written as JSON so that runs can be compared over time. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.benchmark',
+                                     description='Time the database operations against a synthetic catalogue.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='catalogue sizes to benchmark, e.g. 10000 100000 1000000')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of each timed operation')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records inserted per transaction')
+    parser.add_argument('--page-size', type=int, default=500, help='records per page of the listing')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the catalogue generator')
+    parser.add_argument('--directory', help='directory for the database files, a temporary one if not given')
+    parser.add_argument('--output', help='JSON file to write, standard output if not given')
+    args = parser.parse_args(argv)
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    directory = args.directory or tempfile.mkdtemp(prefix='bookrecords-benchmark-')
+    try:
+        benchmark = Benchmark(directory, args.repeat, args.batch_size, args.page_size, args.seed)
+        results = []
+        # The handlers print their progress. Send it to standard error so that standard output holds only the JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            for size in args.sizes:
+                print('Benchmarking catalogue of', size, 'records')
+                results.extend(benchmark.run(size))
+    finally:
+        # Only remove the directory if it was created here.
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {'started_at': started_at,
+              'backend': SQLiteHandler.backend_name,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'settings': {'repeat': args.repeat, 'batch_size': args.batch_size,
+                           'page_size': args.page_size, 'seed': args.seed},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+# To run the benchmark, run this module from command.
+if __name__ == '__main__':
+    sys.exit(main())
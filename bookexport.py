@@ -0,0 +1,193 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import create_handler, get_handler_class
+from bookrecords.resultset import BOOK_COLUMNS, BookResultSet
+
+# Records written to Parquet per row group. Larger groups compress better but hold more records in memory.
+PARQUET_ROW_GROUP_SIZE = 100000
+# Compression level of gzip. The default of 9 is several times slower for little gain on this kind of data.
+GZIP_LEVEL = 6
+
+
+def guess_format(path):
+    """This method returns the export format and compression matching the extension of a path. """
+    lower_path = path.lower()
+    compression = None
+    if lower_path.endswith('.gz'):
+        compression = 'gzip'
+        lower_path = lower_path[:-len('.gz')]
+    elif lower_path.endswith('.zst'):
+        compression = 'zstd'
+        lower_path = lower_path[:-len('.zst')]
+    if lower_path.endswith('.parquet'):
+        return 'parquet', compression
+    if lower_path.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl', compression
+    return 'csv', compression
+
+
+def open_text_output(path, compression=None):
+    """This method opens a text file for writing, compressed on the fly with gzip or zstd if asked. """
+    if compression is None:
+        return open(path, 'w', newline='', encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd compression needs the zstandard package')
+        binary_file = open(path, 'wb')
+        # Closing the text wrapper closes the compressor, which closes the file.
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(binary_file, closefd=True),
+                                newline='', encoding='utf-8')
+    raise ValueError('Unsupported compression: ' + str(compression))
+
+
+class CSVExportWriter:
+    """This class writes records to a CSV file with a header line. """
+
+    def __init__(self, path, compression=None):
+        """This is the constructor method. It opens the file and writes the header line. """
+        self.output_file = open_text_output(path, compression)
+        self.csv_writer = csv.writer(self.output_file)
+        self.csv_writer.writerow(BOOK_COLUMNS)
+
+    def write_rows(self, rows):
+        """This method writes a chunk of row tuples. """
+        self.csv_writer.writerows(rows)
+
+    def close(self):
+        """This method closes the file. """
+        self.output_file.close()
+
+
+class JSONLExportWriter:
+    """This class writes records to a file with one JSON object per line, as read by the bulk import. """
+
+    def __init__(self, path, compression=None):
+        """This is the constructor method. It opens the file. """
+        self.output_file = open_text_output(path, compression)
+
+    def write_rows(self, rows):
+        """This method writes a chunk of row tuples. """
+        self.output_file.write(''.join(json.dumps(dict(zip(BOOK_COLUMNS, row))) + '\n' for row in rows))
+
+    def close(self):
+        """This method closes the file. """
+        self.output_file.close()
+
+
+class ParquetExportWriter:
+    """This class writes records to a columnar Parquet file. It needs the pyarrow package.
+    The records are gathered column by column in a result set and written one row group at a time. """
+
+    def __init__(self, path, compression=None, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        """This is the constructor method. It opens the file.
+        Parquet compresses each column within the file, so the compression is passed to the Parquet writer. """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError('Parquet export needs the pyarrow package')
+        self.pyarrow = pyarrow
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in BOOK_COLUMNS])
+        self.parquet_writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression or 'snappy')
+        self.pending = BookResultSet()
+
+    def write_rows(self, rows):
+        """This method adds a chunk of row tuples and writes a row group whenever enough records are gathered. """
+        self.pending.extend(rows)
+        if len(self.pending) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """This method writes the gathered records as one row group. """
+        if len(self.pending):
+            columns = [self.pending.isbns, self.pending.names, self.pending.writers, self.pending.genres]
+            self.parquet_writer.write_table(self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(column, type=self.pyarrow.string()) for column in columns], schema=self.schema))
+            self.pending = BookResultSet()
+
+    def close(self):
+        """This method writes the last row group and closes the file. """
+        self.flush()
+        self.parquet_writer.close()
+
+
+# The writer class of each export format.
+EXPORT_WRITERS = {'csv': CSVExportWriter, 'jsonl': JSONLExportWriter, 'parquet': ParquetExportWriter}
+
+
+def export_books(path, file_format=None, compression=None, book_data=None, fetch_size=5000, sql_handler=None):
+    """This method exports the records matching the search criteria passed as a DTO, or all records,
+    to a CSV, JSONL or Parquet file and returns the number of records written.
+    The format and compression are taken from the extension of the path unless they are passed.
+    The records are read and written one chunk at a time, so the memory used does not grow with the table. """
+    guessed_format, guessed_compression = guess_format(path)
+    file_format = file_format or guessed_format
+    compression = compression or guessed_compression
+    if file_format not in EXPORT_WRITERS:
+        raise ValueError('Unsupported file format: ' + str(file_format))
+    # Create a handler of the configured backend if one is not passed. This borrows a connection from the pool.
+    close_handler = sql_handler is None
+    if sql_handler is None:
+        sql_handler = create_handler()
+    try:
+        export_writer = EXPORT_WRITERS[file_format](path, compression)
+        count = 0
+        try:
+            for rows in sql_handler.stream_books(book_data, fetch_size):
+                export_writer.write_rows(rows)
+                count += len(rows)
+        finally:
+            export_writer.close()
+        return count
+    finally:
+        if close_handler:
+            sql_handler.close_connection()
+
+
+def main(argv=None):
+    """This method is the command line entry point for exporting book records to a file. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.bookexport',
+                                     description='Export book records to a CSV, JSONL or Parquet file.')
+    parser.add_argument('path', help='file to write, e.g. books.csv, books.jsonl.gz or books.parquet')
+    parser.add_argument('--format', choices=sorted(EXPORT_WRITERS), dest='file_format',
+                        help='format of the file, taken from the extension if not given')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'],
+                        help='compression of the file, taken from the extension (.gz, .zst) if not given')
+    parser.add_argument('--isbn', help='only export the book with this ISBN')
+    parser.add_argument('--name', help='only export the books with this name')
+    parser.add_argument('--writer', help='only export the books of this writer')
+    parser.add_argument('--genre', help='only export the books of this genre')
+    parser.add_argument('--fetch-size', type=int, default=5000, help='records read from the database at a time')
+    args = parser.parse_args(argv)
+
+    # Use the same criteria as the search, if any is given.
+    book_data = None
+    if args.isbn or args.name or args.writer or args.genre:
+        book_data = BookDTO()
+        book_data.book_ISBN = args.isbn or ''
+        book_data.book_name = args.name or ''
+        book_data.book_writer = args.writer or ''
+        book_data.book_genre = args.genre or ''
+    try:
+        count = export_books(args.path, args.file_format, args.compression, book_data, args.fetch_size)
+    except (get_handler_class().Error, OSError, ValueError) as e:
+        print('Error while exporting', e, file=sys.stderr)
+        return 1
+    print('exported: {}'.format(count))
+    return 0
+
+
+# Check whether the module is executed from command
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import json
+import sys
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import create_handler, get_handler_class
+from bookrecords.isbn import is_valid_isbn
+
+# The attributes of the DTO in the order of the table columns.
+BOOK_FIELDS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+
+
+def record_to_dto(record):
+    """This method converts one record read from a file into a DTO.
+    The keys can be the column names (book_ISBN) or the same names without the "book_" prefix (ISBN).
+    A record with any detail missing or an ISBN which is not valid is flagged as invalid,
+    so that it is reported but not inserted. """
+    book_data = BookDTO()
+    for field in BOOK_FIELDS:
+        value = record.get(field)
+        if value is None:
+            value = record.get(field[len('book_'):])
+        setattr(book_data, field, '' if value is None else str(value).strip())
+    # Like the entry screen, every detail and a valid ISBN are required.
+    if '' in book_data.get_as_list() or not is_valid_isbn(book_data.book_ISBN):
+        book_data.store_flag = 'invalid'
+    return book_data
+
+
+def read_books(path, file_format=None):
+    """This method reads book records from a CSV or JSONL file and yields one DTO per record.
+    The file is read one line at a time, so it is never held in memory as a whole.
+    The format is taken from the file extension unless it is passed. """
+    if file_format is None:
+        file_format = 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+    with open(path, newline='', encoding='utf-8') as book_file:
+        if file_format == 'csv':
+            # The first line of the CSV file is expected to contain the column names.
+            for record in csv.DictReader(book_file):
+                yield record_to_dto(record)
+        elif file_format == 'jsonl':
+            for line in book_file:
+                # Skip blank lines, typically at the end of the file.
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = {}
+                yield record_to_dto(record if isinstance(record, dict) else {})
+        else:
+            raise ValueError('Unsupported file format: ' + file_format)
+
+
+def import_books(path, file_format=None, batch_size=1000, sql_handler=None, merge=False, skip_unchanged=True):
+    """This method imports the records of a file into database.
+    It works as a generator yielding each DTO with its flag set, in the order of the file.
+    With merge, the records already stored are updated with the details of the file instead of being flagged as
+    duplicate, skipping the unchanged ones unless skip_unchanged is false. """
+    # Create a handler of the configured backend if one is not passed. This borrows a connection from the pool.
+    close_handler = sql_handler is None
+    if sql_handler is None:
+        sql_handler = create_handler()
+    try:
+        if merge:
+            yield from sql_handler.merge_books_to_db(read_books(path, file_format), batch_size, skip_unchanged)
+        else:
+            yield from sql_handler.insert_books_to_db(read_books(path, file_format), batch_size)
+    finally:
+        if close_handler:
+            sql_handler.close_connection()
+
+
+def main(argv=None):
+    """This method is the command line entry point for importing a file of book records. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.bookimport',
+                                     description='Import book records from a CSV or JSONL file.')
+    parser.add_argument('path', help='CSV file with a header line, or JSONL file with one record per line')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], dest='file_format',
+                        help='format of the file, taken from the extension if not given')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records inserted per transaction')
+    parser.add_argument('--report', help='CSV file to write the outcome of every record that was not stored')
+    parser.add_argument('--merge', action='store_true',
+                        help='update the records already stored with the details of the file, e.g. of a newer feed')
+    parser.add_argument('--rewrite-unchanged', dest='skip_unchanged', action='store_false',
+                        help='with --merge, write the records whose details did not change as well')
+    args = parser.parse_args(argv)
+    # Outcomes which are not reported, as the record is stored as in the file.
+    stored_flags = ('inserted', 'updated', 'unchanged') if args.merge else ('inserted',)
+
+    # Count the outcomes by the flag of the DTO.
+    outcome_counts = {}
+    report_file = open(args.report, 'w', newline='', encoding='utf-8') if args.report else None
+    report_writer = None
+    if report_file is not None:
+        report_writer = csv.writer(report_file)
+        report_writer.writerow(('record',) + BOOK_FIELDS + ('store_flag',))
+    try:
+        books = import_books(args.path, args.file_format, args.batch_size, merge=args.merge,
+                             skip_unchanged=args.skip_unchanged)
+        for record_number, book_data in enumerate(books, start=1):
+            outcome_counts[book_data.store_flag] = outcome_counts.get(book_data.store_flag, 0) + 1
+            if report_writer is not None and book_data.store_flag not in stored_flags:
+                report_writer.writerow([record_number] + book_data.get_as_list() + [book_data.store_flag])
+    except (get_handler_class().Error, OSError, ValueError) as e:
+        print('Error while importing', e, file=sys.stderr)
+        return 1
+    finally:
+        if report_file is not None:
+            report_file.close()
+
+    for store_flag, count in sorted(outcome_counts.items()):
+        print('{}: {}'.format(store_flag, count))
+    return 0
+
+
+# Check whether the module is executed from command
+if __name__ == '__main__':
+    sys.exit(main())
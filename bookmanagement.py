@@ -1,13 +1,21 @@
+import itertools
 import tkinter
 from tkinter import *
 from tkinter import ttk
 from tkinter.messagebox import showinfo
 
-from mysql.connector import Error
-
 # Import the other classes in the package
-from bookrecords import SQLHandler
 from bookrecords import BookDTO
+from bookrecords import dbconfig
+from bookrecords.bookstatspanel import BookStatsPanel
+from bookrecords.dbworker import DBWorker
+from bookrecords.isbn import is_valid_isbn
+from bookrecords.ngramindex import build_index
+from bookrecords.querycache import make_search_key, search_key_matches
+from bookrecords.resultset import row_to_dto
+from bookrecords.resultsgrid import ResultsGrid
+from bookrecords.statspanel import StatsPanel
+from bookrecords.writebehind import EntryJournal, WriteBehindQueue
 
 
 class BookEntry:
@@ -22,19 +30,34 @@ class BookEntry:
         self.input_book_writer = None
         self.input_book_genre = None
         self.store_flag_variable = None
+        # Whether the records are queued and stored in batches instead of one at a time.
+        self.batch_mode_variable = None
+        # List of the records entered in batch mode with their status.
+        self.status_tree = None
+        # Frame holding the widgets of the screen. It is built on first show and kept for the next ones.
+        self.frame = None
 
     def show_fields(self):
-        """This method renders the screen elements for user to input details and submit. """
-        # Reset Tk surface
-        surface.destroy()
-        surface.__init__()
-        # Set dimension as appropriate for the contained elements and the position of the root surface..
-        surface.geometry('500x500+20+10')
-        # Assign title for the dialog window
-        surface.title("Enter new book details")
+        """This method shows the screen for user to input details and submit.
+        The widgets are created the first time only, so the details typed before are still there when the
+        user comes back to the screen. """
+        if self.frame is None:
+            self.build_fields()
+        # Show the frame with the dimension and the title of the screen.
+        show_screen(self.frame, '500x600+20+10', "Enter new book details")
+
+    def build_fields(self):
+        """This method creates the screen elements for user to input details and submit, in a frame of
+        their own on the root surface. """
+        self.frame = Frame(surface)
+
+        # Create a check box to switch to the batch entry mode.
+        self.batch_mode_variable = BooleanVar(self.frame, value=entry_queue.pending != [])
+        Checkbutton(self.frame, text='Batch entry (save in the background)',
+                    variable=self.batch_mode_variable).place(x=200, y=12)
 
         # Create a container for the ISBN field.
-        book_ISBN_container = ttk.LabelFrame(surface, text="Enter book ISBN")
+        book_ISBN_container = ttk.LabelFrame(self.frame, text="Enter book ISBN")
         # Create the ISBN entry field
         self.input_book_ISBN = Text(book_ISBN_container, height=20, width=100)
         # Pack to the container
@@ -43,50 +66,70 @@ class BookEntry:
         book_ISBN_container.place(x=30, y=50, height=40, width=400)
 
         # Similar to the ISBN container and entry field, create the field to capture book name.
-        book_name_container = ttk.LabelFrame(surface, text="Enter book name")
+        book_name_container = ttk.LabelFrame(self.frame, text="Enter book name")
         self.input_book_name = Text(book_name_container, height=20, width=300)
         self.input_book_name.pack()
         book_name_container.place(x=30, y=100, height=40, width=400)
 
         # Create container and field to capture writer name.
-        book_writer_container = ttk.LabelFrame(surface, text="Enter book writer")
+        book_writer_container = ttk.LabelFrame(self.frame, text="Enter book writer")
         self.input_book_writer = Text(book_writer_container, height=20, width=300)
         self.input_book_writer.pack()
         book_writer_container.place(x=30, y=150, height=40, width=400)
 
         # Create container and field to capture book genre.
-        book_genre_container = ttk.LabelFrame(surface, text="Enter book genre")
+        book_genre_container = ttk.LabelFrame(self.frame, text="Enter book genre")
         self.input_book_genre = Text(book_genre_container, height=20, width=300)
         self.input_book_genre.pack()
         book_genre_container.place(x=30, y=200, height=40, width=400)
 
         # Create a Submit button to store the details. Call "save_book_record" method when clicked.
-        Button(surface, text='Submit', command=self.save_book_record,
+        Button(self.frame, text='Submit', command=self.save_book_record,
                width=15, bg='brown', fg='white').place(x=70, y=260)
 
         # Create a Back button to go back to selection screen.
         # Call "show_fields" method of BookManagement class when clicked.
-        Button(surface, text='Back', command=show_fields,
+        Button(self.frame, text='Back', command=show_fields,
                width=15, bg='brown', fg='white').place(x=260, y=260)
 
         # Create a StringVar variable for containing any message to user.
-        self.store_flag_variable = StringVar(surface)
+        self.store_flag_variable = StringVar(self.frame)
         self.store_flag_variable.set('Enter new book details and click Submit to save.')
-        result_label = Label(surface, textvariable=self.store_flag_variable,
+        result_label = Label(self.frame, textvariable=self.store_flag_variable,
                              font=("bold", 10), wraplength=300, justify="left")
         result_label.place(x=30, y=300)
 
-        # Render the dialog box with all fields
-        surface.mainloop()
+        # Create the list of the records entered in batch mode, with the status of each.
+        status_container = ttk.LabelFrame(self.frame, text="Batch entries")
+        self.status_tree = ttk.Treeview(status_container, columns=('book_ISBN', 'book_name', 'status'),
+                                        show='headings')
+        for column, heading, width in (('book_ISBN', 'ISBN', 120), ('book_name', 'Name', 180),
+                                       ('status', 'Status', 100)):
+            self.status_tree.heading(column, text=heading)
+            self.status_tree.column(column, width=width)
+        self.status_tree.pack(fill=BOTH, expand=True)
+        status_container.place(x=30, y=360, height=220, width=440)
+        # Show the records still queued from before, e.g. left by an earlier run.
+        entry_queue.on_status = self.show_entry_status
+        for entry_id, book_data in entry_queue.get_unstored():
+            self.show_entry_status(entry_id, book_data)
 
     def validate_entry(self):
-        """This method validates whether the required input is given in the entry fields"""
+        """This method validates whether the required input is given in the entry fields
+        and whether the ISBN is a valid ISBN-10 or ISBN-13. The message of a failed check is shown to the user. """
         # Use "get" method of field to retrieve the field value. Use "end-1c" as the end position
         if self.input_book_ISBN.get(1.0, "end-1c") == "" \
                 or self.input_book_name.get(1.0, "end-1c") == "" \
                 or self.input_book_writer.get(1.0, "end-1c") == "" \
                 or self.input_book_genre.get(1.0, "end-1c") == "":
             # Return false if any of the fields is left blank
+            self.store_flag_variable.set('Please provide all details.\n'
+                                         'Enter new book details and click Submit to save.')
+            return False
+        elif not is_valid_isbn(self.input_book_ISBN.get(1.0, "end-1c")):
+            # Catch typing mistakes in the ISBN before the record is stored.
+            self.store_flag_variable.set('Please provide a valid ISBN-10 or ISBN-13.\n'
+                                         'Check the digits of the ISBN and click Submit to save.')
             return False
         else:
             # Return true if all details are present
@@ -105,53 +148,81 @@ class BookEntry:
             book_data.book_writer = self.input_book_writer.get(1.0, "end-1c")
             book_data.book_genre = self.input_book_genre.get(1.0, "end-1c")
 
-            # Create instance of the SQLHandler class from package.
-            # This will initiate the connection to database.
-            sql_handler = SQLHandler()
-            # Enclose the SQLHandler call within try and except to handle any uncaught error
-            try:
-                # Call "insert_book_to_db" method of SQLHandler and store the returned DTO
-                book_data = sql_handler.insert_book_to_db(book_data)
-                # Check the flag in the returned DTO.
-                # If the DTO is successfully stored, proceed to empty the entry fields again.
-                if book_data.store_flag == "inserted":
-                    self.input_book_ISBN.delete(1.0, "end-1c")
-                    self.input_book_ISBN.insert("end-1c", "")
-                    self.input_book_name.delete(1.0, "end-1c")
-                    self.input_book_name.insert("end-1c", "")
-                    self.input_book_writer.delete(1.0, "end-1c")
-                    self.input_book_writer.insert("end-1c", "")
-                    self.input_book_genre.delete(1.0, "end-1c")
-                    self.input_book_genre.insert("end-1c", "")
-
-                    # Show message to user confirming that data is saved.
-                    self.store_flag_variable.set('Entry saved!\nEnter new book details and click Submit to save.')
-                elif book_data.store_flag == "duplicate":
-                    # Check if the data is detected as duplicate and update the message to user.
-                    self.store_flag_variable.set('Entry failed! This ISBN already exists.\n'
-                                                 'Enter new book details and click Submit to save.')
-                else:
-                    # For any other status in returned DTO flag, show message that storing failed.
-                    self.store_flag_variable.set('Entry failed! Please contact tech support.\n'
-                                                 'Or try to enter new book details and click Submit again to save.')
-            except Error as e:
-                # Handle any uncaught exception
-                print("Error while executing", e)
-            finally:
-                # Close the connection with database
-                sql_handler.close_connection()
-
+            if self.batch_mode_variable.get():
+                # Queue the record. It is safe in the journal, so the next record can be entered at once.
+                entry_queue.submit(book_data)
+                self.clear_fields()
+                self.store_flag_variable.set('Entry queued!\nEnter new book details and click Submit to save.')
+                return
+            # Insert the record on the background worker so that the window keeps responding.
+            # "save_book_done" is called on the Tk thread with the returned DTO.
+            self.store_flag_variable.set('Saving entry...')
+            db_worker.submit(lambda sql_handler: sql_handler.insert_book_to_db(book_data),
+                             self.save_book_done, self.save_book_failed)
+
+    def save_book_done(self, book_data):
+        """This method is called on the Tk thread with the DTO returned by the insert. """
+        # Check the flag in the returned DTO.
+        # If the DTO is successfully stored, proceed to empty the entry fields again.
+        if book_data.store_flag == "inserted":
+            self.clear_fields()
+
+            # Show message to user confirming that data is saved.
+            self.store_flag_variable.set('Entry saved!\nEnter new book details and click Submit to save.')
             print('Saved')
-        else:
-            # Show message that all details are required if validation fails.
-            self.store_flag_variable.set('Please provide all details.\n'
+        elif book_data.store_flag == "duplicate":
+            # Check if the data is detected as duplicate and update the message to user.
+            self.store_flag_variable.set('Entry failed! This ISBN already exists.\n'
                                          'Enter new book details and click Submit to save.')
+        else:
+            # For any other status in returned DTO flag, show message that storing failed.
+            self.store_flag_variable.set('Entry failed! Please contact tech support.\n'
+                                         'Or try to enter new book details and click Submit again to save.')
+
+    def clear_fields(self):
+        """This method empties the entry fields for the next record. """
+        self.input_book_ISBN.delete(1.0, "end-1c")
+        self.input_book_ISBN.insert("end-1c", "")
+        self.input_book_name.delete(1.0, "end-1c")
+        self.input_book_name.insert("end-1c", "")
+        self.input_book_writer.delete(1.0, "end-1c")
+        self.input_book_writer.insert("end-1c", "")
+        self.input_book_genre.delete(1.0, "end-1c")
+        self.input_book_genre.insert("end-1c", "")
+
+    def show_entry_status(self, entry_id, book_data):
+        """This method shows the status of a record of the batch entry mode in the list.
+        It is called by the queue whenever the status changes. The entry id is used as the item identifier,
+        so the row of the record is updated in place. """
+        # The queue outlives the screen, so do nothing once the list is gone.
+        if self.status_tree is None or not self.status_tree.winfo_exists():
+            return
+        values = (book_data.book_ISBN, book_data.book_name, book_data.store_flag)
+        item_id = str(entry_id)
+        if self.status_tree.exists(item_id):
+            self.status_tree.item(item_id, values=values)
+        else:
+            # Show the latest record on top.
+            self.status_tree.insert('', 0, iid=item_id, values=values)
+
+    def save_book_failed(self, error):
+        """This method is called on the Tk thread when the insert raised an uncaught error. """
+        print("Error while executing", error)
+        self.store_flag_variable.set('Entry failed! Please contact tech support.\n'
+                                     'Or try to enter new book details and click Submit again to save.')
 
 
 class BookMonitor:
     """This class contains the methods to support inserting new book details into the database.
     This class contains the methods to render the UI elements and to handle user input. """
 
+    # Index of the names and writers for the suggestions while typing. It is built once per process
+    # on the background worker and kept up to date by the inserts.
+    typeahead_index = None
+    typeahead_loading = False
+    # Milliseconds without typing before the suggestions are updated.
+    TYPEAHEAD_DELAY = 40
+
     def __init__(self):
         """This is the constructor method"""
         self.input_book_ISBN = None
@@ -159,20 +230,48 @@ class BookMonitor:
         self.input_book_writer = None
         self.input_book_genre = None
         self.store_flag_variable = None
+        # Grid showing the records found. It is created once with the screen and reused for every result.
+        self.results_grid = None
+        # Window showing the statistics of the database operations, while it is open.
+        self.stats_panel = None
+        # Window showing the number of books per genre and per writer, while it is open.
+        self.book_stats_panel = None
+        # List of the suggestions while typing, the records it shows and the scheduled update, if any.
+        self.suggestions_list = None
+        self.suggested_books = []
+        self.typeahead_after_id = None
+        # Whether the records shown are refreshed with the changes, the token of the last change merged
+        # and the scheduled read of the changes, if any.
+        self.auto_refresh_variable = None
+        self.change_token = None
+        self.refresh_after_id = None
+        # Cache key of the criteria of the last search, which tells whether a changed record belongs to its results.
+        self.search_key = None
+        # Frame holding the widgets of the screen. It is built on first show and kept for the next ones.
+        self.frame = None
+        # Number of records of the results being shown, as counted or estimated by the database before the rows
+        # are loaded, and whether it is an estimate. None until the count arrives.
+        self.total_count = None
+        self.total_estimated = False
 
     def show_fields(self):
-        """This method renders the UI elements for user to input search criteria,
-        buttons to choose the function and to display the records. """
-        # Reset Tk surface
-        surface.destroy()
-        surface.__init__()
+        """This method shows the screen for user to input search criteria, with the buttons to choose the function
+        and the records. The widgets are created the first time only, so the criteria and the records shown
+        before are still there when the user comes back to the screen. """
+        if self.frame is None:
+            self.build_fields()
         # Set the dimension of the root surface and the position of the root surface.
-        surface.geometry('900x700+20+10')
-        # Assign title for the dialog window
-        surface.title("View recorded book details")
+        show_screen(self.frame, '900x700+20+10', "View recorded book details")
+        # Follow the changes of the records shown again, if the auto refresh is on.
+        self.schedule_refresh()
+
+    def build_fields(self):
+        """This method creates the UI elements for user to input search criteria,
+        buttons to choose the function and to display the records, in a frame of their own on the root surface. """
+        self.frame = Frame(surface)
 
         # Create a container for the ISBN field.
-        book_ISBN_container = ttk.LabelFrame(surface, text="Enter book ISBN")
+        book_ISBN_container = ttk.LabelFrame(self.frame, text="Enter book ISBN")
         # Create the ISBN entry field
         self.input_book_ISBN = Text(book_ISBN_container, height=20, width=100)
         # Pack to the container
@@ -181,46 +280,125 @@ class BookMonitor:
         book_ISBN_container.place(x=30, y=50, height=40, width=400)
 
         # Similar to the ISBN container and entry field, create the field to capture book name.
-        book_name_container = ttk.LabelFrame(surface, text="Enter book name")
+        book_name_container = ttk.LabelFrame(self.frame, text="Enter book name")
         self.input_book_name = Text(book_name_container, height=20, width=300)
         self.input_book_name.pack()
         book_name_container.place(x=30, y=100, height=40, width=400)
 
         # Create container and field to capture writer name.
-        book_writer_container = ttk.LabelFrame(surface, text="Enter book writer")
+        book_writer_container = ttk.LabelFrame(self.frame, text="Enter book writer")
         self.input_book_writer = Text(book_writer_container, height=20, width=300)
         self.input_book_writer.pack()
         book_writer_container.place(x=30, y=150, height=40, width=400)
 
         # Create container and field to capture book genre.
-        book_genre_container = ttk.LabelFrame(surface, text="Enter book genre")
+        book_genre_container = ttk.LabelFrame(self.frame, text="Enter book genre")
         self.input_book_genre = Text(book_genre_container, height=20, width=300)
         self.input_book_genre.pack()
         book_genre_container.place(x=30, y=200, height=40, width=400)
 
+        # Create a list of suggestions, updated while the name or the writer is typed.
+        suggestions_container = ttk.LabelFrame(self.frame, text="Suggestions (double click to show)")
+        self.suggestions_list = Listbox(suggestions_container, activestyle='none')
+        self.suggestions_list.pack(fill=BOTH, expand=True)
+        suggestions_container.place(x=450, y=50, height=190, width=430)
+        self.suggestions_list.bind('<Double-Button-1>', self.suggestion_chosen)
+        self.suggestions_list.bind('<Return>', self.suggestion_chosen)
+        self.input_book_name.bind('<KeyRelease>', self.schedule_suggestions)
+        self.input_book_writer.bind('<KeyRelease>', self.schedule_suggestions)
+        self.load_typeahead_index()
+
         # Create a Search button to search with the entered details.
         # Call "search_book_record" method when clicked.
-        Button(surface, text='Search', command=self.search_book_record,
+        Button(self.frame, text='Search', command=self.search_book_record,
                width=15, bg='brown', fg='white').place(x=30, y=260)
         # Create a button to show all records. Call "show_book_record" method when clicked.
-        Button(surface, text='Show all (500)', command=self.show_book_records,
+        Button(self.frame, text='Show all', command=self.show_book_records,
                width=15, bg='brown', fg='white').place(x=175, y=260)
 
         # Create a Back button to go back to selection screen.
         # Call "show_fields" method of BookManagement class when clicked.
-        Button(surface, text='Back', command=show_fields,
+        Button(self.frame, text='Back', command=self.leave_screen,
                width=15, bg='brown', fg='white').place(x=315, y=260)
+        # Create a button to show the statistics of the database operations.
+        Button(self.frame, text='Stats', command=self.show_stats,
+               width=15, bg='brown', fg='white').place(x=455, y=260)
+        # Create a button to show the number of books per genre and per writer.
+        Button(self.frame, text='Catalogue', command=self.show_book_stats,
+               width=15, bg='brown', fg='white').place(x=595, y=260)
+        # Create a check box to merge the changes made by anyone into the records shown, as they happen.
+        self.auto_refresh_variable = IntVar(self.frame)
+        Checkbutton(self.frame, text='Auto refresh', command=self.auto_refresh_changed,
+                    variable=self.auto_refresh_variable).place(x=740, y=262)
 
         # Create a StringVar variable for containing any message to user.
-        self.store_flag_variable = StringVar(surface)
+        self.store_flag_variable = StringVar(self.frame)
         self.store_flag_variable.set('Enter search details and click "Search" to find the book.\n'
-                                     'Click "Show all" to show the first 500 entries.')
-        result_label = Label(surface, textvariable=self.store_flag_variable,
+                                     'Click "Show all" to show all entries. More entries are loaded as you scroll.')
+        result_label = Label(self.frame, textvariable=self.store_flag_variable,
                              font=("bold", 10), wraplength=700, justify="left")
         result_label.place(x=30, y=300)
 
-        # Render the dialog box with all fields
-        surface.mainloop()
+        # Create the grid for the records found. It is filled when user clicks Search or Show all.
+        self.results_grid = ResultsGrid(self.frame)
+        self.results_grid.on_rows_added = self.show_row_count
+        # Pull the pages of the grid on the background worker.
+        self.results_grid.worker = db_worker
+        # Place the grid mentioning the position and the dimension
+        self.results_grid.place(x=30, y=345, height=320, width=850)
+
+    def load_typeahead_index(self):
+        """This method starts building the index of the suggestions on the background worker,
+        unless it is built or being built. """
+        if BookMonitor.typeahead_index is None and not BookMonitor.typeahead_loading:
+            BookMonitor.typeahead_loading = True
+            db_worker.submit(build_index, self.typeahead_index_done, self.typeahead_index_failed, channel='typeahead')
+
+    @staticmethod
+    def typeahead_index_done(index):
+        """This method is called on the Tk thread with the index of the suggestions once it is built. """
+        BookMonitor.typeahead_index = index
+        BookMonitor.typeahead_loading = False
+
+    @staticmethod
+    def typeahead_index_failed(error):
+        """This method is called on the Tk thread when building the index of the suggestions failed.
+        It is built again the next time the screen is shown. """
+        print("Error while building suggestions", error)
+        BookMonitor.typeahead_loading = False
+
+    def schedule_suggestions(self, event):
+        """This method is called on every key typed in the name or writer field.
+        It updates the suggestions after a short pause, so a burst of keys only updates them once. """
+        if self.typeahead_after_id is not None:
+            surface.after_cancel(self.typeahead_after_id)
+        self.typeahead_after_id = surface.after(self.TYPEAHEAD_DELAY, self.show_suggestions, event.widget)
+
+    def show_suggestions(self, field):
+        """This method shows the records best matching the text of a field in the list of suggestions. """
+        self.typeahead_after_id = None
+        self.suggestions_list.delete(0, END)
+        if BookMonitor.typeahead_index is None:
+            self.suggested_books = []
+            self.suggestions_list.insert(END, 'Suggestions are being prepared...')
+            return
+        # The index is in memory, so the search is quick enough for the Tk thread.
+        self.suggested_books = BookMonitor.typeahead_index.search(field.get(1.0, "end-1c"))
+        for book_ISBN, book_name, book_writer in self.suggested_books:
+            self.suggestions_list.insert(END, '{} - {}'.format(book_name, book_writer))
+
+    def suggestion_chosen(self, event):
+        """This method is called when user double clicks a suggestion. It searches the record suggested. """
+        selection = self.suggestions_list.curselection()
+        if not selection or selection[0] >= len(self.suggested_books):
+            return
+        book_ISBN, book_name, book_writer = self.suggested_books[selection[0]]
+        # Fill the criteria with the record suggested, so the search finds it by its ISBN.
+        for field, value in ((self.input_book_ISBN, book_ISBN), (self.input_book_name, book_name),
+                             (self.input_book_writer, book_writer), (self.input_book_genre, '')):
+            field.delete(1.0, END)
+            field.insert(1.0, value)
+        self.search_book_record()
 
     def validate_entry(self):
         """This method validates whether the required input is given in the entry fields"""
@@ -248,153 +426,282 @@ class BookMonitor:
             book_data.book_writer = self.input_book_writer.get(1.0, "end-1c")
             book_data.book_genre = self.input_book_genre.get(1.0, "end-1c")
 
-            # Create SQLHandler instance. This initiates the connection to database
-            sql_handler = SQLHandler()
-            # Enclose the SQLHandler call with try and except
-            try:
-                # Call search_book_on_db() method to get a list of results from database matching the criteria
-                books = sql_handler.search_book_on_db(book_data)
-
-                # Create a LabelFrame for the results
-                book_results = ttk.LabelFrame(surface, text="Records found")
-                # Place the frame mentioning the position and the dimension
-                book_results.place(x=30, y=300, height=280, width=850)
-
-                # Define columns with the first DTO instance in the list.
-                # Use the get_as_list method to get a list from the DTO
-                columns = books[0].get_as_list()
-
-                # Create a TreeView representation within the LabelFrame area. Use the columns as headings.
-                tree = ttk.Treeview(book_results, columns=tuple(columns), show='headings')
-                # define headings texts with same value from the columns list
-                for column in columns:
-                    tree.heading(column, text=column)
-                    # Place the heading as center aligned
-                    tree.column(column, anchor=CENTER)
-
-                # Check if there are results returned
-                if len(books) > 1:
-                    # Get the data from index 1. 0 was the column headers.
-                    for book_data in books[1::]:
-                        # Insert each record by converting the list from DTO into a tuple.
-                        tree.insert('', tkinter.END, values=tuple(book_data.get_as_list()))
-
-                # Create a method which will handle the event when one row of the TreeView is clicked.
-                def item_selected(event):
-                    for selected_item in tree.selection():
-                        item = tree.item(selected_item)
-                        record = str(item['values'])
-                        # show a message
-                        showinfo(title='Information', message=''.join(record))
-
-                # Bind the method with TreeViewSelect event.
-                tree.bind('<<TreeviewSelect>>', item_selected)
-
-                # Place the TreeView at 0,0 position and stacking from top left.
-                tree.grid(row=0, column=0, sticky='NSEW')
-
-                # add a vertical scrollbar to the LabelFrame
-                scrollbar = ttk.Scrollbar(book_results, orient=tkinter.VERTICAL, command=tree.yview)
-                tree.configure(yscrollcommand=scrollbar.set)
-                # Stack the scrollbar on right side
-                scrollbar.grid(row=0, column=1, sticky='NS')
-            except Error as e:
-                # Catch any unexpected error
-                print("Error while executing", e)
-            finally:
-                # Close the connection
-                sql_handler.close_connection()
+            # Empty the grid, which also stops it from pulling pages of the previous results.
+            self.results_grid.clear()
+            self.stop_refresh()
+            self.store_flag_variable.set('Searching...')
+            # Keep the criteria to tell which changed records belong to the results.
+            self.search_key = make_search_key(book_data)
+            # Count the matching records first, so the user learns how many there are before they are read.
+            self.read_count(lambda sql_handler: sql_handler.count_books(book_data), estimated=False)
+            # Call search_book_on_db() method on the background worker to get a list of results matching
+            # the criteria. A search submitted while the previous one is still running supersedes it.
+            # The change token is read first, so no change made while searching is missed by the auto refresh.
+            db_worker.submit(lambda sql_handler: (sql_handler.get_change_token(),
+                                                  sql_handler.search_book_on_db(book_data)),
+                             self.search_book_done, self.read_failed, channel=self.results_grid.channel)
+
+    def search_book_done(self, result):
+        """This method is called on the Tk thread with the change token and the result set found by the search. """
+        change_token, books = result
+        search_key = self.search_key
+        # Search results come in one go, so they are shown as a single page.
+        self.display_books(books.columns, [books],
+                           row_filter=lambda row: search_key_matches(search_key, row_to_dto(row)))
+        self.start_refresh(change_token)
+
+    def read_failed(self, error):
+        """This method is called on the Tk thread when reading from database failed. """
+        print("Error while executing", error)
+        self.store_flag_variable.set('Reading the records failed! Please contact tech support.')
 
     def show_book_records(self):
         """This method is called when user clicks on Show All.
-        This method will call necessary class and method to retrieve from database. """
-        # Create SQLHandler instance. This initiates the connection to database
-        sql_handler = SQLHandler()
-        # Enclose the SQLHandler call with try and except
-        try:
-            # Call get_all_books() method to get list of all records from database
-            books = sql_handler.get_all_books()
-
-            # Create a LabelFrame for the results
-            book_results = ttk.LabelFrame(surface, text="Records found")
-            # Place the frame mentioning the position and the dimension
-            book_results.place(x=30, y=300, height=280, width=850)
-
-            # define columns with the first DTO instance in the list.
-            # Use the get_as_list method to get a list from the DTO
-            columns = books[0].get_as_list()
-
-            # Create a TreeView representation within the LabelFrame area. Use the columns as headings.
-            tree = ttk.Treeview(book_results, columns=tuple(columns), show='headings')
-            # define headings texts with same value from the columns list
-            for column in columns:
-                tree.heading(column, text=column)
-                # Place the heading as center aligned
-                tree.column(column, anchor=CENTER)
-
-            # Check if there are results returned
-            if len(books) > 1:
-                # Get the data from index 1. 0 was the column headers.
-                for book_data in books[1::]:
-                    # Insert each record by converting the list from DTO into a tuple.
-                    tree.insert('', tkinter.END, values=tuple(book_data.get_as_list()))
-
-            # Create a method which will handle the event when one row of the TreeView is clicked.
-            def item_selected(event):
-                for selected_item in tree.selection():
-                    item = tree.item(selected_item)
-                    record = str(item['values'])
-                    # show a message
-                    showinfo(title='Information', message=''.join(record))
-
-            # Bind the method with TreeViewSelect event.
-            tree.bind('<<TreeviewSelect>>', item_selected)
-
-            # Place the TreeView at 0,0 position and stacking from top left.
-            tree.grid(row=0, column=0, sticky='NSEW')
-
-            # add a vertical scrollbar to the LabelFrame
-            scrollbar = ttk.Scrollbar(book_results, orient=tkinter.VERTICAL, command=tree.yview)
-            tree.configure(yscrollcommand=scrollbar.set)
-            # Stack the scrollbar on right side
-            scrollbar.grid(row=0, column=1, sticky='NS')
-        except Error as e:
-            # Catch any unexpected error
-            print("Error while executing", e)
-        finally:
-            # Close the connection
-            sql_handler.close_connection()
+        This method will call necessary class and method to retrieve the first page from database.
+        The following pages are retrieved when the user scrolls to the end of the records shown. """
+        # Empty the grid, which also stops it from pulling pages of the previous results.
+        self.results_grid.clear()
+        self.stop_refresh()
+        self.store_flag_variable.set('Loading...')
+        # Read the estimated number of all records from the table statistics, which is quicker than counting them.
+        self.read_count(lambda sql_handler: sql_handler.estimate_book_count(), estimated=True)
+        # Call get_books_page() method on the background worker to get the first page and the token of the next page
+        # The change token is read first, so no change made while loading is missed by the auto refresh.
+        db_worker.submit(lambda sql_handler: (sql_handler.get_change_token(),) + sql_handler.get_books_page(),
+                         self.first_page_done, self.read_failed, channel=self.results_grid.channel)
+
+    def read_count(self, job, estimated):
+        """This method reads the number of records of the results about to be shown on the background worker.
+        A count read for earlier results is superseded. """
+        self.total_count = None
+        self.total_estimated = estimated
+        db_worker.submit(job, self.count_done, self.count_failed, channel='count')
+
+    def count_done(self, total_count):
+        """This method is called on the Tk thread with the number of records of the results. """
+        self.total_count = total_count
+        # Show the count at once when the rows are still being read, or with the rows already shown.
+        if self.results_grid.row_count:
+            self.results_grid.notify()
+        elif total_count is not None:
+            self.store_flag_variable.set('Reading {}{} records...'.format('~' if self.total_estimated else '',
+                                                                         total_count))
+
+    @staticmethod
+    def count_failed(error):
+        """This method is called on the Tk thread when the count could not be read. The rows are shown anyway. """
+        print("Error while counting records", error)
+
+    def first_page_done(self, first_page):
+        """This method is called on the Tk thread with the change token, the first page of all records and
+        the next page token. """
+        change_token, books, next_page_token = first_page
+        # The pages come in order of ISBN, so new records are merged at their place.
+        self.display_books(books.columns, itertools.chain([books], self.iter_book_pages(next_page_token)),
+                           ordered=True)
+        self.start_refresh(change_token)
+
+    @staticmethod
+    def iter_book_pages(page_token):
+        """This method works as a generator yielding the pages of all records starting from the page token.
+        The grid takes each page on the background worker, so the page is read with the handler of the
+        worker thread. """
+        while page_token is not None:
+            books, page_token = db_worker.current_handler().get_books_page(page_token)
+            yield books
+
+    def display_books(self, columns, pages, ordered=False, row_filter=None):
+        """This method shows pages of records in the results grid.
+        columns are the column names and each page is a result set. The grid reads the rows of the
+        result sets directly, so no DTO or list is created per record.
+        ordered and row_filter tell the grid how to merge the changes of the auto refresh. """
+        self.results_grid.load(columns, pages, ordered, row_filter)
+
+    def auto_refresh_changed(self):
+        """This method is called when user ticks or clears Auto refresh. """
+        if self.auto_refresh_variable.get():
+            self.schedule_refresh()
+        else:
+            self.stop_refresh(keep_token=True)
+
+    def start_refresh(self, change_token):
+        """This method starts following the changes made after the change token, for the records just loaded. """
+        self.change_token = change_token
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        """This method schedules the next read of the changes, if the auto refresh is on and records are shown. """
+        if self.auto_refresh_variable.get() and self.change_token is not None and self.refresh_after_id is None:
+            self.refresh_after_id = surface.after(dbconfig.MONITOR_REFRESH_INTERVAL, self.refresh_changes)
+
+    def stop_refresh(self, keep_token=False):
+        """This method stops reading the changes. Without keep_token, the changes of the records shown are
+        not followed any more, e.g. because other records are loaded. """
+        if self.refresh_after_id is not None:
+            surface.after_cancel(self.refresh_after_id)
+            self.refresh_after_id = None
+        db_worker.cancel('changes')
+        if not keep_token:
+            self.change_token = None
+
+    def refresh_changes(self):
+        """This method reads the records changed since the last read on the background worker. """
+        self.refresh_after_id = None
+        change_token = self.change_token
+        if change_token is None or not self.auto_refresh_variable.get():
+            return
+        db_worker.submit(lambda sql_handler: sql_handler.get_changes_since(change_token),
+                         self.changes_done, self.changes_failed, channel='changes')
+
+    def changes_done(self, result):
+        """This method is called on the Tk thread with the records changed, the token of the last change and
+        whether more changes are waiting. The changes are merged into the rows shown. """
+        changes, self.change_token, more = result
+        merged = self.results_grid.merge_rows(changes)
+        if merged:
+            self.store_flag_variable.set('{} changed records merged. {} records shown.'
+                                         .format(merged, len(self.results_grid.tree.get_children())))
+        if more:
+            # Read the rest of the changes at once.
+            self.refresh_changes()
+        else:
+            self.schedule_refresh()
+
+    def changes_failed(self, error):
+        """This method is called on the Tk thread when reading the changes failed. They are read again later. """
+        print("Error while reading changes", error)
+        self.schedule_refresh()
+
+    def leave_screen(self):
+        """This method is called when user clicks on Back. It pauses the auto refresh while the screen is hidden
+        and shows the selection. The changes made meanwhile are merged when the screen is shown again. """
+        self.stop_refresh(keep_token=True)
+        show_fields()
+
+    def show_stats(self):
+        """This method is called when user clicks on Stats. It opens the statistics window, or brings it to front
+        if it is already open. """
+        if self.stats_panel is not None and self.stats_panel.window.winfo_exists():
+            self.stats_panel.window.lift()
+        else:
+            self.stats_panel = StatsPanel(surface)
+
+    def show_book_stats(self):
+        """This method is called when user clicks on Catalogue. It opens the window with the number of books per
+        genre and per writer, or brings it to front and reads the counts again if it is already open. """
+        if self.book_stats_panel is not None and self.book_stats_panel.window.winfo_exists():
+            self.book_stats_panel.window.lift()
+            self.book_stats_panel.refresh()
+        else:
+            self.book_stats_panel = BookStatsPanel(surface, db_worker)
+
+    def show_row_count(self, row_count, complete, dropped_count=0):
+        """This method updates the message to user with the number of records loaded in the grid,
+        and the number of records of the results once it is known.
+        The grid only keeps its last rows, so the number of the first rows it dropped is told as well. """
+        if complete:
+            message = '{} records found.'.format(row_count)
+        elif self.total_count is not None:
+            message = 'Showing {} of {}{} records. Scroll down to load more.'.format(
+                row_count, '~' if self.total_estimated else '', self.total_count)
+        else:
+            message = '{} records loaded. Scroll down to load more.'.format(row_count)
+        if dropped_count:
+            message += ' The first {} are no longer shown; search again to see them.'.format(dropped_count)
+        self.store_flag_variable.set(message)
 
 
 # Initiate a global Tk surface so that multiple classes can access
 surface = Tk()
 
+# Initiate the background worker which runs the database jobs of all screens
+db_worker = DBWorker()
+
+# Initiate the queue of the batch entry mode. It takes over the records left in its journal by an earlier run.
+entry_queue = WriteBehindQueue(EntryJournal(dbconfig.ENTRY_JOURNAL_PATH), db_worker,
+                               dbconfig.ENTRY_BATCH_SIZE, dbconfig.ENTRY_FLUSH_INTERVAL)
+
+
+# Busy indicator shown above the current screen while the background worker runs a job. Created on first show.
+busy_bar = None
+# Frame of the screen shown at the moment.
+current_frame = None
+# Frame of the selection screen and the screens of the two modes. They are created once, on first show,
+# and kept for the whole run, so each screen keeps what the user entered.
+selector_frame = None
+book_entry = None
+book_monitor = None
+
+
+def show_busy_indicator():
+    """This method creates the busy indicator on the root surface, shown while the background worker runs a job.
+    It is created once and stays above whichever screen is shown. """
+    global busy_bar
+    busy_bar = ttk.Progressbar(surface, mode='indeterminate', length=120)
+
+    def busy_changed(busy):
+        if busy:
+            busy_bar.place(x=30, y=15)
+            # Keep the indicator above the frame of the screen.
+            busy_bar.lift()
+            busy_bar.start(10)
+        else:
+            busy_bar.stop()
+            busy_bar.place_forget()
+
+    # Poll the results of the worker and store the queued entries with the root surface.
+    db_worker.attach(surface)
+    entry_queue.attach(surface)
+    db_worker.on_busy_changed = busy_changed
+    busy_changed(db_worker.pending_count > 0)
+
+
+def show_screen(frame, geometry, title):
+    """This method switches the root surface to the screen of a frame. The frame of the previous screen is only
+    hidden, not destroyed, so no widget is created again and the switch is instant. """
+    global current_frame
+    if busy_bar is None:
+        show_busy_indicator()
+    if current_frame is not None and current_frame is not frame:
+        current_frame.place_forget()
+    # Let the frame fill the root surface, whatever its size.
+    frame.place(x=0, y=0, relwidth=1, relheight=1)
+    frame.tkraise()
+    current_frame = frame
+    if busy_bar.winfo_ismapped():
+        busy_bar.lift()
+    # Set dimension as appropriate for the contained elements and the position of the root surface.
+    surface.geometry(geometry)
+    # Assign title for the dialog window
+    surface.title(title)
+
 
 def show_fields():
-    """This method renders the screen elements for user to select mode of usage of the tool. """
-    # Reset and initiate the Tk surface
-    surface.destroy()
-    surface.__init__()
-    # Set dimension as appropriate for the contained elements and the position of the root surface..
-    surface.geometry('500x120+20+10')
-    # Assign title for the dialog window
-    surface.title("Select mode of usage")
-
-    # Create instances of the two classes used for the two modes.
-    book_entry = BookEntry()
-    book_monitor = BookMonitor()
-    # Create a button to show the entry related screen.
-    Button(surface, text='Book entry', command=book_entry.show_fields,
-           width=15, bg='brown', fg='white').place(x=100, y=40)
-    # Create a button to show the monitoring related screen.
-    Button(surface, text='Book Monitor', command=book_monitor.show_fields,
-           width=15, bg='brown', fg='white').place(x=250, y=40)
-
-    # Render the dialog box with all fields
+    """This method shows the screen for user to select mode of usage of the tool.
+    The screen is created on the first call. """
+    global selector_frame, book_entry, book_monitor
+    if selector_frame is None:
+        selector_frame = Frame(surface)
+        # Create instances of the two classes used for the two modes. They live as long as the application.
+        book_entry = BookEntry()
+        book_monitor = BookMonitor()
+        # Create a button to show the entry related screen.
+        Button(selector_frame, text='Book entry', command=book_entry.show_fields,
+               width=15, bg='brown', fg='white').place(x=100, y=40)
+        # Create a button to show the monitoring related screen.
+        Button(selector_frame, text='Book Monitor', command=book_monitor.show_fields,
+               width=15, bg='brown', fg='white').place(x=250, y=40)
+    show_screen(selector_frame, '500x120+20+10', "Select mode of usage")
+
+
+def main():
+    """This method shows the selection screen and runs the Tk main loop until the window is closed.
+    There is one root surface and one main loop for the whole run; the screens only switch frames. """
+    show_fields()
     surface.mainloop()
 
 
 # Check whether the tool is executed from command
 if __name__ == '__main__':
     # Initiate method to display screen components
-    show_fields()
+    main()
@@ -0,0 +1,1076 @@
+import base64
+import threading
+import time
+
+from bookrecords import dbconfig
+from bookrecords.booksdto import BookDTO
+from bookrecords.instrumentation import get_instrumentation, instrumented
+from bookrecords.isbn import normalize_isbn
+from bookrecords.querycache import get_cache, get_prefix, make_count_key, make_search_key
+from bookrecords.resultset import BookResultSet
+from bookrecords.schema import REBUILD_GENRE_STATS, REBUILD_WRITER_STATS, ensure_schema
+
+# Attributes of the DTO which can be used as search criteria, in the order they are combined in the query.
+SEARCH_FIELDS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+
+# Most values passed in one IN list, to stay within the limits of every backend.
+MAX_IN_VALUES = 500
+
+# Condition of a prefix criteria. The escape character is given explicitly, as MySQL escapes with a backslash
+# by default and SQLite has no default one; "!" needs no escaping in the query text of either database.
+LIKE_ESCAPE = " LIKE %s ESCAPE '!'"
+
+# Kinds of counts kept in the summary table, with the attribute of the DTO which is counted.
+STATS_FIELDS = (('genre', 'book_genre'), ('writer', 'book_writer'))
+
+# Methods called with the DTOs of the records inserted into a database, by schema key of the database.
+_insert_listeners = {}
+_insert_listeners_lock = threading.Lock()
+
+
+# Columns written by an insert, with a %s placeholder for each value.
+INSERT_QUERY = "INSERT INTO books (book_key, book_ISBN, book_name, book_writer, book_genre, book_revision, " \
+               "book_hash) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+# Highest key, used in a change token to mean that every record of its revision was seen.
+MAX_BOOK_KEY = 2 ** 63 - 1
+# Revision of the records written by a bulk load which is not finished. The readers of changes never see it,
+# and finish_bulk_load gives the records a real revision.
+PENDING_REVISION = -1
+
+
+def encode_page_token(book_key):
+    """This method turns the key of the last record of a page into the token used to ask for the next page.
+    The token is opaque to the callers so that the way pages are found can change without changing them. """
+    return base64.urlsafe_b64encode(str(book_key).encode('utf-8')).decode('ascii')
+
+
+def decode_page_token(page_token):
+    """This method turns a page token back into the key after which the next page starts. """
+    return int(base64.urlsafe_b64decode(page_token.encode('ascii')).decode('utf-8'))
+
+
+def encode_change_token(revision, book_key=MAX_BOOK_KEY):
+    """This method turns the revision and key of the last change seen into the token used to ask for the changes
+    after it. The records changed by one transaction share a revision, so the key tells how far into the
+    revision the changes were read. """
+    return base64.urlsafe_b64encode('{}:{}'.format(revision, book_key).encode('utf-8')).decode('ascii')
+
+
+def decode_change_token(change_token):
+    """This method turns a change token back into the revision and the key after which the changes start. """
+    revision, book_key = base64.urlsafe_b64decode(change_token.encode('ascii')).decode('utf-8').split(':')
+    return int(revision), int(book_key)
+
+
+def normalize_book_isbn(book_data):
+    """This method sets the ISBN of a DTO to its ISBN-13 form and returns the key of the record.
+    It raises ValueError if the ISBN is not valid. """
+    book_data.book_ISBN = normalize_isbn(book_data.book_ISBN)
+    return int(book_data.book_ISBN)
+
+
+def get_insert_params(book_key, book_data, revision):
+    """This method returns the values of INSERT_QUERY for a record. """
+    return (book_key,) + tuple(book_data.get_as_list()) + (revision, book_data.get_content_hash())
+
+
+def escape_like(text):
+    """This method escapes the wildcards of LIKE in a text with the escape character of LIKE_ESCAPE. """
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+def get_isbn_condition(value):
+    """This method returns the column and the value to look up an ISBN criteria value.
+    A valid ISBN is looked up by its key on the primary key, whichever way it is written.
+    Other text can only match a record kept with an invalid ISBN, found by the index on the ISBN. """
+    try:
+        return 'book_key', int(normalize_isbn(value))
+    except ValueError:
+        return 'book_ISBN', value
+
+
+def build_search_criteria(book_data):
+    """This method builds the WHERE clause for the search criteria passed as a DTO.
+    A criteria value can be a text, found as it is, a text ending with "*", found as a prefix with LIKE,
+    or a list or tuple of texts, any of which is found with IN.
+    It returns the clause with a %s placeholder for each value, and the tuple of values.
+    The clause is empty when no criteria is given. """
+    conditions = []
+    params = []
+    # Check if the attribute is present in the criteria and add a condition for it.
+    for field in SEARCH_FIELDS:
+        value = getattr(book_data, field)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            # Surrounding spaces are ignored and repeated values are only looked up once.
+            values = list(dict.fromkeys(str(item).strip() for item in value if str(item).strip() != ''))
+            if not values:
+                continue
+            column = field
+            if field == 'book_ISBN':
+                # The valid ISBNs are found by their keys only when all of them are valid, so that one IN covers all.
+                lookups = [get_isbn_condition(item) for item in values]
+                if all(lookup[0] == 'book_key' for lookup in lookups):
+                    column = 'book_key'
+                    values = [lookup[1] for lookup in lookups]
+                else:
+                    values = [item if lookup[0] == 'book_ISBN' else normalize_isbn(item)
+                              for item, lookup in zip(values, lookups)]
+            conditions.append(column + ' IN (' + ', '.join(['%s'] * len(values)) + ')')
+            params.extend(values)
+            continue
+        prefix = get_prefix(value, field)
+        if prefix is not None:
+            # A lone wildcard matches every record, so it is no criteria at all.
+            if prefix == '':
+                continue
+            conditions.append(field + LIKE_ESCAPE)
+            params.append(escape_like(prefix) + '%')
+            continue
+        # Surrounding spaces are ignored, like in the cache key of the search.
+        value = str(value).strip()
+        if value == '':
+            continue
+        if field == 'book_ISBN':
+            column, value = get_isbn_condition(value)
+            conditions.append(column + ' = %s')
+            params.append(value)
+        else:
+            conditions.append(field + ' = %s')
+            params.append(value)
+    if not conditions:
+        return '', ()
+    # Join the conditions with "AND" between criteria
+    return ' WHERE ' + ' AND '.join(conditions), tuple(params)
+
+
+class BookRepository:
+    """This class contains the methods to store and read book records which do not depend on the database.
+    A subclass per storage backend provides the connections, the error classes of the driver and the parts of
+    SQL which differ between databases. The queries here are written with %s placeholders, which format_query
+    turns into the placeholder style of the backend. """
+
+    # Base class of the errors raised by the database driver.
+    Error = Exception
+    # Placeholder for a value in a query, in the style of the database driver.
+    placeholder = '%s'
+    # Name of the backend as used in the configuration.
+    backend_name = None
+    # Statement which returns the query plan of the query appended to it.
+    explain_prefix = 'EXPLAIN '
+    # Statement which adds to the count of a (kind, value) of the summary table, creating its row if needed.
+    stats_upsert_query = None
+    # Statement with the values of INSERT_QUERY which inserts a record, or updates the record with the same key.
+    merge_upsert_query = None
+    # Indexes of the books table other than the primary key, as (drop statement, create statement) pairs.
+    # A pair without a drop statement is only run when the indexes are created, after the others.
+    secondary_indexes = ()
+    # Query which returns the estimated number of records from the statistics kept by the database,
+    # without counting the rows of the books table.
+    estimate_count_query = None
+
+    def __init__(self, pool=None, cache=None):
+        """This is the constructor method. It borrows a connection instance from the connection pool.
+        The process-wide pool and query cache of the database are used unless others are passed. """
+        self.pool = pool if pool is not None else self.get_default_pool()
+        self.cache = cache if cache is not None else get_cache(self.schema_key())
+        self.connection = None
+        # Timings of the operations, shared by all handlers of the process.
+        self.instrumentation = get_instrumentation()
+        self.instrumentation.watch('cache', self.cache.get_stats)
+        self.instrumentation.watch('pool', self.pool.get_stats)
+        # Number of errors this handler reported. The instrumentation uses it to count the failed calls.
+        self.error_count = 0
+        # Counts per genre and per writer of the records inserted during a bulk load, None outside of one.
+        self.bulk_stats = None
+        # Slow queries waiting to be written to the slow-query log with their query plan, as
+        # (query, values, duration) tuples. The plan is read once the operation which ran them is over.
+        self.pending_slow_queries = []
+        try:
+            # Borrow the connection as a class level variable. The pool reuses connections that are
+            # already open, so the connection is not set up again for every action.
+            self.borrow_connection()
+            # Bring the schema up to date. This runs the migrations only for the first handler of the process.
+            self.create_book_table()
+            self.log_pending_slow_queries()
+
+        # Handle exception if connectivity fails
+        except self.Error as e:
+            self.report_error("Error while connecting to database", e)
+
+    def get_default_pool(self):
+        """This method returns the process-wide connection pool of the database. """
+        raise NotImplementedError
+
+    def schema_key(self):
+        """This method returns a key which identifies the database, used to share pools, caches and schema state. """
+        raise NotImplementedError
+
+    def migrate_schema(self):
+        """This method applies the pending schema migrations of the backend and returns the schema version. """
+        raise NotImplementedError
+
+    def is_duplicate_error(self, error):
+        """This method tells whether an error of the driver was raised because the primary key already exists. """
+        raise NotImplementedError
+
+    def build_keyword_query(self, keywords, limit):
+        """This method returns the query and values of a keyword search, ranked by relevance. """
+        raise NotImplementedError
+
+    def is_existing_index_error(self, error):
+        """This method tells whether an error of the driver was raised because an index already exists. """
+        raise NotImplementedError
+
+    def format_query(self, query):
+        """This method turns the %s placeholders of a query into the placeholder style of the backend. """
+        if self.placeholder == '%s':
+            return query
+        return query.replace('%s', self.placeholder)
+
+    def get_prepared_cursor(self, query):
+        """This method returns a cursor to execute a query which is run often.
+        A backend can keep prepared statements per connection. By default a new cursor is returned. """
+        self.ensure_connection()
+        return self.connection.cursor()
+
+    def release_prepared_cursor(self, query, cursor):
+        """This method is called when a cursor of get_prepared_cursor is no longer used. """
+        cursor.close()
+
+    def forget_prepared_cursor(self, query, cursor):
+        """This method is called when a query of get_prepared_cursor failed, so the cursor is not reused. """
+        try:
+            cursor.close()
+        except self.Error:
+            pass
+
+    def ensure_connection(self):
+        """This method borrows a connection from the pool if this instance does not hold one.
+        The pool checks the health of the connection before handing it out. """
+        if self.connection is None:
+            self.borrow_connection()
+
+    def borrow_connection(self):
+        """This method borrows a connection from the pool and records the time spent waiting for it. """
+        started = time.perf_counter()
+        try:
+            self.connection = self.pool.get_connection()
+        except Exception:
+            self.instrumentation.record_acquire(time.perf_counter() - started, failed=True)
+            raise
+        self.instrumentation.record_acquire(time.perf_counter() - started)
+
+    def execute_query(self, cursor, query, params=(), many=False):
+        """This method executes a query on the cursor and writes it to the slow-query log if it is too slow.
+        With many set, params is a list of value tuples executed with executemany. """
+        started = time.perf_counter()
+        if many:
+            cursor.executemany(query, params)
+        else:
+            cursor.execute(query, params)
+        duration = time.perf_counter() - started
+        if not self.instrumentation.is_slow(duration):
+            return
+        if self.instrumentation.explain_slow_queries and not many:
+            # The connection cannot run the EXPLAIN while the caller has not fetched the rows of the query,
+            # so the query is logged with its plan by log_pending_slow_queries once the operation is over.
+            self.pending_slow_queries.append((query, params, duration))
+        else:
+            self.instrumentation.log_slow_query(self.backend_name, query, params if not many else (),
+                                                duration, len(params) if many else None)
+
+    def log_pending_slow_queries(self):
+        """This method writes the slow queries waiting for their query plan to the slow-query log.
+        It is called when a handler operation is over, once its cursors are closed and no rows are left unread. """
+        while self.pending_slow_queries:
+            query, params, duration = self.pending_slow_queries.pop(0)
+            plan = self.explain_query(query, params) if self.connection is not None else None
+            self.instrumentation.log_slow_query(self.backend_name, query, params, duration, None, plan)
+
+    def explain_query(self, query, params=()):
+        """This method returns the query plan of the database for a query as a list of text lines.
+        It returns None if the plan cannot be read, as the plan is only extra detail for the slow-query log. """
+        cursor = None
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute(self.explain_prefix + query, params)
+            return [', '.join(str(value) for value in row) for row in cursor.fetchall()]
+        except self.Error:
+            return None
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except self.Error:
+                    pass
+
+    def report_error(self, message, error):
+        """This method reports an error which was handled by the handler itself, so it counts as a failed call. """
+        print(message, error)
+        self.error_count += 1
+
+    def close_connection(self):
+        """This method returns the connection instance in the class to the connection pool. """
+        # The connection is kept open by the pool so that the next handler can reuse it.
+        if self.connection is not None:
+            self.log_pending_slow_queries()
+            self.pool.release_connection(self.connection)
+            self.connection = None
+
+    def add_insert_listener(self, listener):
+        """This method registers a method to be called with the list of DTOs of the records inserted into the
+        database of this handler, by any handler of the process, after they are committed.
+        The records updated by a merge are passed too, with their flag set to "updated". """
+        with _insert_listeners_lock:
+            _insert_listeners.setdefault(self.schema_key(), []).append(listener)
+
+    def remove_insert_listener(self, listener):
+        """This method unregisters a method of add_insert_listener. """
+        with _insert_listeners_lock:
+            listeners = _insert_listeners.get(self.schema_key(), [])
+            if listener in listeners:
+                listeners.remove(listener)
+
+    def books_inserted(self, books):
+        """This method is called with the DTOs of the records committed by an insert.
+        It drops the cached results which the records change and calls the insert listeners. """
+        self.cache.invalidate_books(books)
+        with _insert_listeners_lock:
+            listeners = list(_insert_listeners.get(self.schema_key(), ()))
+        for listener in listeners:
+            listener(books)
+
+    def create_book_table(self):
+        """This method makes sure that the required tables and indexes exist in database.
+        The versioned migrations of the schema module are applied once per process,
+        so later calls return without a database call. """
+        # Make sure that a connection is held.
+        self.ensure_connection()
+        # Return true when the schema is up to date and false on failure
+        return ensure_schema(self)
+
+    @instrumented('insert_book')
+    def insert_book_to_db(self, book_data):
+        """This method handles inserting a new record into database.
+        It takes a DTO as input which contains the required details for the record. """
+        # Check that the data been passed as input is a new record to be inserted into database.
+        if book_data.store_flag == "new":
+            # Set the insertion query as a variable.
+            # Use placeholders for the values.
+            # The values will be passed with a parameter to the cursor.execute method as a tuple.
+            # This way, SQL injection will be avoided by passing the values through the driver method.
+            insert_query = self.format_query(INSERT_QUERY)
+            # The ISBN is stored in its ISBN-13 form, so that the same book is a duplicate however it is written.
+            try:
+                book_key = normalize_book_isbn(book_data)
+            except ValueError as e:
+                print("Error while inserting record - invalid ISBN", e)
+                book_data.store_flag = "invalid"
+                return book_data
+
+            # Always call the create_book_table method to create the table.
+            # It only reaches the database the first time in the process.
+            if self.create_book_table():
+                # Get cursor instance.
+                cursor = self.connection.cursor()
+                # Enclose the database call within try and except
+                try:
+                    # Execute the insert query
+                    # Pass the values as a parameter
+                    revision = self.next_revision(cursor)
+                    self.execute_query(cursor, insert_query, get_insert_params(book_key, book_data, revision))
+                    # Count the record in the summary table, in the same transaction as the record itself.
+                    self.update_book_stats(cursor, [book_data])
+                    # Remember to commit if successful
+                    self.connection.commit()
+                    # Set the flag in the DTO to indicate that storing was successful
+                    book_data.store_flag = "inserted"
+                    # Drop the cached results which the new record changes and tell the listeners
+                    self.books_inserted([book_data])
+                except self.Error as e:
+                    # End the failed transaction before the connection is used again.
+                    self.connection.rollback()
+                    # Check for duplicate record.
+                    # Checking through database failure is cheaper as we can check with single database call.
+                    if self.is_duplicate_error(e):
+                        print("Error while inserting record - duplicate record", e)
+                        # Set the flag in DTO to indicate failure due to duplicate record.
+                        book_data.store_flag = "duplicate"
+                    else:
+                        # For other errors, set the DTO flag as normal failure.
+                        # If further specific failures need to be captured, the best way would be to check
+                        # the error and handle like duplicate record block.
+                        self.report_error("Error while inserting record", e)
+                        book_data.store_flag = "insert failed"
+                finally:
+                    # Close the cursor
+                    cursor.close()
+            else:
+                # Set flag in DTO if creation of table itself had failed.
+                book_data.store_flag = "create failed"
+        # Return the DTO with the flag set
+        return book_data
+
+    @instrumented('insert_books')
+    def insert_books_to_db(self, books, batch_size=1000):
+        """This method handles inserting many new records into database.
+        It takes an iterable of DTOs and works as a generator. The records are grouped in batches which are
+        inserted with a single multi-row statement and a single commit per batch.
+        Each DTO is yielded back in the same order with its flag set, as insert_book_to_db does for one record.
+        Only one batch is held in memory at a time, so the input can be a stream of any length. """
+        # Create the table once for the whole import rather than once per record.
+        if not self.create_book_table():
+            for book_data in books:
+                if book_data.store_flag == "new":
+                    book_data.store_flag = "create failed"
+                yield book_data
+            return
+
+        batch = []
+        for book_data in books:
+            batch.append(book_data)
+            if len(batch) >= batch_size:
+                yield from self._insert_batch(batch)
+                batch = []
+        # Insert whatever is left after the last full batch.
+        if batch:
+            yield from self._insert_batch(batch)
+
+    def find_existing_keys(self, cursor, book_keys):
+        """This method returns the set of the given keys which are already stored.
+        The keys are looked up with as few IN queries as the limits of the backend allow. """
+        existing_keys = set()
+        for start in range(0, len(book_keys), MAX_IN_VALUES):
+            chunk = book_keys[start:start + MAX_IN_VALUES]
+            placeholders = ', '.join([self.placeholder] * len(chunk))
+            self.execute_query(cursor, "SELECT book_key FROM books WHERE book_key IN (" + placeholders + ")",
+                               tuple(chunk))
+            existing_keys.update(row[0] for row in cursor.fetchall())
+        return existing_keys
+
+    def _insert_batch(self, batch):
+        """This method inserts one batch of DTOs for insert_books_to_db and returns the batch with flags set.
+        Records already present in the table or repeated within the batch are flagged as duplicate,
+        and records whose ISBN is not valid are flagged as invalid. """
+        # Only the records marked as new are inserted. Others are passed back untouched.
+        keyed_books = []
+        for book_data in batch:
+            if book_data.store_flag == "new":
+                try:
+                    keyed_books.append((normalize_book_isbn(book_data), book_data))
+                except ValueError:
+                    book_data.store_flag = "invalid"
+        if not keyed_books:
+            return batch
+        insert_query = self.format_query(INSERT_QUERY)
+        cursor = self.connection.cursor()
+        try:
+            # A duplicate key would fail the whole multi-row insert.
+            # So find the keys which are already stored with one query for the batch.
+            existing_keys = self.find_existing_keys(cursor, [book_key for book_key, book_data in keyed_books])
+            books_to_insert = []
+            insert_keys = []
+            for book_key, book_data in keyed_books:
+                if book_key in existing_keys:
+                    book_data.store_flag = "duplicate"
+                else:
+                    # Remember the key so that a repeat later in the same batch is caught as well.
+                    existing_keys.add(book_key)
+                    books_to_insert.append(book_data)
+                    insert_keys.append(book_key)
+            if books_to_insert:
+                # The records of the batch are one change, with one revision.
+                revision = self.next_revision(cursor)
+                insert_params = [get_insert_params(book_key, book_data, revision)
+                                 for book_key, book_data in zip(insert_keys, books_to_insert)]
+                # One executemany for the whole batch. MySQL rewrites it into a single statement
+                # with one VALUES list per record.
+                self.execute_query(cursor, insert_query, insert_params, many=True)
+                self.update_book_stats(cursor, books_to_insert)
+            # One commit for the whole batch.
+            self.connection.commit()
+            for book_data in books_to_insert:
+                book_data.store_flag = "inserted"
+            # Drop the cached results which the new records change and tell the listeners
+            self.books_inserted(books_to_insert)
+        except self.Error as e:
+            # The batch failed as a whole, e.g. because of a value too long for a column.
+            # Roll back and insert the batch one record at a time so that each record gets its own outcome.
+            self.report_error("Error while inserting batch, retrying record by record", e)
+            self.connection.rollback()
+            for book_key, book_data in keyed_books:
+                book_data.store_flag = "new"
+                self.insert_book_to_db(book_data)
+        finally:
+            cursor.close()
+        return batch
+
+    @instrumented('merge_books')
+    def merge_books_to_db(self, books, batch_size=1000, skip_unchanged=True):
+        """This method handles merging many records into database, e.g. an updated catalogue feed.
+        A record whose ISBN is not stored yet is inserted and a stored one is updated with the details passed.
+        It takes an iterable of DTOs and works as a generator, like insert_books_to_db. Each batch takes one query
+        to read the hashes of the stored records, one upsert statement and a single commit.
+        With skip_unchanged, the records whose details are the same as stored are not written at all.
+        Each DTO is yielded back in the same order with its flag set to inserted, updated or unchanged,
+        or to invalid or duplicate for the records which were not merged. """
+        # Create the table once for the whole merge rather than once per record.
+        if not self.create_book_table():
+            for book_data in books:
+                if book_data.store_flag == "new":
+                    book_data.store_flag = "create failed"
+                yield book_data
+            return
+
+        batch = []
+        for book_data in books:
+            batch.append(book_data)
+            if len(batch) >= batch_size:
+                yield from self._merge_batch(batch, skip_unchanged)
+                batch = []
+        # Merge whatever is left after the last full batch.
+        if batch:
+            yield from self._merge_batch(batch, skip_unchanged)
+
+    def find_stored_books(self, cursor, book_keys):
+        """This method returns the hash, name, writer and genre of the given keys which are already stored,
+        as a dictionary by key. The keys are looked up with as few IN queries as the limits of the backend allow. """
+        stored_books = {}
+        for start in range(0, len(book_keys), MAX_IN_VALUES):
+            chunk = book_keys[start:start + MAX_IN_VALUES]
+            placeholders = ', '.join([self.placeholder] * len(chunk))
+            self.execute_query(cursor, "SELECT book_key, book_hash, book_name, book_writer, book_genre FROM books "
+                                       "WHERE book_key IN (" + placeholders + ")", tuple(chunk))
+            stored_books.update((row[0], row[1:]) for row in cursor.fetchall())
+        return stored_books
+
+    def get_stored_hashes(self, book_keys):
+        """This method returns the content hash of the given keys which are already stored, as a dictionary by key.
+        It returns what could be read, nothing if reading failed. """
+        stored_hashes = {}
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            stored_hashes = {book_key: stored_book[0]
+                             for book_key, stored_book in self.find_stored_books(cursor, book_keys).items()}
+        except self.Error as e:
+            self.report_error("Error while reading stored records", e)
+        finally:
+            cursor.close()
+        return stored_hashes
+
+    def _merge_batch(self, batch, skip_unchanged):
+        """This method merges one batch of DTOs for merge_books_to_db and returns the batch with flags set.
+        A record repeated within the batch is flagged as duplicate, and only its last occurrence is merged. """
+        # Only the records marked as new are merged. Others are passed back untouched.
+        keyed_books = {}
+        for book_data in batch:
+            if book_data.store_flag == "new":
+                try:
+                    book_key = normalize_book_isbn(book_data)
+                except ValueError:
+                    book_data.store_flag = "invalid"
+                    continue
+                if book_key in keyed_books:
+                    keyed_books[book_key].store_flag = "duplicate"
+                keyed_books[book_key] = book_data
+        if not keyed_books:
+            return batch
+        cursor = self.connection.cursor()
+        try:
+            # Read what is stored for the keys of the batch with one query, to tell the new records from the
+            # stored ones, and the changed ones from the unchanged ones.
+            stored_books = self.find_stored_books(cursor, list(keyed_books))
+            merged_keys = []
+            # Records inserted, records updated and the records before they were updated, for the counts per
+            # genre and per writer.
+            inserted_books = []
+            updated_books = []
+            replaced_books = []
+            for book_key, book_data in keyed_books.items():
+                stored_book = stored_books.get(book_key)
+                if stored_book is None:
+                    inserted_books.append(book_data)
+                elif skip_unchanged and stored_book[0] == book_data.get_content_hash():
+                    book_data.store_flag = "unchanged"
+                    continue
+                else:
+                    updated_books.append(book_data)
+                    replaced_book = BookDTO()
+                    replaced_book.book_ISBN = book_data.book_ISBN
+                    replaced_book.book_name, replaced_book.book_writer, replaced_book.book_genre = stored_book[1:]
+                    replaced_books.append(replaced_book)
+                merged_keys.append(book_key)
+            if merged_keys:
+                # The records of the batch are one change, with one revision.
+                revision = self.next_revision(cursor)
+                self.execute_query(cursor, self.format_query(self.merge_upsert_query),
+                                   [get_insert_params(book_key, keyed_books[book_key], revision)
+                                    for book_key in merged_keys], many=True)
+                self.update_book_stats(cursor, inserted_books + updated_books, replaced_books)
+            # One commit for the whole batch.
+            self.connection.commit()
+            for book_data in inserted_books:
+                book_data.store_flag = "inserted"
+            for book_data in updated_books:
+                book_data.store_flag = "updated"
+            # Drop the cached results which the records change, as they were and as they are now,
+            # and tell the listeners about the new and the updated records.
+            self.cache.invalidate_books(replaced_books)
+            self.books_inserted(inserted_books + updated_books)
+        except self.Error as e:
+            # The batch failed as a whole, e.g. because of a value too long for a column.
+            # Roll back and merge the batch one record at a time so that each record gets its own outcome.
+            self.connection.rollback()
+            if len(keyed_books) == 1:
+                self.report_error("Error while merging record", e)
+                for book_data in keyed_books.values():
+                    book_data.store_flag = "merge failed"
+            else:
+                self.report_error("Error while merging batch, retrying record by record", e)
+                for book_data in keyed_books.values():
+                    book_data.store_flag = "new"
+                    self._merge_batch([book_data], skip_unchanged)
+        finally:
+            cursor.close()
+        return batch
+
+    def next_revision(self, cursor):
+        """This method takes the revision of the change made by the current transaction and returns it.
+        It locks the revision row until the transaction ends, so it is called just before the records are
+        written, to keep the lock short. During a bulk load, the pending revision is returned instead,
+        so that parallel loads do not wait for each other on the revision row. """
+        if self.bulk_stats is not None:
+            return PENDING_REVISION
+        self.execute_query(cursor, "UPDATE book_revision SET revision = revision + 1")
+        self.execute_query(cursor, "SELECT revision FROM book_revision")
+        return cursor.fetchone()[0]
+
+    def get_change_token(self):
+        """This method returns the token of the changes made so far, to pass to get_changes_since later.
+        Reading the token before reading records means that any change made while they are read is returned by
+        get_changes_since, possibly together with records already read. """
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            self.execute_query(cursor, "SELECT revision FROM book_revision")
+            return encode_change_token(cursor.fetchone()[0])
+        finally:
+            cursor.close()
+
+    @instrumented('get_changes')
+    def get_changes_since(self, change_token, limit=1000):
+        """This method returns the records changed after the change token, in order of change, as a result set,
+        together with the token to pass to the next call and whether more changes are waiting.
+        The changes are found on the index of the revision, so the time taken depends on the number of changes,
+        not on the number of records. They bypass the cache, as they are read to find what the cache missed.
+        Errors are raised to the caller, who asks again with the same token later. """
+        revision, book_key = decode_change_token(change_token)
+        changes_query = "SELECT book_ISBN, book_name, book_writer, book_genre, book_revision, book_key FROM books " \
+                        "WHERE book_revision > %s OR (book_revision = %s AND book_key > %s) " \
+                        "ORDER BY book_revision, book_key LIMIT %s"
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            # Ask for one record more than the limit to know whether more changes are waiting.
+            self.execute_query(cursor, self.format_query(changes_query), (revision, revision, book_key, limit + 1))
+            # The result set keeps the first four columns.
+            changes = BookResultSet([i[0] for i in cursor.description[:4]])
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        for row in rows[:limit]:
+            changes.append(row)
+            revision, book_key = row[4], row[5]
+        # The token of the last change returned, so the next call starts right after it.
+        return changes, encode_change_token(revision, book_key), len(rows) > limit
+
+    def update_book_stats(self, cursor, books, removed_books=()):
+        """This method adds records passed as DTOs to the counts per genre and per writer of the summary table,
+        and takes removed_books off them, e.g. the records as they were before an update.
+        It is called in the transaction which writes the records, so the counts are committed with them.
+        During a bulk load, the counts are gathered in memory instead and written by finish_bulk_load. """
+        counts = {} if self.bulk_stats is None else self.bulk_stats
+        for change, changed_books in ((1, books), (-1, removed_books)):
+            for book_data in changed_books:
+                for stat_kind, field in STATS_FIELDS:
+                    stat_key = (stat_kind, getattr(book_data, field))
+                    counts[stat_key] = counts.get(stat_key, 0) + change
+        if self.bulk_stats is None:
+            self.add_book_stats(cursor, counts)
+
+    def add_book_stats(self, cursor, counts):
+        """This method adds counts given as a dictionary of (kind, value) to number of records to the summary
+        table, in the transaction of the cursor. """
+        if not counts:
+            return
+        # Update the rows in a fixed order, so that two inserts never lock the same rows the other way round.
+        params = sorted(((stat_kind, stat_value, count) for (stat_kind, stat_value), count in counts.items()),
+                        key=lambda param: (param[0], param[1].casefold()))
+        self.execute_query(cursor, self.format_query(self.stats_upsert_query), params, many=True)
+
+    def start_bulk_load(self):
+        """This method puts the handler in bulk load mode, for loading many records from several processes at once.
+        The records inserted get the pending revision and their counts per genre and per writer are gathered in
+        memory, so the transactions of the processes do not wait for each other on the shared rows of the revision
+        and the summary table. The records are only seen as changes once finish_bulk_load is called. """
+        self.bulk_stats = {}
+
+    def take_bulk_stats(self):
+        """This method returns the counts gathered during a bulk load since the last call and starts new counts. """
+        bulk_stats, self.bulk_stats = self.bulk_stats, {}
+        return bulk_stats
+
+    def finish_bulk_load(self, counts):
+        """This method ends a bulk load by any number of processes. In one transaction, it gives every record with
+        the pending revision a new revision and adds the counts gathered by the processes to the summary table.
+        It also finishes a bulk load which was interrupted, so calling it again is harmless.
+        It returns the revision of the records loaded. Errors are raised to the caller. """
+        self.bulk_stats = None
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            revision = self.next_revision(cursor)
+            self.execute_query(cursor, self.format_query("UPDATE books SET book_revision = %s "
+                                                         "WHERE book_revision = %s"), (revision, PENDING_REVISION))
+            self.add_book_stats(cursor, counts)
+            self.connection.commit()
+        except self.Error:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        # The records were loaded by other processes, so drop every result read before.
+        self.cache.clear()
+        return revision
+
+    def drop_secondary_indexes(self):
+        """This method drops the indexes other than the primary key, so that a bulk load does not update them
+        record by record. create_secondary_indexes builds them again in one pass each. """
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            for drop_statement, create_statement in self.secondary_indexes:
+                if drop_statement is None:
+                    continue
+                try:
+                    self.execute_query(cursor, drop_statement)
+                except self.Error as e:
+                    # The index is already dropped, e.g. by a bulk load which was interrupted.
+                    print("Skipping", drop_statement, "-", e)
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+    def create_secondary_indexes(self):
+        """This method builds the indexes dropped by drop_secondary_indexes again. An index which exists already
+        is left as it is, so calling it again is harmless. """
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            for drop_statement, create_statement in self.secondary_indexes:
+                try:
+                    self.execute_query(cursor, create_statement)
+                except self.Error as e:
+                    if drop_statement is None or not self.is_existing_index_error(e):
+                        raise
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+    def rebuild_book_stats(self):
+        """This method counts the records per genre and per writer again from the books table,
+        e.g. after records were changed by other means than the handlers. It returns the number of rows of the
+        summary table. Errors are raised to the caller, as the old counts are kept when the rebuild fails. """
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            # Replace the counts in one transaction, so readers see either the old or the new counts.
+            self.execute_query(cursor, "DELETE FROM book_stats")
+            self.execute_query(cursor, REBUILD_GENRE_STATS)
+            self.execute_query(cursor, REBUILD_WRITER_STATS)
+            self.execute_query(cursor, "SELECT COUNT(*) FROM book_stats")
+            row_count = cursor.fetchone()[0]
+            self.connection.commit()
+        except self.Error:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        # Drop the counts read before the rebuild.
+        self.cache.clear()
+        return row_count
+
+    @instrumented('book_stats')
+    def get_book_stats(self, stat_kind, limit=None):
+        """This method returns the number of records per genre or per writer, as selected by stat_kind
+        ("genre" or "writer"), as a list of (value, count) pairs with the largest counts first.
+        The counts are read from the summary table, so the time taken depends on the number of genres or writers,
+        not on the number of records. """
+        if stat_kind not in dict(STATS_FIELDS):
+            raise ValueError('Unknown statistics: ' + str(stat_kind))
+        # Answer from the cache if the same counts were read recently. The inserts drop them from the cache.
+        cache_key = ('stats', stat_kind, limit)
+        cached_stats = self.cache.get(cache_key)
+        if cached_stats is not None:
+            return cached_stats
+        stats_query = "SELECT stat_value, book_count FROM book_stats WHERE stat_kind = %s AND book_count > 0 " \
+                      "ORDER BY book_count DESC, stat_value"
+        params = (stat_kind,)
+        if limit is not None:
+            stats_query += " LIMIT %s"
+            params += (limit,)
+        book_stats = []
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            self.execute_query(cursor, self.format_query(stats_query), params)
+            book_stats = [(row[0], row[1]) for row in cursor.fetchall()]
+            self.cache.put(cache_key, book_stats, len(book_stats))
+        except self.Error as e:
+            self.report_error("Error while reading statistics", e)
+        finally:
+            cursor.close()
+        return book_stats
+
+    @instrumented('count_books')
+    def count_books(self, book_data=None):
+        """This method returns the exact number of records matching the search criteria passed as a DTO,
+        or of all records without criteria. The rows are counted by the database, which uses the primary key or
+        an index for the criteria, so no record is transferred. It returns None if the count failed. """
+        cache_key = make_count_key(book_data)
+        cached_count = self.cache.get(cache_key)
+        if cached_count is not None:
+            return cached_count
+        where_clause, params = build_search_criteria(book_data) if book_data is not None else ('', ())
+        count_query = self.format_query("SELECT COUNT(*) FROM books" + where_clause)
+        book_count = None
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            self.execute_query(cursor, count_query, params)
+            book_count = cursor.fetchone()[0]
+            self.cache.put(cache_key, book_count, 1)
+        except self.Error as e:
+            self.report_error("Error while counting records", e)
+        finally:
+            cursor.close()
+        return book_count
+
+    @instrumented('estimate_books')
+    def estimate_book_count(self):
+        """This method returns the estimated number of all records, read from the statistics of the database
+        instead of counting the rows, so it takes the same short time however large the table is.
+        The estimate is kept for COUNT_ESTIMATE_TTL seconds. It returns None if it could not be read. """
+        cache_key = ('estimate',)
+        cached_count = self.cache.get(cache_key)
+        if cached_count is not None:
+            return cached_count
+        book_count = None
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        try:
+            self.execute_query(cursor, self.format_query(self.estimate_count_query))
+            row = cursor.fetchone()
+            # The statistics are missing until the database gathered them the first time.
+            book_count = int(row[0]) if row is not None and row[0] is not None else 0
+            self.cache.put(cache_key, book_count, 1, dbconfig.COUNT_ESTIMATE_TTL)
+        except self.Error as e:
+            self.report_error("Error while estimating the number of records", e)
+        finally:
+            cursor.close()
+        return book_count
+
+    def get_all_books(self):
+        """This method handles retrieving the first page of records in the database table.
+        Use get_books_page or iter_book_pages to reach the records after the first page.
+        It is not instrumented itself, as the read is recorded as get_books_page. """
+        # Return the result set of the first page
+        all_books, next_page_token = self.get_books_page()
+        return all_books
+
+    @instrumented('get_books_page')
+    def get_books_page(self, page_token=None, page_size=500, fetch_size=100):
+        """This method handles retrieving one page of records ordered by key, which is the order of the ISBN-13.
+        It returns the result set of the page and the token for the next page.
+        The token is None when there are no more records.
+        The page is found by seeking past the last key of the previous page on the primary key
+        instead of skipping rows with OFFSET, so a deep page is as fast as the first one. """
+        # Answer from the cache if the same page was read recently
+        cache_key = ('page', page_token, page_size)
+        cached_page = self.cache.get(cache_key)
+        if cached_page is not None:
+            return cached_page
+        # Create a result set for the records. It stays empty if reading fails.
+        all_books = BookResultSet()
+        # Ask for one record more than the page size to know whether a next page exists.
+        params = (page_size + 1,)
+        # The key is read last, only to make the token of the next page.
+        if page_token is None:
+            page_query = "SELECT book_ISBN, book_name, book_writer, book_genre, book_key FROM books " \
+                         "ORDER BY book_key LIMIT %s"
+        else:
+            page_query = "SELECT book_ISBN, book_name, book_writer, book_genre, book_key FROM books " \
+                         "WHERE book_key > %s ORDER BY book_key LIMIT %s"
+            params = (decode_page_token(page_token),) + params
+        next_page_token = None
+        # Get the cursor instance
+        self.ensure_connection()
+        cursor = self.connection.cursor()
+        # Enclose the database call within try and except
+        try:
+            # Execute the query
+            self.execute_query(cursor, self.format_query(page_query), params)
+            # Keep the field names of the result as the column names of the result set.
+            all_books = BookResultSet([i[0] for i in cursor.description[:4]])
+            last_key = None
+            # Read the records in chunks rather than all at once
+            rows = cursor.fetchmany(fetch_size)
+            while rows:
+                for row in rows:
+                    if len(all_books) == page_size:
+                        # This is the extra record. It only tells that there is a next page.
+                        next_page_token = encode_page_token(last_key)
+                        break
+                    # The result set keeps the first four columns.
+                    all_books.append(row)
+                    last_key = row[4]
+                rows = cursor.fetchmany(fetch_size)
+            # Keep the page in the cache for the next read
+            self.cache.put(cache_key, (all_books, next_page_token), len(all_books))
+        except self.Error as e:
+            # Catch exception
+            self.report_error("Error while reading data", e)
+        finally:
+            cursor.close()
+        # Return the result set and the token for the next page
+        return all_books, next_page_token
+
+    def iter_book_pages(self, page_token=None, page_size=500):
+        """This method works as a generator yielding the pages of records one at a time,
+        as (result set, token of the next page) pairs. Only the current page is held in memory. """
+        while True:
+            all_books, page_token = self.get_books_page(page_token, page_size)
+            yield all_books, page_token
+            if page_token is None:
+                break
+
+    def get_streaming_cursor(self):
+        """This method returns a cursor which reads the records of a large result from the server as they are
+        fetched, instead of all at once when the query is executed. By default a plain cursor is returned. """
+        return self.connection.cursor()
+
+    def close_streaming_cursor(self, cursor):
+        """This method closes a cursor of get_streaming_cursor, also when not every record was fetched. """
+        cursor.close()
+
+    @instrumented('stream_books')
+    def stream_books(self, book_data=None, fetch_size=1000):
+        """This method works as a generator yielding the records matching the search criteria in chunks,
+        each a list of up to fetch_size (ISBN, name, writer, genre) tuples. All records are read without criteria.
+        The records are read through a streaming cursor and bypass the cache, so only one chunk is held in
+        memory however many records there are. Errors are raised to the caller, as a partial result is of no use. """
+        where_clause, params = build_search_criteria(book_data) if book_data is not None else ('', ())
+        stream_query = self.format_query("SELECT book_ISBN, book_name, book_writer, book_genre FROM books"
+                                         + where_clause)
+        self.ensure_connection()
+        cursor = self.get_streaming_cursor()
+        try:
+            self.execute_query(cursor, stream_query, params)
+            rows = cursor.fetchmany(fetch_size)
+            while rows:
+                yield [(str(row[0]), row[1], row[2], row[3]) for row in rows]
+                rows = cursor.fetchmany(fetch_size)
+        finally:
+            self.close_streaming_cursor(cursor)
+
+    @instrumented('keyword_search')
+    def keyword_search_on_db(self, keywords, limit=100):
+        """This method handles retrieving the records whose name or writer contain the keywords,
+        most relevant first. It uses the full-text index on name and writer instead of scanning the table.
+        It returns a result set, like the other read methods. """
+        # Answer from the cache if the same keywords were searched recently
+        cache_key = ('keyword', ' '.join(keywords.casefold().split()), limit)
+        cached_books = self.cache.get(cache_key)
+        if cached_books is not None:
+            return cached_books
+        # Create a result set for the records. It stays empty if reading fails.
+        all_books = BookResultSet()
+        keyword_query, params = self.build_keyword_query(keywords, limit)
+        # Enclose the database call within try and except
+        cursor = None
+        try:
+            # Get the prepared cursor instance for the query
+            cursor = self.get_prepared_cursor(keyword_query)
+            self.execute_query(cursor, keyword_query, params)
+            # Keep the field names of the result as the column names of the result set.
+            all_books = BookResultSet([i[0] for i in cursor.description])
+            all_books.extend(cursor.fetchall())
+            self.release_prepared_cursor(keyword_query, cursor)
+            # Keep the result in the cache for the next search
+            self.cache.put(cache_key, all_books, len(all_books))
+        except self.Error as e:
+            # Catch exception and drop the cursor
+            self.report_error("Error while reading data", e)
+            if cursor is not None:
+                self.forget_prepared_cursor(keyword_query, cursor)
+        # Return the result set
+        return all_books
+
+    @instrumented('search_book')
+    def search_book_on_db(self, book_data):
+        """This method handles retrieving records matching the search criteria.
+        The search criteria is passed as a DTO and the records are returned as a result set. """
+        # Answer from the cache if the same criteria were searched recently
+        cache_key = make_search_key(book_data)
+        cached_books = self.cache.get(cache_key)
+        if cached_books is not None:
+            return cached_books
+        # Create a result set for the records. It stays empty if reading fails.
+        all_books = BookResultSet()
+        # Create the query as a variable. The values are passed separately from the query text,
+        # so they can never change the query and the same text is reused for the same set of criteria.
+        where_clause, params = build_search_criteria(book_data)
+        search_query = self.format_query("SELECT book_ISBN, book_name, book_writer, book_genre FROM books"
+                                         + where_clause)
+        # Enclose the database call within try and except
+        cursor = None
+        try:
+            # Get the prepared cursor instance for the query
+            cursor = self.get_prepared_cursor(search_query)
+            # Execute the query with the values of the criteria
+            self.execute_query(cursor, search_query, params)
+            # Keep the field names of the result as the column names of the result set.
+            all_books = BookResultSet([i[0] for i in cursor.description])
+            # Add the records to the result set
+            all_books.extend(cursor.fetchall())
+            self.release_prepared_cursor(search_query, cursor)
+            # Keep the result in the cache for the next search
+            self.cache.put(cache_key, all_books, len(all_books))
+        except self.Error as e:
+            # Catch exception and drop the cursor
+            self.report_error("Error while reading data", e)
+            if cursor is not None:
+                self.forget_prepared_cursor(search_query, cursor)
+        # Return the result set
+        return all_books
+
+
+def get_handler_class(backend=None):
+    """This method returns the handler class of a storage backend, by default the configured one.
+    The module of the backend is only imported here, so the driver of an unused backend is never loaded. """
+    backend = backend or dbconfig.BACKEND
+    if backend == 'mysql':
+        from bookrecords.sqlhandler import SQLHandler
+        return SQLHandler
+    if backend == 'sqlite':
+        from bookrecords.sqlitehandler import SQLiteHandler
+        return SQLiteHandler
+    raise ValueError('Unknown storage backend: ' + str(backend))
+
+
+def create_handler(backend=None, **kwargs):
+    """This method creates a handler of a storage backend, by default the configured one.
+    Any keyword argument is passed to the constructor of the handler. """
+    return get_handler_class(backend)(**kwargs)
@@ -1,7 +1,21 @@
+import hashlib
+
+
+def content_hash(book_name, book_writer, book_genre):
+    """This method returns the hash of the details of a record other than the ISBN, as 16 hexadecimal characters.
+    Two records with the same details have the same hash, so a changed record is found by comparing hashes. """
+    # Join with a character which cannot be typed into a detail, so that no two sets of details give the same text.
+    text = '\x1f'.join((book_name, book_writer, book_genre))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
 class BookDTO:
     """This class is a data transfer object. It contains the attributes for one record in database.
     It contains any additional variable required to maintain the state of the DTO
     or any variable required for the functionalities. """
+    # Declare the attributes up front so that no per-instance dictionary is created for them.
+    __slots__ = ('book_ISBN', 'book_name', 'book_writer', 'book_genre', 'store_flag')
+
     def __init__(self):
         """This is the constructor method. """
         self.book_ISBN = ''
@@ -19,6 +33,10 @@ class BookDTO:
                 self.book_writer,
                 self.book_genre]
 
+    def get_content_hash(self):
+        """This method returns the hash of the name, writer and genre of the record. """
+        return content_hash(self.book_name, self.book_writer, self.book_genre)
+
     def __str__(self):
         """This is to override the __str__ method of the object. This will be called wherever a print version of
         the object is requested.
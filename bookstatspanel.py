@@ -0,0 +1,74 @@
+import tkinter
+from tkinter import ttk
+
+# Most genres and writers shown, with the largest counts first.
+DEFAULT_LIMIT = 200
+
+
+class BookStatsPanel:
+    """This class shows the number of books per genre and per writer in a window of its own.
+    The counts are read from the summary table on the background worker, so the window shows them without
+    the database scanning the books, however many there are. """
+
+    def __init__(self, parent, worker, limit=DEFAULT_LIMIT):
+        """This is the constructor method. It creates the window and its widgets and reads the counts.
+        worker is the background worker which runs the reads. """
+        self.worker = worker
+        self.limit = limit
+        self.window = tkinter.Toplevel(parent)
+        self.window.title("Catalogue statistics")
+        self.window.geometry('640x460+940+460')
+
+        # Create a LabelFrame with a TreeView for each kind of count.
+        self.trees = {}
+        for position, (stat_kind, heading) in enumerate((('genre', 'Genre'), ('writer', 'Writer'))):
+            container = ttk.LabelFrame(self.window, text="Books per " + stat_kind)
+            tree = ttk.Treeview(container, columns=['count'])
+            tree.heading('#0', text=heading)
+            tree.column('#0', width=200)
+            tree.heading('count', text='Books')
+            tree.column('count', anchor=tkinter.E, width=70)
+            scroll_bar = ttk.Scrollbar(container, orient=tkinter.VERTICAL, command=tree.yview)
+            tree.configure(yscrollcommand=scroll_bar.set)
+            scroll_bar.pack(side=tkinter.RIGHT, fill=tkinter.Y)
+            tree.pack(fill=tkinter.BOTH, expand=True)
+            container.place(x=10 + position * 315, y=10, height=360, width=305)
+            self.trees[stat_kind] = tree
+
+        # Create a label for the totals and a button to read the counts again.
+        self.totals_variable = tkinter.StringVar(self.window)
+        tkinter.Label(self.window, textvariable=self.totals_variable, font=("bold", 10),
+                      justify="left", anchor='nw').place(x=10, y=380, height=40, width=480)
+        tkinter.Button(self.window, text='Refresh', command=self.refresh,
+                       width=12, bg='brown', fg='white').place(x=510, y=385)
+        self.refresh()
+
+    def refresh(self):
+        """This method reads the counts on the background worker. """
+        self.totals_variable.set('Reading statistics...')
+        limit = self.limit
+        self.worker.submit(lambda sql_handler: {stat_kind: sql_handler.get_book_stats(stat_kind, limit)
+                                                for stat_kind in self.trees},
+                           self.refresh_done, self.refresh_failed)
+
+    def refresh_done(self, book_stats):
+        """This method is called on the Tk thread with the counts read, by kind. """
+        # The window may have been closed while the counts were read.
+        if not self.window.winfo_exists():
+            return
+        for stat_kind, tree in self.trees.items():
+            tree.delete(*tree.get_children())
+            for stat_value, count in book_stats[stat_kind]:
+                tree.insert('', tkinter.END, text=stat_value, values=(count,))
+        # Every book has one genre, so the counts per genre add up to the number of books.
+        lines = ['Books: {}, genres: {}, writers: {}'.format(sum(count for _, count in book_stats['genre']),
+                                                              len(book_stats['genre']), len(book_stats['writer']))]
+        if any(len(stats) >= self.limit for stats in book_stats.values()):
+            lines.append('Only the {} largest counts of each kind are shown and counted.'.format(self.limit))
+        self.totals_variable.set('\n'.join(lines))
+
+    def refresh_failed(self, error):
+        """This method is called on the Tk thread when reading the counts raised an error. """
+        print("Error while reading statistics", error)
+        if self.window.winfo_exists():
+            self.totals_variable.set('Reading statistics failed! Click Refresh to try again.')
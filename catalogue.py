@@ -0,0 +1,112 @@
+import argparse
+import bisect
+import csv
+import itertools
+import random
+import sys
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.isbn import isbn13_check_digit
+
+# Words the synthetic titles and names are made of.
+TITLE_WORDS = ('Shadow', 'River', 'Garden', 'Winter', 'Silent', 'Empire', 'Glass', 'Journey', 'Stone', 'Night',
+               'Letters', 'Crown', 'Ocean', 'Secret', 'Fire', 'Memory', 'House', 'Storm', 'Light', 'Forest',
+               'Machine', 'Island', 'Mirror', 'Harbour', 'Road', 'Kingdom', 'Summer', 'Iron', 'Song', 'Clock')
+FIRST_NAMES = ('Anna', 'James', 'Maria', 'Ravi', 'Chen', 'Fatima', 'Lucas', 'Yuki', 'Olga', 'Samuel',
+               'Aisha', 'Pierre', 'Ingrid', 'Diego', 'Priya', 'Tomas', 'Mei', 'Kofi', 'Elena', 'Noah')
+LAST_NAMES = ('Smith', 'Kumar', 'Garcia', 'Okafor', 'Tanaka', 'Novak', 'Rossi', 'Muller', 'Haddad', 'Silva',
+              'Jensen', 'Kowalski', 'Nguyen', 'Petrov', 'Mensah', 'Lopez', 'Wang', 'Ibrahim', 'Dubois', 'Berg')
+GENRES = ('Fiction', 'Mystery', 'Romance', 'Fantasy', 'Science Fiction', 'Biography', 'History', 'Thriller',
+          'Poetry', 'Children', 'Travel', 'Cookery', 'Science', 'Philosophy', 'Horror', 'Drama', 'Humour',
+          'Religion', 'Art', 'Business')
+
+
+def isbn13(number):
+    """This method turns a number of up to 9 digits into a valid ISBN-13 with the 978 prefix. """
+    digits = '978' + str(number).zfill(9)
+    return digits + isbn13_check_digit(digits)
+
+
+def zipf_weights(count, exponent):
+    """This method returns the cumulative weights of a Zipf distribution over count ranks.
+    The first rank is the most frequent, so a few writers and genres hold most of the books like in a real
+    catalogue. """
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def pick(randomizer, cumulative_weights):
+    """This method picks a rank from the cumulative weights in O(log n). """
+    return bisect.bisect(cumulative_weights, randomizer.random() * cumulative_weights[-1])
+
+
+class CatalogueGenerator:
+    """This class generates a synthetic catalogue of books.
+    The same seed always gives the same catalogue, so benchmark runs can be compared.
+    Writers and genres are skewed with a Zipf distribution and the ISBNs are unique, valid ISBN-13 in
+    shuffled order, like records arriving from a real import. """
+
+    def __init__(self, seed=0, writer_count=None, exponent=1.1):
+        """This is the constructor method.
+        writer_count is the number of distinct writers, by default one per 20 books of the catalogue. """
+        self.seed = seed
+        self.writer_count = writer_count
+        self.exponent = exponent
+
+    def writer_name(self, rank):
+        """This method returns the name of the writer of a rank. Every rank gets a distinct name. """
+        first_name = FIRST_NAMES[rank % len(FIRST_NAMES)]
+        last_name = LAST_NAMES[(rank // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        generation = rank // (len(FIRST_NAMES) * len(LAST_NAMES))
+        # Add a suffix once the combinations of first and last names run out.
+        return first_name + ' ' + last_name + (' ' + str(generation + 1) if generation else '')
+
+    def generate(self, count, start=0):
+        """This method works as a generator yielding count new DTOs.
+        Only the current DTO is held in memory, so catalogues of millions of rows can be generated.
+        start skips the ISBNs of that many records, to generate records which are not in a catalogue of the
+        same seed and size. """
+        randomizer = random.Random(self.seed)
+        writer_count = self.writer_count or max(1, count // 20)
+        writer_weights = zipf_weights(writer_count, self.exponent)
+        genre_weights = zipf_weights(len(GENRES), self.exponent)
+        # Spread the sequence numbers over the ISBN range with a multiplier coprime with it,
+        # so the ISBNs are unique and not in order without keeping them all in memory.
+        isbn_range = 10 ** 9
+        multiplier = 387420489
+        offset = randomizer.randrange(isbn_range)
+        for sequence in range(start, start + count):
+            book_data = BookDTO()
+            book_data.book_ISBN = isbn13((sequence * multiplier + offset) % isbn_range)
+            book_data.book_name = ' '.join(randomizer.choice(TITLE_WORDS) for _ in range(randomizer.randint(2, 4)))
+            book_data.book_writer = self.writer_name(pick(randomizer, writer_weights))
+            book_data.book_genre = GENRES[pick(randomizer, genre_weights)]
+            yield book_data
+
+
+def main(argv=None):
+    """This method is the command line entry point for writing a synthetic catalogue to a CSV file,
+    which can be loaded with the bulk import. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.catalogue',
+                                     description='Write a synthetic catalogue of book records as CSV.')
+    parser.add_argument('count', type=int, help='number of records to generate')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the generator, the same seed gives the same records')
+    parser.add_argument('--writers', type=int, help='number of distinct writers, by default one per 20 records')
+    parser.add_argument('--output', help='CSV file to write, standard output if not given')
+    args = parser.parse_args(argv)
+
+    output_file = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        writer = csv.writer(output_file)
+        writer.writerow(('book_ISBN', 'book_name', 'book_writer', 'book_genre'))
+        for book_data in CatalogueGenerator(args.seed, args.writers).generate(args.count):
+            writer.writerow(book_data.get_as_list())
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+    return 0
+
+
+# To write a catalogue file, run this module from command.
+if __name__ == '__main__':
+    sys.exit(main())
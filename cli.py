@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+
+from bookrecords import dbconfig
+
+# The columns written for every record, in the order of the table.
+OUTPUT_COLUMNS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+# The columns written for the counts of the stats command.
+STATS_COLUMNS = ('stat_kind', 'stat_value', 'book_count')
+
+
+class RecordWriter:
+    """This class writes records to a text stream as tab separated values, CSV or JSON lines.
+    A header line is written with the first rows for the formats which have one. """
+
+    def __init__(self, stream, output_format='tsv', columns=OUTPUT_COLUMNS):
+        """This is the constructor method. columns are the names of the values of the rows. """
+        self.stream = stream
+        self.output_format = output_format
+        self.columns = columns
+        self.csv_writer = csv.writer(stream) if output_format == 'csv' else None
+        self.header_written = False
+
+    def write_header(self):
+        """This method writes the header line, once. """
+        self.header_written = True
+        if self.output_format == 'csv':
+            self.csv_writer.writerow(self.columns)
+        elif self.output_format == 'tsv':
+            self.stream.write('\t'.join(self.columns) + '\n')
+
+    def write_rows(self, rows):
+        """This method writes row tuples, e.g. the rows of a result set, and returns the number written. """
+        if not self.header_written:
+            self.write_header()
+        count = 0
+        for row in rows:
+            if self.output_format == 'csv':
+                self.csv_writer.writerow(row)
+            elif self.output_format == 'jsonl':
+                self.stream.write(json.dumps(dict(zip(self.columns, row))) + '\n')
+            else:
+                self.stream.write('\t'.join(str(value) for value in row) + '\n')
+            count += 1
+        return count
+
+
+def get_criteria(args):
+    """This method returns the search criteria of the arguments as a DTO. """
+    from bookrecords.booksdto import BookDTO
+    book_data = BookDTO()
+    book_data.book_ISBN = args.isbn or ''
+    book_data.book_name = args.name or ''
+    book_data.book_writer = args.writer or ''
+    book_data.book_genre = args.genre or ''
+    return book_data
+
+
+def search(sql_handler, args, writer):
+    """This method writes the records matching the criteria or the keywords of the arguments. """
+    if args.keywords:
+        return writer.write_rows(sql_handler.keyword_search_on_db(args.keywords, args.limit))
+    book_data = get_criteria(args)
+    if not any(book_data.get_as_list()):
+        raise ValueError('Give at least one of --isbn, --name, --writer, --genre or --keywords')
+    return writer.write_rows(sql_handler.search_book_on_db(book_data))
+
+
+def count_books(sql_handler, args):
+    """This method returns the number of records matching the criteria of the arguments, or of all records without
+    criteria. With --estimate, the number of all records is read from the statistics of the database instead. """
+    if args.estimate:
+        if any(get_criteria(args).get_as_list()):
+            raise ValueError('--estimate counts all records and takes no criteria')
+        book_count = sql_handler.estimate_book_count()
+    else:
+        book_count = sql_handler.count_books(get_criteria(args))
+    if book_count is None:
+        raise ValueError('the records could not be counted')
+    return book_count
+
+
+def list_books(sql_handler, args, writer):
+    """This method writes the records page by page, in order of ISBN, up to the limit if one is given.
+    Only one page is held in memory. When the limit stops the listing, the token to continue from is reported. """
+    count = 0
+    page_token = args.page_token
+    while True:
+        page_size = args.page_size if args.limit is None else min(args.page_size, args.limit - count)
+        books, next_page_token = sql_handler.get_books_page(page_token, page_size)
+        count += writer.write_rows(books)
+        if next_page_token is None:
+            break
+        if args.limit is not None and count >= args.limit:
+            print('Next page token:', next_page_token, file=sys.stderr)
+            break
+        page_token = next_page_token
+    return count
+
+
+def show_stats(sql_handler, args, writer):
+    """This method writes the number of records per genre and per writer, largest first,
+    after counting them again from the books table if asked. """
+    if args.rebuild:
+        print('Statistics rebuilt:', sql_handler.rebuild_book_stats(), 'rows', file=sys.stderr)
+    count = 0
+    for stat_kind in args.kinds or ('genre', 'writer'):
+        count += writer.write_rows((stat_kind, stat_value, book_count)
+                                   for stat_value, book_count in sql_handler.get_book_stats(stat_kind, args.limit))
+    return count
+
+
+def build_parser():
+    """This method returns the parser of the command line arguments. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords',
+                                     description='Search, list, count, import and export book records '
+                                                 'without the screens.')
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'],
+                        help='storage backend, taken from dbconfig if not given')
+    parser.add_argument('--sqlite-path', help='database file of the SQLite backend')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # Options shared by the commands which write records.
+    output_parser = argparse.ArgumentParser(add_help=False)
+    output_parser.add_argument('--output-format', choices=['tsv', 'csv', 'jsonl'], default='tsv',
+                               help='format of the records written to standard output')
+
+    # Options shared by the commands which take search criteria.
+    criteria_parser = argparse.ArgumentParser(add_help=False)
+    criteria_parser.add_argument('--isbn', help='ISBN of the book')
+    criteria_parser.add_argument('--name', help='name of the book')
+    criteria_parser.add_argument('--writer', help='writer of the book')
+    criteria_parser.add_argument('--genre', help='genre of the book')
+
+    search_parser = subparsers.add_parser('search', parents=[output_parser, criteria_parser],
+                                          help='find records by criteria or keywords')
+    search_parser.add_argument('--keywords', help='words to find in the name or writer, most relevant first')
+    search_parser.add_argument('--limit', type=int, default=100, help='most records found by a keyword search')
+
+    list_parser = subparsers.add_parser('list', parents=[output_parser], help='list the records in order of ISBN')
+    list_parser.add_argument('--limit', type=int, help='most records listed, all if not given')
+    list_parser.add_argument('--page-size', type=int, default=500, help='records read per query')
+    list_parser.add_argument('--page-token', help='token reported by an earlier listing, to continue from')
+
+    count_parser = subparsers.add_parser('count', parents=[criteria_parser],
+                                         help='show the number of records matching the criteria, or of all records')
+    count_parser.add_argument('--estimate', action='store_true',
+                              help='read the number of all records from the statistics of the database')
+
+    stats_parser = subparsers.add_parser('stats', parents=[output_parser],
+                                         help='show the number of records per genre and per writer')
+    stats_parser.add_argument('--kind', choices=['genre', 'writer'], action='append', dest='kinds',
+                              help='counts to show, both if not given; can be repeated')
+    stats_parser.add_argument('--limit', type=int, help='most values shown per kind, largest counts first')
+    stats_parser.add_argument('--rebuild', action='store_true',
+                              help='count the records again from the books table first')
+
+    import_parser = subparsers.add_parser('import', help='import records from a CSV or JSONL file')
+    import_parser.add_argument('import_args', nargs=argparse.REMAINDER,
+                               help='arguments of the import, see python -m bookrecords.bookimport --help')
+
+    load_parser = subparsers.add_parser('load', help='load records from a large file with several processes')
+    load_parser.add_argument('load_args', nargs=argparse.REMAINDER,
+                             help='arguments of the load, see python -m bookrecords.parallelload --help')
+
+    export_parser = subparsers.add_parser('export', help='export records to a CSV, JSONL or Parquet file')
+    export_parser.add_argument('export_args', nargs=argparse.REMAINDER,
+                               help='arguments of the export, see python -m bookrecords.bookexport --help')
+    return parser
+
+
+def main(argv=None):
+    """This method is the command line entry point. It never imports tkinter, so it runs without a display. """
+    args = build_parser().parse_args(argv)
+    # The options override the configuration for the handlers created by this process.
+    if args.backend:
+        dbconfig.BACKEND = args.backend
+    if args.sqlite_path:
+        dbconfig.SQLITE_PATH = args.sqlite_path
+
+    if args.command == 'import':
+        from bookrecords import bookimport
+        return bookimport.main(args.import_args)
+    if args.command == 'export':
+        from bookrecords import bookexport
+        return bookexport.main(args.export_args)
+    if args.command == 'load':
+        from bookrecords import parallelload
+        return parallelload.main(args.load_args)
+
+    from bookrecords.bookrepository import create_handler, get_handler_class
+    output = sys.stdout
+    try:
+        # The handlers print their progress. Send it to standard error so that standard output holds only records.
+        with contextlib.redirect_stdout(sys.stderr):
+            sql_handler = create_handler()
+            try:
+                if args.command == 'count':
+                    # The count is the output itself, not a number of records written.
+                    print(count_books(sql_handler, args), file=output)
+                    return 0
+                writer = RecordWriter(output, args.output_format,
+                                      STATS_COLUMNS if args.command == 'stats' else OUTPUT_COLUMNS)
+                if args.command == 'search':
+                    count = search(sql_handler, args, writer)
+                elif args.command == 'stats':
+                    count = show_stats(sql_handler, args, writer)
+                else:
+                    count = list_books(sql_handler, args, writer)
+            finally:
+                sql_handler.close_connection()
+    except (get_handler_class().Error, ValueError) as e:
+        print('Error while executing', e, file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # The reader of the output stopped early, e.g. head. Point the output at nothing so that
+        # flushing it at exit does not fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    print(count, 'records', file=sys.stderr)
+    return 0
+
+
+# Check whether the module is executed from command
+if __name__ == '__main__':
+    sys.exit(main())
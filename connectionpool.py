@@ -0,0 +1,172 @@
+import threading
+import time
+
+from bookrecords import dbconfig
+
+
+class ConnectionPool:
+    """This class keeps a bounded set of open database connections which are borrowed and returned
+    instead of connecting and disconnecting for every action.
+    Connections are checked before being handed out and closed after staying idle for too long.
+    The pool does not depend on a database driver. The driver specific parts are passed to the constructor. """
+
+    def __init__(self, connect, ping=None, error_class=Exception, exhausted_error=RuntimeError, pool_size=None,
+                 idle_timeout=None, health_check_after=None, acquire_timeout=None):
+        """This is the constructor method.
+        connect is called without arguments to open a new connection, and ping is called with a connection to
+        check that it is usable. error_class is the base class of the errors of the driver and exhausted_error
+        the error raised when no connection becomes free in time. Any setting not passed is taken from dbconfig. """
+        self.connect_function = connect
+        self.ping_function = ping
+        self.error_class = error_class
+        self.exhausted_error = exhausted_error
+        self.pool_size = pool_size if pool_size is not None else dbconfig.POOL_SIZE
+        self.idle_timeout = idle_timeout if idle_timeout is not None else dbconfig.POOL_IDLE_TIMEOUT
+        self.health_check_after = health_check_after if health_check_after is not None \
+            else dbconfig.POOL_HEALTH_CHECK_AFTER
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else dbconfig.POOL_ACQUIRE_TIMEOUT
+        # Idle connections as (connection, time it was returned) pairs. The most recently returned is last.
+        self._idle = []
+        # Number of connections currently open, whether borrowed or idle.
+        self._open_count = 0
+        self._condition = threading.Condition()
+        # Counters to show how the pool is behaving.
+        self.created_count = 0
+        self.evicted_count = 0
+        self.replaced_count = 0
+
+    def _connect(self):
+        """This method opens a new connection with the connect function of the driver. """
+        connection = self.connect_function()
+        with self._condition:
+            self.created_count += 1
+        return connection
+
+    def _close_quietly(self, connection):
+        """This method closes a connection and ignores any failure, as the connection is given up anyway. """
+        try:
+            connection.close()
+        except self.error_class:
+            pass
+
+    def is_healthy(self, connection):
+        """This method checks with a round trip to the server whether the connection is still usable. """
+        if self.ping_function is None:
+            return True
+        try:
+            self.ping_function(connection)
+            return True
+        except self.error_class:
+            return False
+
+    def _evict_idle(self):
+        """This method closes the connections which stayed idle longer than the idle timeout.
+        It must be called while holding the pool lock. """
+        expiry = time.monotonic() - self.idle_timeout
+        # The list is ordered by return time, so the expired connections are at the front.
+        while self._idle and self._idle[0][1] < expiry:
+            connection, _ = self._idle.pop(0)
+            self._open_count -= 1
+            self.evicted_count += 1
+            self._close_quietly(connection)
+
+    def get_connection(self):
+        """This method hands out a healthy connection.
+        An idle connection is reused if present, otherwise a new one is opened while the pool is not full.
+        When the pool is full, it waits for a connection to be returned up to the acquire timeout. """
+        deadline = time.monotonic() + self.acquire_timeout
+        connection = None
+        returned_at = None
+        with self._condition:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    # Take the most recently returned connection as it is the most likely to be alive.
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._open_count < self.pool_size:
+                    # Reserve the slot now and connect outside the lock.
+                    self._open_count += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self.exhausted_error("No connection available in the pool within {} seconds"
+                                               .format(self.acquire_timeout))
+                self._condition.wait(remaining)
+
+        # Ping the connection only if it was idle long enough to have been dropped by the server.
+        if connection is not None and time.monotonic() - returned_at > self.health_check_after \
+                and not self.is_healthy(connection):
+            self._close_quietly(connection)
+            # The counters are read by get_stats while other threads borrow connections.
+            with self._condition:
+                self.replaced_count += 1
+            connection = None
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except self.error_class:
+                # Give the reserved slot back so that other callers can try again.
+                with self._condition:
+                    self._open_count -= 1
+                    self._condition.notify()
+                raise
+        return connection
+
+    def release_connection(self, connection):
+        """This method returns a borrowed connection to the pool.
+        Any open transaction is rolled back so that the next borrower starts clean. """
+        try:
+            connection.rollback()
+        except self.error_class:
+            # The connection is broken, so close it instead of keeping it.
+            self.discard_connection(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._evict_idle()
+            self._condition.notify()
+
+    def discard_connection(self, connection):
+        """This method closes a borrowed connection and frees its slot in the pool. """
+        self._close_quietly(connection)
+        with self._condition:
+            self._open_count -= 1
+            self._condition.notify()
+
+    def close_all(self):
+        """This method closes every idle connection. Borrowed connections are not affected. """
+        with self._condition:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._open_count -= 1
+                self._close_quietly(connection)
+            self._condition.notify_all()
+
+    def get_stats(self):
+        """This method returns the counters of the pool as a dictionary. """
+        with self._condition:
+            return {'pool_size': self.pool_size,
+                    'open': self._open_count,
+                    'idle': len(self._idle),
+                    'borrowed': self._open_count - len(self._idle),
+                    'created': self.created_count,
+                    'evicted': self.evicted_count,
+                    'replaced': self.replaced_count}
+
+
+# The process-wide pools, one per database. They are created on first use.
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(key, create_pool):
+    """This method returns the process-wide connection pool of a database, identified by key.
+    create_pool is called without arguments to create the pool on first use. """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(key)
+        if pool is None:
+            pool = create_pool()
+            _shared_pools[key] = pool
+        return pool
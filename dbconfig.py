@@ -0,0 +1,49 @@
+import os
+
+# Connection details and credentials for the MySQL database.
+# Each value can be overridden with an environment variable so that the code need not be changed per machine.
+MYSQL_CONFIG = {'host': os.environ.get('BOOKRECORDS_DB_HOST', 'localhost'),
+                'port': os.environ.get('BOOKRECORDS_DB_PORT', '3306'),
+                'database': os.environ.get('BOOKRECORDS_DB_NAME', 'pythonapps'),
+                'user': os.environ.get('BOOKRECORDS_DB_USER', 'pythonuser'),
+                'password': os.environ.get('BOOKRECORDS_DB_PASSWORD', 'Welcome1')}
+
+# Maximum number of connections the process-wide pool keeps open at the same time.
+POOL_SIZE = int(os.environ.get('BOOKRECORDS_POOL_SIZE', '5'))
+# Seconds a connection may stay unused in the pool before it is closed.
+POOL_IDLE_TIMEOUT = float(os.environ.get('BOOKRECORDS_POOL_IDLE_TIMEOUT', '300'))
+# Seconds a connection may stay unused before it is pinged again when borrowed.
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get('BOOKRECORDS_POOL_HEALTH_CHECK_AFTER', '5'))
+# Seconds to wait for a free connection when all connections of the pool are borrowed.
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('BOOKRECORDS_POOL_ACQUIRE_TIMEOUT', '10'))
+
+# Maximum number of read results kept by the process-wide query cache. 0 turns the cache off.
+CACHE_MAX_ENTRIES = int(os.environ.get('BOOKRECORDS_CACHE_MAX_ENTRIES', '256'))
+# Maximum number of records held by all cached results together, to bound the memory used.
+CACHE_MAX_ROWS = int(os.environ.get('BOOKRECORDS_CACHE_MAX_ROWS', '100000'))
+# Seconds a cached result is used before it is read again, so changes by other clients show up.
+CACHE_TTL = float(os.environ.get('BOOKRECORDS_CACHE_TTL', '30'))
+# Seconds the estimated number of all records is used before it is read again from the table statistics.
+COUNT_ESTIMATE_TTL = float(os.environ.get('BOOKRECORDS_COUNT_ESTIMATE_TTL', '10'))
+
+# Storage backend used by the application: "mysql" for the MySQL server above,
+# or "sqlite" for a local database file which needs no server.
+BACKEND = os.environ.get('BOOKRECORDS_BACKEND', 'mysql')
+# Path of the database file used by the SQLite backend.
+SQLITE_PATH = os.environ.get('BOOKRECORDS_SQLITE_PATH', 'bookrecords.db')
+
+# Milliseconds a query may take before it is written to the slow-query log.
+SLOW_QUERY_THRESHOLD = float(os.environ.get('BOOKRECORDS_SLOW_QUERY_MS', '200'))
+# Set to 1 to add the query plan of the database to every entry of the slow-query log.
+SLOW_QUERY_EXPLAIN = os.environ.get('BOOKRECORDS_SLOW_QUERY_EXPLAIN', '0') == '1'
+# File the slow-query log is written to. Empty to leave it to the logging configuration of the application.
+SLOW_QUERY_LOG = os.environ.get('BOOKRECORDS_SLOW_QUERY_LOG', '')
+
+# File keeping the records of the batch entry mode until they are stored, so none is lost if the application closes.
+ENTRY_JOURNAL_PATH = os.environ.get('BOOKRECORDS_ENTRY_JOURNAL', 'bookrecords-entries.journal')
+# Records stored per transaction by the batch entry mode, and milliseconds between two stores of the queue.
+ENTRY_BATCH_SIZE = int(os.environ.get('BOOKRECORDS_ENTRY_BATCH_SIZE', '50'))
+ENTRY_FLUSH_INTERVAL = int(os.environ.get('BOOKRECORDS_ENTRY_FLUSH_INTERVAL', '2000'))
+
+# Milliseconds between two reads of the changes by the auto refresh of the Book Monitor.
+MONITOR_REFRESH_INTERVAL = int(os.environ.get('BOOKRECORDS_MONITOR_REFRESH_INTERVAL', '5000'))
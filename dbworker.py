@@ -0,0 +1,161 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bookrecords.bookrepository import create_handler
+
+
+class DBWorker:
+    """This class runs database jobs on a pool of background threads so that the Tk mainloop never waits
+    for the database. Each thread holds its own handler of the configured storage backend,
+    borrowed from the connection pool.
+    Results are put on a queue which is polled from the Tk thread with "after",
+    so the callbacks run on the Tk thread and may update widgets. """
+
+    def __init__(self, max_workers=2, poll_interval=20):
+        """This is the constructor method. The threads are started when the first job is submitted.
+        poll_interval is the number of milliseconds between two checks of the result queue. """
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bookrecords-db')
+        # Queue of (callback, value, channel, job number) of the finished jobs, to be handled on the Tk thread.
+        self.results = queue.Queue()
+        # Handler of each worker thread.
+        self.thread_state = threading.local()
+        # Latest job number of each channel. A job whose number is no longer the latest was superseded.
+        self.channel_jobs = {}
+        self.channel_futures = {}
+        self.lock = threading.Lock()
+        # Number of jobs submitted whose callback did not run yet.
+        self.pending_count = 0
+        self.root = None
+        self.poll_id = None
+        # Method called with True when the worker becomes busy and with False when it becomes idle.
+        self.on_busy_changed = None
+
+    def attach(self, root):
+        """This method sets the Tk root whose "after" is used to poll the results.
+        It must be called again whenever the root is re-initialised. """
+        self.root = root
+        self.poll_id = None
+        if self.pending_count:
+            self.schedule_poll()
+
+    def current_handler(self):
+        """This method returns the handler of the calling worker thread.
+        It is meant to be called from within a job. """
+        sql_handler = getattr(self.thread_state, 'sql_handler', None)
+        if sql_handler is None:
+            sql_handler = create_handler()
+            self.thread_state.sql_handler = sql_handler
+        return sql_handler
+
+    def drop_handler(self):
+        """This method gives up the handler of the calling worker thread after an error,
+        so that the next job starts with a fresh connection from the pool. """
+        sql_handler = getattr(self.thread_state, 'sql_handler', None)
+        self.thread_state.sql_handler = None
+        if sql_handler is not None and sql_handler.connection is not None:
+            sql_handler.pool.discard_connection(sql_handler.connection)
+            sql_handler.connection = None
+
+    def submit(self, job, on_done=None, on_error=None, channel=None):
+        """This method runs job(sql_handler) on a worker thread.
+        on_done is called on the Tk thread with the return value, on_error with the exception.
+        A job submitted on a channel supersedes the previous job of the same channel:
+        the previous job is cancelled if it did not start, and its result is dropped if it did. """
+        with self.lock:
+            job_number = self.channel_jobs.get(channel, 0) + 1
+            if channel is not None:
+                self.channel_jobs[channel] = job_number
+                previous_future = self.channel_futures.pop(channel, None)
+                if previous_future is not None and previous_future.cancel():
+                    # The previous job never ran, so its callback never will either.
+                    self.pending_count -= 1
+            self.pending_count += 1
+            became_busy = self.pending_count == 1
+        future = self.executor.submit(self.run_job, job, on_done, on_error, channel, job_number)
+        if channel is not None:
+            with self.lock:
+                if self.channel_jobs.get(channel) == job_number:
+                    self.channel_futures[channel] = future
+        if became_busy:
+            self.busy_changed(True)
+        self.schedule_poll()
+        return future
+
+    def cancel(self, channel):
+        """This method cancels the job of a channel. Its result is dropped if it is already running. """
+        became_idle = False
+        with self.lock:
+            self.channel_jobs[channel] = self.channel_jobs.get(channel, 0) + 1
+            previous_future = self.channel_futures.pop(channel, None)
+            if previous_future is not None and previous_future.cancel():
+                self.pending_count -= 1
+                became_idle = self.pending_count == 0
+        if became_idle:
+            self.busy_changed(False)
+
+    def is_current(self, channel, job_number):
+        """This method tells whether a job is still the latest of its channel. """
+        with self.lock:
+            return channel is None or self.channel_jobs.get(channel) == job_number
+
+    def run_job(self, job, on_done, on_error, channel, job_number):
+        """This method runs on a worker thread and queues the outcome of the job for the Tk thread. """
+        if not self.is_current(channel, job_number):
+            # Superseded before it started, so don't touch the database at all.
+            self.results.put((None, None, channel, job_number))
+            return
+        sql_handler = None
+        try:
+            # Creating the handler can fail too, e.g. on a bad configuration, and is reported like the job.
+            sql_handler = self.current_handler()
+            value = job(sql_handler)
+        except Exception as e:
+            if sql_handler is not None and isinstance(e, sql_handler.Error):
+                # The connection may be broken, so don't keep it for the next job.
+                self.drop_handler()
+            self.results.put((on_error, e, channel, job_number))
+        else:
+            self.results.put((on_done, value, channel, job_number))
+        finally:
+            # Return the connection to the pool between jobs so that every job starts a fresh transaction
+            # and sees the records committed meanwhile. The next job borrows it again without a handshake.
+            if sql_handler is not None:
+                sql_handler.close_connection()
+
+    def schedule_poll(self):
+        """This method schedules the next check of the result queue on the Tk thread. """
+        if self.root is not None and self.poll_id is None:
+            self.poll_id = self.root.after(self.poll_interval, self.poll)
+
+    def poll(self):
+        """This method runs on the Tk thread and calls the callbacks of the finished jobs. """
+        self.poll_id = None
+        while True:
+            try:
+                callback, value, channel, job_number = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.pending_count -= 1
+                became_idle = self.pending_count == 0
+            # Drop the result of a superseded job.
+            if self.is_current(channel, job_number):
+                if callback is not None:
+                    callback(value)
+                elif isinstance(value, Exception):
+                    print("Error while executing", value)
+            if became_idle:
+                self.busy_changed(False)
+        if self.pending_count:
+            self.schedule_poll()
+
+    def busy_changed(self, busy):
+        """This method tells the owner whether jobs are running, e.g. to show a busy indicator. """
+        if self.on_busy_changed is not None:
+            self.on_busy_changed(busy)
+
+    def shutdown(self):
+        """This method stops the worker threads after the running jobs. """
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,217 @@
+import bisect
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+from bookrecords import dbconfig
+
+# Upper bounds of the latency histogram buckets in milliseconds. The last bucket holds everything slower.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+# Most values of a query written to the slow-query log, so that a long IN list does not flood the log.
+MAX_LOGGED_PARAMS = 20
+
+# Logger of the queries slower than the threshold. Each message is one JSON object.
+slow_query_logger = logging.getLogger('bookrecords.slowquery')
+
+
+class OperationStats:
+    """This class keeps the counters and the latency histogram of one operation.
+    The histogram has fixed buckets, so recording takes constant time and memory however many calls are made. """
+
+    def __init__(self):
+        """This is the constructor method. """
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, duration, rows, failed):
+        """This method records one call which took duration seconds and returned rows records. """
+        self.calls += 1
+        self.rows += rows
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        if failed:
+            self.errors += 1
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, duration * 1000)] += 1
+
+    def percentile(self, fraction):
+        """This method returns an estimate of the latency in milliseconds below which the fraction of calls lies.
+        It is the upper bound of the bucket holding that call, or the slowest call for the last bucket. """
+        if not self.calls:
+            return 0.0
+        rank = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max_time * 1000)
+        return self.max_time * 1000
+
+    def as_dict(self):
+        """This method returns the counters as a dictionary, with the latencies in milliseconds. """
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'rows': self.rows,
+                'mean_ms': round(self.total_time / self.calls * 1000, 3) if self.calls else 0.0,
+                'p50_ms': round(self.percentile(0.5), 3),
+                'p95_ms': round(self.percentile(0.95), 3),
+                'max_ms': round(self.max_time * 1000, 3)}
+
+
+class Instrumentation:
+    """This class collects the timings of the handler operations of the process:
+    latency histograms, rows returned and errors per operation, and the time spent waiting for a connection.
+    Queries slower than the threshold are written to the slow-query log.
+    Other components register their own counters with watch, so that one call returns every statistic. """
+
+    def __init__(self, slow_query_threshold=None, explain_slow_queries=None):
+        """This is the constructor method. Any setting not passed is taken from dbconfig.
+        slow_query_threshold is in milliseconds. """
+        self.slow_query_threshold = slow_query_threshold if slow_query_threshold is not None \
+            else dbconfig.SLOW_QUERY_THRESHOLD
+        self.explain_slow_queries = explain_slow_queries if explain_slow_queries is not None \
+            else dbconfig.SLOW_QUERY_EXPLAIN
+        self.operations = {}
+        self.acquire = OperationStats()
+        self.slow_queries = 0
+        # Methods returning the counters of other components, by name.
+        self.watched = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, duration, rows=0, failed=False):
+        """This method records one call of an operation. """
+        with self.lock:
+            operation_stats = self.operations.get(operation)
+            if operation_stats is None:
+                operation_stats = OperationStats()
+                self.operations[operation] = operation_stats
+            operation_stats.record(duration, rows, failed)
+
+    def record_acquire(self, duration, failed=False):
+        """This method records the time spent to borrow a connection from the pool. """
+        with self.lock:
+            self.acquire.record(duration, 0, failed)
+
+    def is_slow(self, duration):
+        """This method tells whether a query which took duration seconds goes to the slow-query log. """
+        return duration * 1000 >= self.slow_query_threshold
+
+    def log_slow_query(self, backend, query, params, duration, rows=None, plan=None):
+        """This method writes a slow query to the slow-query log as one JSON object. """
+        with self.lock:
+            self.slow_queries += 1
+        slow_query_logger.warning(json.dumps({'backend': backend,
+                                              'duration_ms': round(duration * 1000, 3),
+                                              'query': ' '.join(query.split()),
+                                              'params': [str(param) for param in params[:MAX_LOGGED_PARAMS]],
+                                              'rows': rows,
+                                              'plan': plan}))
+
+    def watch(self, name, get_stats):
+        """This method registers the method returning the counters of a component, e.g. the cache or the pool. """
+        with self.lock:
+            self.watched[name] = get_stats
+
+    def get_stats(self):
+        """This method returns every statistic as a dictionary:
+        the operations by name, the connection acquire time, the slow-query count and the watched components. """
+        with self.lock:
+            stats = {'operations': {operation: operation_stats.as_dict()
+                                    for operation, operation_stats in sorted(self.operations.items())},
+                     'acquire': self.acquire.as_dict(),
+                     'slow_queries': self.slow_queries}
+            watched = list(self.watched.items())
+        # Ask the components outside the lock as they take their own locks.
+        for name, get_stats in watched:
+            stats[name] = get_stats()
+        return stats
+
+    def reset(self):
+        """This method clears the counters of the operations. """
+        with self.lock:
+            self.operations = {}
+            self.acquire = OperationStats()
+            self.slow_queries = 0
+
+
+def count_rows(result):
+    """This method returns the number of records in the result of a handler method:
+    a page as (result set, token), a result set or list of rows, or a single DTO. """
+    if isinstance(result, tuple):
+        result = result[0]
+    if hasattr(result, '__len__'):
+        return len(result)
+    return 0 if result is None else 1
+
+
+def instrumented(operation):
+    """This method returns a decorator which records every call of a handler method as the operation.
+    The handler reports an error it handled itself with report_error, so such a call counts as failed too.
+    For a generator method, the time and rows cover the whole iteration, each item counting as its records. """
+    def decorate(method):
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def generator_wrapper(self, *args, **kwargs):
+                started = time.perf_counter()
+                rows = 0
+                failed = False
+                errors_before = self.error_count
+                try:
+                    for item in method(self, *args, **kwargs):
+                        rows += count_rows(item)
+                        yield item
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    duration = time.perf_counter() - started
+                    # The cursors of the operation are closed now, so the query plans of its slow queries can be read.
+                    self.log_pending_slow_queries()
+                    self.instrumentation.record(operation, duration, rows, failed or self.error_count != errors_before)
+            return generator_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            result = None
+            failed = False
+            errors_before = self.error_count
+            try:
+                result = method(self, *args, **kwargs)
+                return result
+            except Exception:
+                failed = True
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                self.log_pending_slow_queries()
+                self.instrumentation.record(operation, duration, count_rows(result),
+                                            failed or self.error_count != errors_before)
+        return wrapper
+    return decorate
+
+
+# The process-wide instrumentation. It is created on first use.
+_shared_instrumentation = None
+_shared_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation():
+    """This method returns the process-wide instrumentation, creating it on first use.
+    The slow-query log is also written to the configured file, if any. """
+    global _shared_instrumentation
+    with _shared_instrumentation_lock:
+        if _shared_instrumentation is None:
+            _shared_instrumentation = Instrumentation()
+            if dbconfig.SLOW_QUERY_LOG:
+                log_handler = logging.FileHandler(dbconfig.SLOW_QUERY_LOG, encoding='utf-8')
+                log_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                slow_query_logger.addHandler(log_handler)
+        return _shared_instrumentation
@@ -0,0 +1,59 @@
+import re
+
+# Characters allowed between the digits of an ISBN as it is usually written.
+SEPARATORS = re.compile(r'[\s\-]')
+
+
+def clean_isbn(text):
+    """This method removes the spaces and hyphens of an ISBN and an "ISBN" prefix, if any.
+    The check character X of an ISBN-10 is turned to upper case. """
+    text = SEPARATORS.sub('', str(text)).upper()
+    if text.startswith('ISBN'):
+        text = text[len('ISBN'):].lstrip(':')
+    return text
+
+
+def isbn10_check_digit(first_digits):
+    """This method returns the check character of an ISBN-10 from its first 9 digits. """
+    total = sum((10 - position) * int(digit) for position, digit in enumerate(first_digits))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def isbn13_check_digit(first_digits):
+    """This method returns the check digit of an ISBN-13 from its first 12 digits. """
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(first_digits))
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_isbn(text):
+    """This method tells whether a text is an ISBN-10 or ISBN-13 with a correct check digit. """
+    try:
+        normalize_isbn(text)
+        return True
+    except ValueError:
+        return False
+
+
+def normalize_isbn(text):
+    """This method returns the ISBN-13 form of an ISBN-10 or ISBN-13, as 13 digits without separators.
+    The same book always gets the same text, however its ISBN was written.
+    It raises ValueError if the text is not an ISBN or its check digit is wrong. """
+    isbn = clean_isbn(text)
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        if isbn10_check_digit(isbn[:9]) != isbn[9]:
+            raise ValueError('Wrong check digit in ISBN-10: ' + str(text))
+        # An ISBN-10 is the ISBN-13 with the 978 prefix, with the check digit computed again.
+        first_digits = '978' + isbn[:9]
+        return first_digits + isbn13_check_digit(first_digits)
+    if len(isbn) == 13 and isbn.isdigit() and isbn.startswith(('978', '979')):
+        if isbn13_check_digit(isbn[:12]) != isbn[12]:
+            raise ValueError('Wrong check digit in ISBN-13: ' + str(text))
+        return isbn
+    raise ValueError('Not an ISBN-10 or ISBN-13: ' + str(text))
+
+
+def isbn_key(text):
+    """This method returns the key of an ISBN as stored in the BIGINT primary key of the books table:
+    the ISBN-13 as a number. It raises ValueError if the text is not a valid ISBN. """
+    return int(normalize_isbn(text))
@@ -0,0 +1,342 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from bookrecords import dbconfig
+from bookrecords.benchmark import criteria, percentile
+from bookrecords.bookrepository import create_handler, encode_page_token
+from bookrecords.booksdto import BookDTO
+from bookrecords.catalogue import CatalogueGenerator
+from bookrecords.isbn import isbn_key
+from bookrecords.querycache import QueryCache
+
+# Share of each operation in the load when no mix is passed, as operation=weight pairs.
+DEFAULT_MIX = 'insert=20,search=50,list=20,keyword=10'
+# Operations a client can run, see LoadClient.
+OPERATIONS = ('insert', 'search', 'list', 'keyword')
+# Records of the catalogue used as search criteria and as the inserts which are meant to be duplicates.
+SAMPLE_SIZE = 1000
+# Range of new records reserved per client in the sequence of the catalogue generator, so no two clients insert
+# the same new ISBN by chance. Only the inserts which are meant to be duplicates repeat an ISBN.
+NEW_RECORDS_PER_CLIENT = 1000000
+
+
+def parse_mix(text):
+    """This method turns a mix given as "insert=20,search=50" into a dictionary of operation to weight. """
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise ValueError('Unknown operation in mix: ' + operation)
+        mix[operation] = float(weight or 1)
+    if sum(mix.values()) <= 0:
+        raise ValueError('The mix has no operation with a positive weight: ' + text)
+    return mix
+
+
+def copy_book(book_data):
+    """This method returns a new DTO with the details of a record, flagged as new. """
+    new_book = BookDTO()
+    new_book.book_ISBN, new_book.book_name, new_book.book_writer, new_book.book_genre = book_data.get_as_list()
+    return new_book
+
+
+class LoadStats:
+    """This class collects the outcome of every operation run by the clients of a load test.
+    The durations are kept in full, so the percentiles are exact rather than read from histogram buckets. """
+
+    def __init__(self):
+        """This is the constructor method. """
+        self.durations = {operation: [] for operation in OPERATIONS}
+        self.errors = dict.fromkeys(OPERATIONS, 0)
+        self.duplicates = dict.fromkeys(OPERATIONS, 0)
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def record(self, operation, duration, failed=False, duplicate=False):
+        """This method records one operation which took duration seconds. """
+        with self.lock:
+            self.durations[operation].append(duration)
+            self.completed += 1
+            if failed:
+                self.errors[operation] += 1
+            if duplicate:
+                self.duplicates[operation] += 1
+
+    def summarize(self, elapsed):
+        """This method returns the counters of every operation run and of all of them together, with the latencies
+        in milliseconds and the throughput over elapsed seconds. """
+        with self.lock:
+            durations = {operation: sorted(values) for operation, values in self.durations.items() if values}
+            errors = dict(self.errors)
+            duplicates = dict(self.duplicates)
+        summaries = {operation: self.summarize_operation(values, errors[operation], duplicates[operation], elapsed)
+                     for operation, values in durations.items()}
+        all_durations = sorted(duration for values in durations.values() for duration in values)
+        total = self.summarize_operation(all_durations, sum(errors.values()), sum(duplicates.values()), elapsed)
+        return summaries, total
+
+    @staticmethod
+    def summarize_operation(durations, errors, duplicates, elapsed):
+        """This method turns the sorted durations of the runs of an operation, in seconds, into one result record. """
+        calls = len(durations)
+        return {'calls': calls,
+                'errors': errors,
+                'duplicates': duplicates,
+                'error_rate': round(errors / calls, 4) if calls else 0.0,
+                'duplicate_rate': round(duplicates / calls, 4) if calls else 0.0,
+                'ops_per_s': round(calls / elapsed, 1) if elapsed else None,
+                'mean_ms': round(sum(durations) / calls * 1000, 3) if calls else 0.0,
+                'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+                'p90_ms': round(percentile(durations, 0.9) * 1000, 3),
+                'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+                'max_ms': round(durations[-1] * 1000, 3) if calls else 0.0}
+
+
+class LoadClient:
+    """This class simulates one client of the database, like a desktop application or a script.
+    It runs a random mix of operations through its own handler until the deadline. The handler returns its
+    connection to the pool after every operation, as the background worker of the screens does. """
+
+    def __init__(self, client_number, settings, samples, stats):
+        """This is the constructor method. samples are records of the catalogue, used as search criteria.
+        settings is the dictionary of the settings of the load test. """
+        self.settings = settings
+        self.samples = samples
+        self.stats = stats
+        self.randomizer = random.Random(settings['seed'] * 1000003 + client_number)
+        self.operations = list(settings['mix'])
+        self.weights = [settings['mix'][operation] for operation in self.operations]
+        # New records of this client, from its own range of the sequence of the catalogue generator.
+        self.new_books = CatalogueGenerator(seed=settings['seed'], writer_count=settings['writer_count']).generate(
+            NEW_RECORDS_PER_CLIENT, start=settings['catalogue_size'] + client_number * NEW_RECORDS_PER_CLIENT)
+        self.sql_handler = None
+
+    def run(self, deadline):
+        """This method runs operations until the deadline, a time of time.monotonic. """
+        cache = QueryCache(max_entries=0) if not self.settings['cache'] else None
+        self.sql_handler = create_handler(cache=cache)
+        think_time = self.settings['think_time_ms'] / 1000
+        try:
+            while time.monotonic() < deadline:
+                operation = self.randomizer.choices(self.operations, self.weights)[0]
+                self.run_operation(operation)
+                if think_time:
+                    time.sleep(think_time)
+        finally:
+            self.sql_handler.close_connection()
+
+    def run_operation(self, operation):
+        """This method runs one operation, records its outcome and returns the connection to the pool. """
+        sample = self.randomizer.choice(self.samples)
+        error_count = self.sql_handler.error_count
+        failed = False
+        duplicate = False
+        started = time.perf_counter()
+        try:
+            if operation == 'insert':
+                # A share of the inserts repeat a record of the catalogue, like a record entered twice.
+                if self.randomizer.random() < self.settings['duplicate_share']:
+                    book_data = copy_book(sample)
+                else:
+                    book_data = next(self.new_books)
+                store_flag = self.sql_handler.insert_book_to_db(book_data).store_flag
+                duplicate = store_flag == 'duplicate'
+                failed = store_flag not in ('inserted', 'duplicate')
+            elif operation == 'search':
+                field = self.randomizer.choice(('book_ISBN', 'book_name', 'book_writer', 'book_genre'))
+                self.sql_handler.search_book_on_db(criteria(**{field: getattr(sample, field)}))
+            elif operation == 'list':
+                # Half of the listings are the first page, the others start at a record of the catalogue,
+                # like a user who scrolled down.
+                page_token = None
+                if self.randomizer.random() < 0.5:
+                    page_token = encode_page_token(isbn_key(sample.book_ISBN))
+                self.sql_handler.get_books_page(page_token, self.settings['page_size'])
+            else:
+                self.sql_handler.keyword_search_on_db(sample.book_name.split()[0])
+        except Exception as e:
+            print('Error while running', operation, e)
+            failed = True
+            # The connection may be broken, so don't keep it for the next operation.
+            if self.sql_handler.connection is not None:
+                self.sql_handler.pool.discard_connection(self.sql_handler.connection)
+                self.sql_handler.connection = None
+        finally:
+            self.sql_handler.close_connection()
+        # The handlers report most errors themselves instead of raising them.
+        failed = failed or self.sql_handler.error_count > error_count
+        self.stats.record(operation, time.perf_counter() - started, failed, duplicate)
+
+
+class LoadTest:
+    """This class runs a load test: it fills a catalogue, starts the clients at once on threads of this process and
+    samples the throughput and the connections of the pool at a fixed interval while they run.
+    The clients share the process-wide connection pool of the database, so the pool size bounds the connections
+    they hold at the same time and the time they wait for one shows the contention. """
+
+    def __init__(self, settings):
+        """This is the constructor method. settings is the dictionary of the settings of the load test. """
+        self.settings = settings
+        self.stats = LoadStats()
+        # Samples of the throughput and the connections over time.
+        self.timeline = []
+
+    def fill_catalogue(self):
+        """This method inserts the catalogue the clients work on and returns the sample records.
+        Records already stored, e.g. by an earlier run against the same database, are left as they are. """
+        generator = CatalogueGenerator(seed=self.settings['seed'], writer_count=self.settings['writer_count'])
+        sql_handler = create_handler()
+        try:
+            for _ in sql_handler.insert_books_to_db(generator.generate(self.settings['catalogue_size'])):
+                pass
+        finally:
+            sql_handler.close_connection()
+        generator = CatalogueGenerator(seed=self.settings['seed'], writer_count=self.settings['writer_count'])
+        return list(generator.generate(min(self.settings['catalogue_size'], SAMPLE_SIZE)))
+
+    def sample(self, pool, started, previous):
+        """This method adds one sample of the throughput since the previous sample and of the connections of the
+        pool to the timeline, and returns the sample. """
+        now = time.monotonic()
+        completed = self.stats.completed
+        pool_stats = pool.get_stats()
+        interval = now - previous['time'] if previous else now - started
+        entry = {'time': now,
+                 't_s': round(now - started, 3),
+                 'completed': completed,
+                 'ops_per_s': round((completed - (previous['completed'] if previous else 0)) / interval, 1)
+                 if interval else None,
+                 'open_connections': pool_stats['open'],
+                 'borrowed_connections': pool_stats['borrowed'],
+                 'idle_connections': pool_stats['idle']}
+        self.timeline.append(entry)
+        return entry
+
+    def run(self):
+        """This method runs the load test and returns the report as a dictionary. """
+        samples = self.fill_catalogue()
+        if not samples:
+            raise ValueError('The catalogue is empty, so there is nothing to search')
+        # Count only the operations of the clients, not the filling of the catalogue.
+        instrumentation_handler = create_handler()
+        instrumentation_handler.close_connection()
+        instrumentation_handler.instrumentation.reset()
+        pool = instrumentation_handler.pool
+
+        clients = [LoadClient(client_number, self.settings, samples, self.stats)
+                   for client_number in range(self.settings['clients'])]
+        started = time.monotonic()
+        deadline = started + self.settings['duration']
+        threads = [threading.Thread(target=client.run, args=(deadline,), name='bookrecords-client-{}'.format(number))
+                   for number, client in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        # Sample until every client stopped.
+        previous = None
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(max(0.0, (previous['time'] if previous else started) + self.settings['sample_interval']
+                                - time.monotonic()))
+            previous = self.sample(pool, started, previous)
+        elapsed = time.monotonic() - started
+
+        operations, total = self.stats.summarize(elapsed)
+        instrumentation = instrumentation_handler.instrumentation.get_stats()
+        return {'elapsed_s': round(elapsed, 3),
+                'total': total,
+                'operations': operations,
+                'connection_acquire': instrumentation['acquire'],
+                'pool': instrumentation['pool'],
+                'slow_queries': instrumentation['slow_queries'],
+                'timeline': [{key: value for key, value in entry.items() if key != 'time'}
+                             for entry in self.timeline]}
+
+
+def main(argv=None):
+    """This method is the command line entry point for running a load test.
+    The report is written as JSON so that runs can be compared over time. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.loadtest',
+                                     description='Simulate concurrent clients of the database and report how it '
+                                                 'holds up.')
+    parser.add_argument('--clients', type=int, default=8, help='clients running at the same time')
+    parser.add_argument('--duration', type=float, default=10, help='seconds the clients run')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='share of each operation as operation=weight pairs, from ' + ', '.join(OPERATIONS))
+    parser.add_argument('--duplicate-share', type=float, default=0.05,
+                        help='share of the inserts which repeat a record already stored')
+    parser.add_argument('--think-time', type=float, default=0, dest='think_time_ms',
+                        help='milliseconds each client waits between two operations')
+    parser.add_argument('--catalogue-size', type=int, default=10000,
+                        help='records stored before the clients start')
+    parser.add_argument('--page-size', type=int, default=500, help='records per page of the listing')
+    parser.add_argument('--pool-size', type=int, help='connections of the pool, taken from dbconfig if not given')
+    parser.add_argument('--cache', action='store_true',
+                        help='answer repeated reads from the query cache, which the clients of one process share')
+    parser.add_argument('--sample-interval', type=float, default=1.0,
+                        help='seconds between two samples of the throughput and the connections')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the catalogue and of the clients')
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'], default='sqlite',
+                        help='storage backend. MySQL uses the database of dbconfig, which should be a test database')
+    parser.add_argument('--sqlite-path', help='database file of the SQLite backend, a temporary one if not given')
+    parser.add_argument('--output', help='JSON file to write, standard output if not given')
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    settings = {'clients': args.clients, 'duration': args.duration, 'mix': mix,
+                'duplicate_share': args.duplicate_share, 'think_time_ms': args.think_time_ms,
+                'catalogue_size': args.catalogue_size, 'writer_count': max(1, args.catalogue_size // 20),
+                'page_size': args.page_size, 'cache': args.cache, 'sample_interval': args.sample_interval,
+                'seed': args.seed}
+    dbconfig.BACKEND = args.backend
+    # The pool is created by the first handler, so the size is set before.
+    if args.pool_size is not None:
+        dbconfig.POOL_SIZE = args.pool_size
+    directory = None
+    if args.backend == 'sqlite':
+        if args.sqlite_path:
+            dbconfig.SQLITE_PATH = args.sqlite_path
+        else:
+            directory = tempfile.mkdtemp(prefix='bookrecords-loadtest-')
+            dbconfig.SQLITE_PATH = os.path.join(directory, 'loadtest.db')
+    try:
+        # The handlers print their progress. Send it to standard error so that standard output holds only the JSON.
+        with contextlib.redirect_stdout(sys.stderr):
+            results = LoadTest(settings).run()
+    finally:
+        # Only remove the directory if it was created here.
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {'started_at': started_at,
+              'backend': args.backend,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'settings': dict(settings, pool_size=dbconfig.POOL_SIZE),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+# To run the load test, run this module from command.
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import heapq
+import math
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+# Share of the trigrams of the query a record must contain to be suggested.
+DEFAULT_MIN_SIMILARITY = 0.5
+# Most records scored for one query, to keep the time of a query bounded on large catalogues.
+# The records are taken from the lists of the rarest trigrams first, which hold the best candidates.
+MAX_CANDIDATES = 1000
+
+
+def normalize_text(text):
+    """This method normalizes a text for matching: case insensitive, with single spaces between words. """
+    return ' '.join(str(text).casefold().split())
+
+
+def word_trigrams(word):
+    """This method returns the trigrams of one word. The word is padded with two spaces in front,
+    so the first trigrams ("  h", " ha") only match words starting with the same letters. """
+    padded = '  ' + word
+    return [padded[position:position + 3] for position in range(len(padded) - 2)]
+
+
+def text_trigrams(text):
+    """This method returns the set of trigrams of every word of a normalized text. """
+    trigrams = set()
+    for word in text.split():
+        trigrams.update(word_trigrams(word))
+    return trigrams
+
+
+class TrigramIndex:
+    """This class keeps an in-memory index of the trigrams of the book names and writers, for search as you type.
+    Each trigram maps to the compact array of the records containing it, so a query only looks at the records
+    sharing its rarest trigrams instead of every record. Matches are ranked by the share of the trigrams of the
+    query they contain, which tolerates typing mistakes, with a bonus when every word of the query starts a word
+    of the record. The index is built once and records are added as they are inserted and replaced as they are
+    updated.
+    All methods can be called from any thread. """
+
+    def __init__(self, min_similarity=DEFAULT_MIN_SIMILARITY):
+        """This is the constructor method. It creates an empty index. """
+        self.min_similarity = min_similarity
+        # Details of the records, by record number.
+        self.isbns = []
+        self.names = []
+        self.writers = []
+        # Normalized name and writer of the records, which the trigrams are taken from.
+        self.texts = []
+        self.record_numbers = {}
+        # Record numbers containing each trigram, in increasing order.
+        self.postings = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """This method returns the number of records in the index. """
+        return len(self.isbns)
+
+    def add(self, book_ISBN, book_name, book_writer):
+        """This method adds one record. A record whose ISBN is already indexed is ignored. """
+        book_ISBN = str(book_ISBN)
+        text = normalize_text(book_name + ' ' + book_writer)
+        with self.lock:
+            if book_ISBN in self.record_numbers:
+                return
+            self.append(book_ISBN, book_name, book_writer, text)
+
+    def append(self, book_ISBN, book_name, book_writer, text):
+        """This method adds a record which is not indexed yet. It must be called while holding the lock. """
+        record_number = len(self.isbns)
+        self.record_numbers[book_ISBN] = record_number
+        self.isbns.append(book_ISBN)
+        self.names.append(book_name)
+        self.writers.append(sys.intern(book_writer))
+        self.texts.append(text)
+        for trigram in text_trigrams(text):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                # Unsigned 32 bit record numbers take 4 bytes each instead of a Python integer.
+                posting = array('I')
+                self.postings[trigram] = posting
+            posting.append(record_number)
+
+    def update(self, book_ISBN, book_name, book_writer):
+        """This method replaces the name and writer of a record, keeping its record number, or adds the record
+        if its ISBN is not indexed yet. """
+        book_ISBN = str(book_ISBN)
+        text = normalize_text(book_name + ' ' + book_writer)
+        with self.lock:
+            record_number = self.record_numbers.get(book_ISBN)
+            if record_number is None:
+                self.append(book_ISBN, book_name, book_writer, text)
+                return
+            old_trigrams = text_trigrams(self.texts[record_number])
+            new_trigrams = text_trigrams(text)
+            self.names[record_number] = book_name
+            self.writers[record_number] = sys.intern(book_writer)
+            self.texts[record_number] = text
+            # Take the record out of the lists of the trigrams it lost, and put it in the lists of the
+            # trigrams it gained where its number belongs, so that every list stays ordered.
+            for trigram in old_trigrams - new_trigrams:
+                posting = self.postings[trigram]
+                del posting[bisect_left(posting, record_number)]
+                if not posting:
+                    del self.postings[trigram]
+            for trigram in new_trigrams - old_trigrams:
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    posting = array('I')
+                    self.postings[trigram] = posting
+                posting.insert(bisect_left(posting, record_number), record_number)
+
+    def add_rows(self, rows):
+        """This method adds records given as (ISBN, name, writer, genre) tuples, e.g. a chunk of stream_books. """
+        for row in rows:
+            self.add(row[0], row[1], row[2])
+
+    def add_books(self, books):
+        """This method adds records given as DTOs, e.g. the records just inserted.
+        The records flagged as updated replace the indexed name and writer of their ISBN. """
+        for book_data in books:
+            if book_data.store_flag == "updated":
+                self.update(book_data.book_ISBN, book_data.book_name, book_data.book_writer)
+            else:
+                self.add(book_data.book_ISBN, book_data.book_name, book_data.book_writer)
+
+    def search(self, query, limit=10):
+        """This method returns up to limit records matching the query, best first,
+        as (ISBN, name, writer) tuples. """
+        query = normalize_text(query)
+        query_words = query.split()
+        query_trigrams = text_trigrams(query)
+        if not query_trigrams:
+            return []
+        with self.lock:
+            # Without its trigrams, a record cannot reach the minimum similarity, so only the records in the
+            # rarest lists can. A record must be in at least one of the (trigrams - required + 1) rarest lists.
+            required = max(1, math.ceil(self.min_similarity * len(query_trigrams)))
+            postings = sorted((self.postings.get(trigram, ()) for trigram in query_trigrams), key=len)
+            rare_count = len(query_trigrams) - required + 1
+            # Count the trigrams shared by the candidates found in the rarest lists.
+            shared_counts = {}
+            for posting in postings[:rare_count]:
+                for record_number in islice(posting, MAX_CANDIDATES):
+                    shared_counts[record_number] = shared_counts.get(record_number, 0) + 1
+                if len(shared_counts) >= MAX_CANDIDATES:
+                    break
+            # Add the trigrams found in the other lists, looked up by bisection as the lists are ordered.
+            for posting in postings[rare_count:]:
+                posting_length = len(posting)
+                for record_number in shared_counts:
+                    position = bisect_left(posting, record_number)
+                    if position < posting_length and posting[position] == record_number:
+                        shared_counts[record_number] += 1
+
+            scored = []
+            for record_number, shared in shared_counts.items():
+                if shared < required:
+                    continue
+                score = shared / len(query_trigrams)
+                # Rank the records where the query is typed as a prefix of the words first.
+                text = self.texts[record_number]
+                record_words = text.split()
+                if all(any(word.startswith(query_word) for word in record_words) for query_word in query_words):
+                    score += 1
+                # Among equal scores, prefer the shorter texts, which match more of what was typed.
+                scored.append((score, -len(text), record_number))
+            best = heapq.nlargest(limit, scored)
+            return [(self.isbns[record_number], self.names[record_number], self.writers[record_number])
+                    for _, _, record_number in best]
+
+
+def build_index(sql_handler, fetch_size=5000):
+    """This method builds an index of every record stored, reading them in chunks through the handler.
+    The index also receives the records inserted while it is built and afterwards, through the insert
+    listeners of the handler, so it stays up to date. It is meant to run on a background worker. """
+    index = TrigramIndex()
+    # Listen before reading, so that no record inserted meanwhile is missed. A record read twice is ignored.
+    sql_handler.add_insert_listener(index.add_books)
+    try:
+        for rows in sql_handler.stream_books(fetch_size=fetch_size):
+            index.add_rows(rows)
+    except Exception:
+        # The index is given up, so stop feeding it.
+        sql_handler.remove_insert_listener(index.add_books)
+        raise
+    return index
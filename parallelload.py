@@ -0,0 +1,257 @@
+import argparse
+import bisect
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bookrecords import dbconfig
+from bookrecords.bookimport import BOOK_FIELDS, read_books
+from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import create_handler, get_handler_class
+from bookrecords.isbn import isbn_key
+
+# Shards made per worker process. More shards than workers keep every worker busy until the end
+# when some shards take longer than others.
+SHARDS_PER_WORKER = 2
+# Records read before the ISBN ranges of the shards are chosen. The ranges split these records evenly,
+# so the shards are of about the same size when the sample is like the rest of the file.
+SAMPLE_SIZE = 20000
+# Settings of dbconfig passed to the worker processes, which start from a fresh interpreter.
+WORKER_SETTINGS = ('BACKEND', 'SQLITE_PATH', 'MYSQL_CONFIG', 'POOL_SIZE', 'SLOW_QUERY_THRESHOLD')
+
+# Handler of a worker process, created by init_worker.
+_worker_handler = None
+
+
+def init_worker(settings):
+    """This method runs once in every worker process. It applies the settings of the parent process and creates
+    the handler of the worker, with its own connection. Connections are never shared with the parent process. """
+    global _worker_handler
+    for name, value in settings.items():
+        setattr(dbconfig, name, value)
+    # The workers print to standard error, like the handlers of the parent.
+    with contextlib.redirect_stdout(sys.stderr):
+        _worker_handler = create_handler()
+    _worker_handler.start_bulk_load()
+
+
+def load_shard(shard_path, report_path, batch_size):
+    """This method runs in a worker process. It inserts the records of a shard file in batches and writes the
+    records which were not inserted to a report file. It returns the outcome of the shard as a dictionary:
+    the count of records per flag, the counts per genre and per writer of the records inserted, and the time taken. """
+    started = time.perf_counter()
+    outcome_counts = {}
+    record_numbers = []
+
+    def read_shard(shard_file):
+        for line in shard_file:
+            record = json.loads(line)
+            record_numbers.append(record[0])
+            book_data = BookDTO()
+            book_data.book_ISBN, book_data.book_name, book_data.book_writer, book_data.book_genre = record[1:]
+            yield book_data
+
+    with contextlib.redirect_stdout(sys.stderr), open(shard_path, encoding='utf-8') as shard_file, \
+            open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+        report_writer = csv.writer(report_file)
+        # The DTOs come back in the order they were read, so the record numbers are taken in the same order.
+        for position, book_data in enumerate(_worker_handler.insert_books_to_db(read_shard(shard_file), batch_size)):
+            outcome_counts[book_data.store_flag] = outcome_counts.get(book_data.store_flag, 0) + 1
+            if book_data.store_flag != 'inserted':
+                report_writer.writerow([record_numbers[position]] + book_data.get_as_list() + [book_data.store_flag])
+    return {'shard': os.path.basename(shard_path),
+            'pid': os.getpid(),
+            'counts': outcome_counts,
+            'stats': _worker_handler.take_bulk_stats(),
+            'elapsed_s': round(time.perf_counter() - started, 3)}
+
+
+class ShardWriter:
+    """This class splits the records of a file into shard files by ranges of ISBN.
+    The ranges are chosen from a sample of the first records, so that the shards are of about the same size.
+    Records with the same ISBN always go to the same shard, so the worker of the shard finds the repeats of an
+    ISBN within the file, and the workers insert into separate ranges of the primary key. """
+
+    def __init__(self, directory, shard_count):
+        """This is the constructor method. The shard files are created in the directory. """
+        self.directory = directory
+        self.shard_count = shard_count
+        # Keys at which the next shard starts, chosen once the sample is read.
+        self.boundaries = None
+        self.sample = []
+        self.shard_files = []
+        self.shard_sizes = [0] * shard_count
+
+    def shard_path(self, shard):
+        """This method returns the path of a shard file. """
+        return os.path.join(self.directory, 'shard-{:03d}.jsonl'.format(shard))
+
+    def add(self, record_number, book_key, book_data):
+        """This method adds a record with a valid ISBN, given with its key. """
+        if self.boundaries is None:
+            self.sample.append((record_number, book_key, book_data))
+            if len(self.sample) >= SAMPLE_SIZE:
+                self.split_sample()
+            return
+        self.write(record_number, book_key, book_data)
+
+    def split_sample(self):
+        """This method chooses the ranges of the shards from the sample and writes the sample to the shards. """
+        keys = sorted(book_key for _, book_key, _ in self.sample)
+        self.boundaries = [keys[len(keys) * shard // self.shard_count] for shard in range(1, self.shard_count)] \
+            if keys else []
+        self.shard_files = [open(self.shard_path(shard), 'w', encoding='utf-8') for shard in range(self.shard_count)]
+        for record_number, book_key, book_data in self.sample:
+            self.write(record_number, book_key, book_data)
+        self.sample = []
+
+    def write(self, record_number, book_key, book_data):
+        """This method writes a record to the shard of its key. """
+        shard = bisect.bisect_right(self.boundaries, book_key)
+        self.shard_files[shard].write(json.dumps([record_number] + book_data.get_as_list()) + '\n')
+        self.shard_sizes[shard] += 1
+
+    def close(self):
+        """This method closes the shard files and returns the paths of the shards which have records,
+        largest first, so the longest shards are started first. """
+        if self.boundaries is None:
+            self.split_sample()
+        for shard_file in self.shard_files:
+            shard_file.close()
+        shards = sorted((shard for shard in range(self.shard_count) if self.shard_sizes[shard]),
+                        key=lambda shard: -self.shard_sizes[shard])
+        return [self.shard_path(shard) for shard in shards]
+
+
+def parallel_load(path, file_format=None, workers=None, batch_size=1000, defer_indexes=False, report_path=None):
+    """This method loads the records of a CSV or JSONL file into the database with several processes at once.
+    The file is split into shards by ranges of ISBN, and a pool of worker processes inserts the shards in batches,
+    each worker with its own connection. With defer_indexes, the indexes other than the primary key are dropped
+    during the load and built again at the end, which is faster for loads of a large part of the table.
+    The revision and the counts per genre and per writer of the records are written once, at the end.
+    It returns a summary with the count of records per flag and the timings. The records which were not inserted
+    are written to the report file, if a path is given, in the order of the file. """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    # Bring the schema up to date in this process before the workers start, so they do not race to migrate it.
+    with contextlib.redirect_stdout(sys.stderr):
+        sql_handler = create_handler()
+    directory = tempfile.mkdtemp(prefix='bookrecords-load-')
+    outcome_counts = {}
+    # Records rejected in this process, before sharding, as report rows.
+    rejected_rows = []
+    shard_results = []
+    try:
+        # Split the file. Records whose ISBN is not valid cannot be placed in a range and are reported here.
+        shard_writer = ShardWriter(directory, workers * SHARDS_PER_WORKER)
+        for record_number, book_data in enumerate(read_books(path, file_format), start=1):
+            book_key = None
+            if book_data.store_flag == 'new':
+                try:
+                    book_key = isbn_key(book_data.book_ISBN)
+                except ValueError:
+                    book_data.store_flag = 'invalid'
+            if book_key is None:
+                outcome_counts[book_data.store_flag] = outcome_counts.get(book_data.store_flag, 0) + 1
+                rejected_rows.append([record_number] + book_data.get_as_list() + [book_data.store_flag])
+                continue
+            shard_writer.add(record_number, book_key, book_data)
+        shard_paths = shard_writer.close()
+        split_s = time.perf_counter() - started
+
+        if defer_indexes:
+            sql_handler.drop_secondary_indexes()
+        bulk_stats = {}
+        completed = False
+        try:
+            settings = {name: getattr(dbconfig, name) for name in WORKER_SETTINGS}
+            # Start the workers from a fresh interpreter, so no connection of this process is inherited.
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_worker, initargs=(settings,)) as executor:
+                futures = [executor.submit(load_shard, shard_path, shard_path + '.report.csv', batch_size)
+                           for shard_path in shard_paths]
+                for future in as_completed(futures):
+                    shard_result = future.result()
+                    shard_results.append(shard_result)
+                    for store_flag, count in shard_result['counts'].items():
+                        outcome_counts[store_flag] = outcome_counts.get(store_flag, 0) + count
+                    for stat_key, count in shard_result['stats'].items():
+                        bulk_stats[stat_key] = bulk_stats.get(stat_key, 0) + count
+            completed = True
+        finally:
+            # Also after a failure, so the records inserted are complete and the indexes are back.
+            if defer_indexes:
+                sql_handler.create_secondary_indexes()
+            # The counts of a shard which failed are lost with its worker, so count everything again then.
+            sql_handler.finish_bulk_load(bulk_stats if completed else {})
+            if not completed:
+                sql_handler.rebuild_book_stats()
+            sql_handler.close_connection()
+
+        if report_path is not None:
+            write_report(report_path, rejected_rows, [shard_path + '.report.csv' for shard_path in shard_paths])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    elapsed_s = time.perf_counter() - started
+    inserted = outcome_counts.get('inserted', 0)
+    return {'records': sum(outcome_counts.values()),
+            'counts': outcome_counts,
+            'workers': workers,
+            'shards': len(shard_results),
+            'split_s': round(split_s, 3),
+            'elapsed_s': round(elapsed_s, 3),
+            'inserted_per_s': round(inserted / elapsed_s, 1) if elapsed_s else None,
+            'shard_results': sorted(({key: value for key, value in shard_result.items() if key != 'stats'}
+                                     for shard_result in shard_results), key=lambda result: result['shard'])}
+
+
+def write_report(report_path, rejected_rows, shard_report_paths):
+    """This method merges the rejected records of the parent and of every shard into one report file,
+    in the order of the records in the loaded file. """
+    rows = list(rejected_rows)
+    for shard_report_path in shard_report_paths:
+        if os.path.exists(shard_report_path):
+            with open(shard_report_path, newline='', encoding='utf-8') as shard_report:
+                rows.extend([int(row[0])] + row[1:] for row in csv.reader(shard_report))
+    rows.sort(key=lambda row: row[0])
+    with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+        report_writer = csv.writer(report_file)
+        report_writer.writerow(('record',) + BOOK_FIELDS + ('store_flag',))
+        report_writer.writerows(rows)
+
+
+def main(argv=None):
+    """This method is the command line entry point for loading a file of book records with several processes. """
+    parser = argparse.ArgumentParser(prog='python -m bookrecords.parallelload',
+                                     description='Load book records from a CSV or JSONL file with several processes.')
+    parser.add_argument('path', help='CSV file with a header line, or JSONL file with one record per line')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], dest='file_format',
+                        help='format of the file, taken from the extension if not given')
+    parser.add_argument('--workers', type=int, help='worker processes, one per CPU if not given')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records inserted per transaction')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop the secondary indexes during the load and build them again at the end')
+    parser.add_argument('--report', help='CSV file to write the outcome of every record that was not inserted')
+    args = parser.parse_args(argv)
+    try:
+        summary = parallel_load(args.path, args.file_format, args.workers, args.batch_size, args.defer_indexes,
+                                args.report)
+    except (get_handler_class().Error, OSError, ValueError) as e:
+        print('Error while loading', e, file=sys.stderr)
+        return 1
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+# Check whether the module is executed from command
+if __name__ == '__main__':
+    sys.exit(main())
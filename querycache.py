@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bookrecords import dbconfig
+from bookrecords.isbn import clean_isbn, normalize_isbn
+
+# Attributes of the DTO which make up the search criteria, in the order used in the cache keys.
+CRITERIA_FIELDS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+# Character at the end of a criteria value which makes it a prefix: "Harry*" finds every value starting with Harry.
+PREFIX_WILDCARD = '*'
+
+
+def normalize_value(value, field=None):
+    """This method normalizes one criteria value the way the database compares it:
+    surrounding spaces are ignored and the comparison is case insensitive.
+    A valid ISBN is turned to its ISBN-13 form, as the records are found by its key. """
+    value = str(value).strip().casefold()
+    if field == 'book_ISBN':
+        try:
+            return normalize_isbn(value)
+        except ValueError:
+            pass
+    return value
+
+
+def get_prefix(value, field=None):
+    """This method returns the text a prefix criteria value starts with, without the wildcard, or None if the value
+    is not a prefix. The separators of an ISBN prefix are removed, as the ISBNs are stored without them. """
+    if not isinstance(value, str) or not value.strip().endswith(PREFIX_WILDCARD):
+        return None
+    prefix = value.strip().rstrip(PREFIX_WILDCARD).strip()
+    return clean_isbn(prefix) if field == 'book_ISBN' else prefix
+
+
+def normalize_criteria(value, field=None):
+    """This method normalizes the criteria value of a field for the cache key of a search.
+    A list, tuple or set of values is kept as the sorted tuple of its normalized values, and a prefix keeps its
+    wildcard, so each shape of criteria has keys of its own. An empty criteria value is "". """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = {normalize_value(item, field) for item in value} - {''}
+        return tuple(sorted(values)) if values else ''
+    prefix = get_prefix(value, field)
+    if prefix is not None:
+        return prefix.casefold() + PREFIX_WILDCARD if prefix else ''
+    return normalize_value(value, field)
+
+
+def make_search_key(book_data):
+    """This method returns the cache key of a search with the criteria passed as a DTO. """
+    return ('search',) + tuple(normalize_criteria(getattr(book_data, field), field) for field in CRITERIA_FIELDS)
+
+
+def make_count_key(book_data=None):
+    """This method returns the cache key of the count of the records matching the criteria passed as a DTO,
+    or of all records without criteria. It is laid out like the key of the search, so the inserts drop it
+    in the same cases. """
+    if book_data is None:
+        return ('count',) + ('',) * len(CRITERIA_FIELDS)
+    return ('count',) + make_search_key(book_data)[1:]
+
+
+def search_key_matches(key, book_data):
+    """This method tells whether a record passed as a DTO would be found by the search of a cache key. """
+    for field, criteria_value in zip(CRITERIA_FIELDS, key[1:]):
+        if criteria_value == '':
+            continue
+        record_value = normalize_value(getattr(book_data, field), field)
+        if isinstance(criteria_value, tuple):
+            if record_value not in criteria_value:
+                return False
+        elif criteria_value.endswith(PREFIX_WILDCARD):
+            if not record_value.startswith(criteria_value[:-len(PREFIX_WILDCARD)]):
+                return False
+        elif criteria_value != record_value:
+            return False
+    return True
+
+
+class QueryCache:
+    """This class keeps the results of the read methods of the handlers in memory so that a repeated
+    read is answered without a database call.
+    The least recently used results are evicted when the cache holds too many results or too many rows,
+    and every result expires after a time to live, so changes by other clients show up eventually.
+    The write methods invalidate the results which the written records can change. """
+
+    def __init__(self, max_entries=None, max_rows=None, ttl=None):
+        """This is the constructor method. Any setting not passed is taken from dbconfig. """
+        self.max_entries = max_entries if max_entries is not None else dbconfig.CACHE_MAX_ENTRIES
+        self.max_rows = max_rows if max_rows is not None else dbconfig.CACHE_MAX_ROWS
+        self.ttl = ttl if ttl is not None else dbconfig.CACHE_TTL
+        # Cached results as key -> (expiry time, value, number of rows). The least recently used is first.
+        self.entries = OrderedDict()
+        self.row_count = 0
+        self.lock = threading.Lock()
+        # Counters to show how the cache is behaving.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """This method returns the cached value of a key, or None if it is not cached or expired. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self.remove(key)
+                self.misses += 1
+                return None
+            # Mark the entry as the most recently used.
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, rows, ttl=None):
+        """This method caches the value of a key. rows is the number of records in the value,
+        used to bound the memory held by the cache. ttl is the time to live of the value in seconds,
+        by default the one of the cache. """
+        if self.max_entries <= 0 or rows > self.max_rows:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value, rows)
+            self.row_count += rows
+            # Evict the least recently used entries until the cache is within its bounds.
+            while len(self.entries) > self.max_entries or self.row_count > self.max_rows:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        """This method removes a key. It must be called while holding the lock. """
+        entry = self.entries.pop(key)
+        self.row_count -= entry[2]
+
+    def invalidate_books(self, books):
+        """This method removes the cached results which can change because the records passed as DTOs were
+        written: the searches and counts which would find any of the records, and all pages and keyword searches.
+        The estimated count of all records is kept until it expires, as it is only an estimate. """
+        books = list(books)
+        if not books:
+            return
+        with self.lock:
+            for key in list(self.entries):
+                if key[0] == 'estimate':
+                    continue
+                if key[0] not in ('search', 'count') or any(search_key_matches(key, book_data)
+                                                            for book_data in books):
+                    self.remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """This method removes every cached result. """
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.row_count = 0
+
+    def get_stats(self):
+        """This method returns the counters of the cache as a dictionary. """
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'rows': self.row_count,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+
+# The process-wide caches, one per database. They are created on first use.
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_cache(key='default'):
+    """This method returns the process-wide query cache of a database, identified by key,
+    creating it on first use. """
+    with _shared_caches_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = QueryCache()
+            _shared_caches[key] = cache
+        return cache
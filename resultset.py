@@ -0,0 +1,63 @@
+import sys
+
+from bookrecords.booksdto import BookDTO
+
+# Column names of the books table in the order of the DTO attributes.
+BOOK_COLUMNS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+
+
+def row_to_dto(row):
+    """This method returns a record given as an (ISBN, name, writer, genre) tuple as a DTO. """
+    book_data = BookDTO()
+    book_data.book_ISBN, book_data.book_name, book_data.book_writer, book_data.book_genre = row
+    return book_data
+
+
+class BookResultSet:
+    """This class holds the records returned by a read method, one list per column.
+    Compared to a list of DTOs, no object is kept per record, and the writer and genre strings,
+    which repeat a lot, are interned so that each distinct value is stored once.
+    The column names are kept separately instead of as the first record.
+    Rows are produced as tuples only while iterating, ready to be inserted into a Treeview. """
+
+    __slots__ = ('columns', 'isbns', 'names', 'writers', 'genres')
+
+    def __init__(self, columns=BOOK_COLUMNS):
+        """This is the constructor method. It creates an empty result set with the given column names. """
+        self.columns = tuple(columns)
+        self.isbns = []
+        self.names = []
+        self.writers = []
+        self.genres = []
+
+    def append(self, row):
+        """This method adds one record given as a sequence of (ISBN, name, writer, genre). """
+        self.isbns.append(str(row[0]))
+        self.names.append(row[1])
+        self.writers.append(sys.intern(row[2]))
+        self.genres.append(sys.intern(row[3]))
+
+    def extend(self, rows):
+        """This method adds every record of a sequence of rows. """
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        """This method returns the number of records. """
+        return len(self.isbns)
+
+    def __iter__(self):
+        """This method iterates over the records as (ISBN, name, writer, genre) tuples. """
+        return zip(self.isbns, self.names, self.writers, self.genres)
+
+    def __getitem__(self, index):
+        """This method returns the record at an index as a tuple. """
+        return self.isbns[index], self.names[index], self.writers[index], self.genres[index]
+
+    def to_dto(self, index):
+        """This method returns the record at an index as a DTO. """
+        return row_to_dto(self[index])
+
+    def to_dtos(self):
+        """This method returns every record as a list of DTOs, for code which needs the DTOs. """
+        return [self.to_dto(index) for index in range(len(self))]
@@ -0,0 +1,252 @@
+import tkinter
+from itertools import islice
+from tkinter import ttk
+from tkinter.messagebox import showinfo
+
+from bookrecords.isbn import isbn_key
+
+
+def row_order_key(item_id):
+    """This method returns the number the pages of all records are ordered by for the ISBN of a row: its key.
+    A record kept with an invalid ISBN has a negative key which cannot be told from the ISBN, so it is placed
+    before the records with a valid ISBN, where the pages bring it. """
+    try:
+        return isbn_key(item_id)
+    except ValueError:
+        return -1
+
+
+class ResultsGrid:
+    """This class shows records in a Treeview which is filled lazily from a page iterator.
+    The widgets are created once and reused for every set of results.
+    Rows are inserted in small chunks between Tk events, the next page is only pulled when the user
+    scrolls near the end, and the rows scrolled far past are dropped, so the number of items held
+    by the Treeview stays bounded however large the result set is. The dropped rows are not read again
+    when scrolling back; their number is passed to the owner of the grid to tell the user. """
+
+    def __init__(self, parent, chunk_size=100, max_items=2000, prefetch_at=0.9):
+        """This is the constructor method. It creates the widgets of the grid within the parent.
+        chunk_size is the number of rows inserted per Tk event, max_items the number of rows kept in the
+        Treeview and prefetch_at the scroll position after which the next page is pulled. """
+        self.chunk_size = chunk_size
+        self.max_items = max_items
+        self.prefetch_at = prefetch_at
+        # Iterator of pages being shown. Each page is an iterable of row tuples, e.g. a result set.
+        self.pages = None
+        # Iterator over the rows of the current page which are not inserted yet. None when all are inserted.
+        self.pending_rows = None
+        # Callback identifier of the scheduled chunk insertion, if any.
+        self.after_id = None
+        # Number of rows inserted since the last load and whether the page iterator is used up.
+        self.row_count = 0
+        self.exhausted = True
+        # Number of the first rows dropped to keep max_items rows, since the last load.
+        self.dropped_count = 0
+        # Method called with the row count, the exhausted flag and the dropped count whenever rows are added.
+        self.on_rows_added = None
+        # Background worker used to pull pages without blocking Tk, and the channel of its page jobs.
+        # When no worker is set, pages are pulled directly on the Tk thread.
+        self.worker = None
+        self.channel = 'results'
+        # Whether a page is being pulled by the worker.
+        self.loading = False
+        # Whether the pages come in order of ISBN, and the method telling whether a changed record belongs to the
+        # results shown, if not all records do. Both are used to merge changes into the rows shown.
+        self.ordered = False
+        self.row_filter = None
+
+        # Create a LabelFrame for the results
+        self.container = ttk.LabelFrame(parent, text="Records found")
+        # Create a TreeView representation within the LabelFrame area. The columns are set on load.
+        self.tree = ttk.Treeview(self.container, show='headings')
+        # Bind the method with TreeViewSelect event.
+        self.tree.bind('<<TreeviewSelect>>', self.item_selected)
+        # Place the TreeView at 0,0 position and stacking from top left and let it fill the frame.
+        self.tree.grid(row=0, column=0, sticky='NSEW')
+        self.container.rowconfigure(0, weight=1)
+        self.container.columnconfigure(0, weight=1)
+        # add a vertical scrollbar to the LabelFrame
+        self.scrollbar = ttk.Scrollbar(self.container, orient=tkinter.VERTICAL, command=self.tree.yview)
+        # Route the scroll position through the grid to know when the end is near.
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        # Stack the scrollbar on right side
+        self.scrollbar.grid(row=0, column=1, sticky='NS')
+
+    def place(self, **kwargs):
+        """This method places the grid on its parent with the given position and dimension. """
+        self.container.place(**kwargs)
+
+    def set_columns(self, columns):
+        """This method sets the column headings of the Treeview. """
+        columns = tuple(columns)
+        if tuple(self.tree['columns']) == columns:
+            return
+        self.tree.configure(columns=columns)
+        # define headings texts with same value from the columns list
+        for column in columns:
+            self.tree.heading(column, text=column)
+            # Place the heading as center aligned
+            self.tree.column(column, anchor=tkinter.CENTER)
+
+    def clear(self):
+        """This method removes the rows shown and stops reading the previous page iterator. """
+        if self.after_id is not None:
+            self.tree.after_cancel(self.after_id)
+            self.after_id = None
+        # Drop the page being pulled for the previous results, if any.
+        if self.loading and self.worker is not None:
+            self.worker.cancel(self.channel)
+        self.loading = False
+        self.pages = None
+        self.pending_rows = None
+        self.row_count = 0
+        self.exhausted = True
+        self.dropped_count = 0
+        # Delete the existing items instead of creating a new Treeview.
+        self.tree.delete(*self.tree.get_children())
+
+    def load(self, columns, pages, ordered=False, row_filter=None):
+        """This method shows the rows of a new page iterator, replacing the rows shown before.
+        Only the first page is pulled now. The following pages are pulled as the user scrolls.
+        ordered tells that the pages come in order of ISBN and row_filter is called with a row tuple to tell
+        whether a record changed later belongs to these results, see merge_rows. """
+        self.clear()
+        self.ordered = ordered
+        self.row_filter = row_filter
+        self.set_columns(columns)
+        self.pages = iter(pages)
+        self.exhausted = False
+        self.tree.yview_moveto(0)
+        self.pull_page()
+
+    def pull_page(self):
+        """This method takes the next page from the page iterator and schedules its rows for insertion.
+        With a worker, the page is taken on a worker thread as reading it may query the database. """
+        if self.pages is None or self.exhausted or self.pending_rows is not None or self.loading:
+            return
+        if self.worker is None:
+            self.page_loaded(next(self.pages, None))
+            return
+        self.loading = True
+        pages = self.pages
+        self.worker.submit(lambda sql_handler: next(pages, None), self.page_loaded, self.page_failed,
+                           channel=self.channel)
+
+    def page_loaded(self, rows):
+        """This method receives a page taken from the page iterator. None means that there are no more pages. """
+        self.loading = False
+        if rows is None:
+            self.exhausted = True
+            self.notify()
+            return
+        # Read the rows straight from the page as they are inserted, without copying them first.
+        self.pending_rows = iter(rows)
+        self.schedule_chunk()
+
+    def page_failed(self, error):
+        """This method stops pulling pages when reading a page failed. """
+        print("Error while reading page", error)
+        self.loading = False
+        self.exhausted = True
+        self.notify()
+
+    def schedule_chunk(self):
+        """This method schedules the insertion of the next chunk of rows unless one is already scheduled. """
+        if self.after_id is None and self.pending_rows is not None:
+            self.after_id = self.tree.after_idle(self.insert_chunk)
+
+    def insert_chunk(self):
+        """This method inserts one chunk of the pending rows, then yields to Tk before the next chunk
+        so that the window keeps responding while a page is being inserted. """
+        self.after_id = None
+        chunk = list(islice(self.pending_rows, self.chunk_size))
+        for row in chunk:
+            self.insert_row(tkinter.END, row)
+        self.row_count += len(chunk)
+        self.trim()
+        if len(chunk) < self.chunk_size:
+            # The page is used up. Pull the next one at once if the rows do not fill the view yet.
+            self.pending_rows = None
+            if self.tree.yview()[1] >= self.prefetch_at:
+                self.pull_page()
+        self.notify()
+        self.schedule_chunk()
+
+    def insert_row(self, position, row):
+        """This method inserts a row at a position of the Treeview. The ISBN is used as the item identifier,
+        so a changed record can be found among the rows shown. A row already shown, e.g. merged as a change
+        before its page was pulled, is updated instead. """
+        item_id = str(row[0])
+        if self.tree.exists(item_id):
+            self.tree.item(item_id, values=row)
+        else:
+            self.tree.insert('', position, iid=item_id, values=row)
+
+    def merge_rows(self, rows):
+        """This method merges changed records into the rows shown, without reloading them.
+        A record shown is updated in place. A new record is added if it belongs to the results: at its place
+        in order of ISBN for ordered results, unless the pages still to be pulled will bring it or it falls among
+        the rows dropped from the top, or at the end otherwise. It returns the number of rows updated or added. """
+        merged = 0
+        for row in rows:
+            item_id = str(row[0])
+            if self.tree.exists(item_id):
+                self.tree.item(item_id, values=row)
+                merged += 1
+                continue
+            if self.pages is None or (self.row_filter is not None and not self.row_filter(row)):
+                continue
+            position = tkinter.END
+            if self.ordered:
+                items = self.tree.get_children()
+                # Compare the keys of the records, the order of the pages, rather than the ISBN texts.
+                order_key = row_order_key(item_id)
+                if not self.exhausted and (not items or order_key > row_order_key(items[-1])):
+                    # The record comes after the rows shown, so it is in a page still to be pulled.
+                    continue
+                if self.dropped_count and items and order_key < row_order_key(items[0]):
+                    # The record comes before the first row shown, among the rows dropped to keep max_items rows.
+                    # Adding it on top would only have it dropped again by trim.
+                    continue
+                # Find the place of the record among the rows shown by bisection on their keys.
+                low, high = 0, len(items)
+                while low < high:
+                    middle = (low + high) // 2
+                    if row_order_key(items[middle]) < order_key:
+                        low = middle + 1
+                    else:
+                        high = middle
+                position = low
+            self.tree.insert('', position, iid=item_id, values=row)
+            self.row_count += 1
+            merged += 1
+        if merged:
+            self.trim()
+        return merged
+
+    def trim(self):
+        """This method drops the oldest rows when more than max_items rows are held, and counts them. """
+        items = self.tree.get_children()
+        if len(items) > self.max_items:
+            self.tree.delete(*items[:len(items) - self.max_items])
+            self.dropped_count += len(items) - self.max_items
+
+    def notify(self):
+        """This method tells the owner of the grid how many rows were added and dropped so far. """
+        if self.on_rows_added is not None:
+            self.on_rows_added(self.row_count, self.exhausted and self.pending_rows is None, self.dropped_count)
+
+    def on_scroll(self, first, last):
+        """This method is called by the Treeview whenever the visible part changes.
+        It updates the scrollbar and pulls the next page when the end of the rows comes into view. """
+        self.scrollbar.set(first, last)
+        if float(last) >= self.prefetch_at:
+            self.pull_page()
+
+    def item_selected(self, event):
+        """This method handles the event when one row of the TreeView is clicked. """
+        for selected_item in self.tree.selection():
+            item = self.tree.item(selected_item)
+            record = str(item['values'])
+            # show a message
+            showinfo(title='Information', message=''.join(record))
@@ -0,0 +1,355 @@
+import threading
+
+from bookrecords.booksdto import content_hash
+from bookrecords.isbn import normalize_isbn
+
+# Records whose key or hash is computed per round trip by the migrations which fill a new column.
+BACKFILL_BATCH_SIZE = 1000
+
+# Statements which count the records per genre and per writer into the summary table, for every backend.
+# The summary table groups the values the way the books table compares them, case insensitively.
+REBUILD_GENRE_STATS = "INSERT INTO book_stats (stat_kind, stat_value, book_count) \
+                       SELECT 'genre', MIN(book_genre), COUNT(*) FROM books GROUP BY book_genre"
+REBUILD_WRITER_STATS = "INSERT INTO book_stats (stat_kind, stat_value, book_count) \
+                        SELECT 'writer', MIN(book_writer), COUNT(*) FROM books GROUP BY book_writer"
+
+# Table with a single row holding the revision of the last change to the books table.
+# Every write transaction takes the next revision from it. The row stays locked until the transaction ends,
+# so the revisions are committed in increasing order and a reader never misses a change below the highest
+# revision it has seen.
+CREATE_REVISION_TABLE = "CREATE TABLE IF NOT EXISTS book_revision (revision BIGINT NOT NULL)"
+
+# The versioned changes of the database schema. Each migration is (version, description, statements).
+# A statement is either SQL text or a method called with the connection and a cursor, for the steps which
+# compute values in Python. Such a method is defined below the lists.
+# Migrations are applied in order of version and each is applied once per database.
+# Never change a migration which was released. Add a new one with the next version instead,
+# to the list of every backend so that the versions mean the same schema everywhere.
+MYSQL_MIGRATIONS = [
+    (1, 'Create books table',
+     ["CREATE TABLE IF NOT EXISTS books (\
+          book_ISBN VARCHAR(20) NOT NULL,\
+          book_name VARCHAR(100) NOT NULL,\
+          book_writer VARCHAR(100) NOT NULL,\
+          book_genre VARCHAR(100) NOT NULL,\
+          PRIMARY KEY (book_ISBN));"]),
+    (2, 'Add indexes for search by writer and by genre',
+     ["CREATE INDEX idx_books_writer ON books (book_writer)",
+      "CREATE INDEX idx_books_genre ON books (book_genre)"]),
+    (3, 'Add full-text index for keyword search on name and writer',
+     ["CREATE FULLTEXT INDEX ftx_books_name_writer ON books (book_name, book_writer)"]),
+    (4, 'Key books by the ISBN-13 as a number',
+     # Adding a nullable column does not copy the table, so the records stay readable and writable.
+     ["ALTER TABLE books ADD COLUMN book_key BIGINT NULL FIRST",
+      lambda connection, cursor: backfill_mysql_book_keys(connection, cursor),
+      # Swapping the primary key rebuilds the table in place, while the records stay readable.
+      "ALTER TABLE books MODIFY book_key BIGINT NOT NULL, DROP PRIMARY KEY, ADD PRIMARY KEY (book_key),\
+          ADD INDEX idx_books_isbn (book_ISBN)",
+      "UPDATE books SET book_ISBN = LPAD(book_key, 13, '0') WHERE book_key > 0"]),
+    (5, 'Add summary table of the number of books per genre and per writer',
+     ["CREATE TABLE IF NOT EXISTS book_stats (\
+          stat_kind VARCHAR(10) NOT NULL,\
+          stat_value VARCHAR(100) NOT NULL,\
+          book_count BIGINT NOT NULL,\
+          PRIMARY KEY (stat_kind, stat_value));",
+      # Count the records stored before the table existed. The inserts keep the counts up to date from here.
+      "DELETE FROM book_stats",
+      REBUILD_GENRE_STATS,
+      REBUILD_WRITER_STATS]),
+    (6, 'Add revision of the last change to every record',
+     # The records stored before are revision 0. The index also holds the key, which orders a revision.
+     ["ALTER TABLE books ADD COLUMN book_revision BIGINT NOT NULL DEFAULT 0",
+      "CREATE INDEX idx_books_revision ON books (book_revision)",
+      CREATE_REVISION_TABLE,
+      "DELETE FROM book_revision",
+      "INSERT INTO book_revision (revision) VALUES (0)"]),
+    (7, 'Add hash of the details of every record',
+     ["ALTER TABLE books ADD COLUMN book_hash CHAR(16) NULL",
+      lambda connection, cursor: backfill_book_hashes(connection, cursor)]),
+]
+
+# The same schema for SQLite. The text columns compare case insensitively like the MySQL default collation,
+# and keyword search uses an FTS5 table kept in step with the books table by triggers.
+SQLITE_MIGRATIONS = [
+    (1, 'Create books table',
+     ["CREATE TABLE IF NOT EXISTS books (\
+          book_ISBN VARCHAR(20) NOT NULL COLLATE NOCASE,\
+          book_name VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          book_writer VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          book_genre VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          PRIMARY KEY (book_ISBN));"]),
+    (2, 'Add indexes for search by writer and by genre',
+     ["CREATE INDEX IF NOT EXISTS idx_books_writer ON books (book_writer)",
+      "CREATE INDEX IF NOT EXISTS idx_books_genre ON books (book_genre)"]),
+    (3, 'Add full-text index for keyword search on name and writer',
+     ["CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(\
+          book_name, book_writer, content='books', content_rowid='rowid')",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN\
+          INSERT INTO books_fts (books_fts, rowid, book_name, book_writer)\
+          VALUES ('delete', old.rowid, old.book_name, old.book_writer);\
+      END",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN\
+          INSERT INTO books_fts (books_fts, rowid, book_name, book_writer)\
+          VALUES ('delete', old.rowid, old.book_name, old.book_writer);\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END",
+      # Index the records stored before the table existed.
+      "INSERT INTO books_fts (books_fts) VALUES ('rebuild')"]),
+    # SQLite cannot change the primary key of a table, so the records are copied to a new table.
+    # An INTEGER PRIMARY KEY is the rowid of SQLite itself, so the key takes no room of its own.
+    (4, 'Key books by the ISBN-13 as a number',
+     ["DROP TABLE IF EXISTS books_keyed",
+      "CREATE TABLE books_keyed (\
+          book_key INTEGER PRIMARY KEY,\
+          book_ISBN VARCHAR(20) NOT NULL COLLATE NOCASE,\
+          book_name VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          book_writer VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          book_genre VARCHAR(100) NOT NULL COLLATE NOCASE)",
+      lambda connection, cursor: copy_sqlite_book_keys(connection, cursor),
+      # Dropping the table drops its indexes and triggers as well. They are created again on the new table.
+      "DROP TABLE books",
+      "ALTER TABLE books_keyed RENAME TO books",
+      "CREATE INDEX IF NOT EXISTS idx_books_writer ON books (book_writer)",
+      "CREATE INDEX IF NOT EXISTS idx_books_genre ON books (book_genre)",
+      "CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (book_ISBN)",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN\
+          INSERT INTO books_fts (books_fts, rowid, book_name, book_writer)\
+          VALUES ('delete', old.rowid, old.book_name, old.book_writer);\
+      END",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN\
+          INSERT INTO books_fts (books_fts, rowid, book_name, book_writer)\
+          VALUES ('delete', old.rowid, old.book_name, old.book_writer);\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END",
+      # The rowids of the records changed, so index them again.
+      "INSERT INTO books_fts (books_fts) VALUES ('rebuild')"]),
+    (5, 'Add summary table of the number of books per genre and per writer',
+     ["CREATE TABLE IF NOT EXISTS book_stats (\
+          stat_kind VARCHAR(10) NOT NULL,\
+          stat_value VARCHAR(100) NOT NULL COLLATE NOCASE,\
+          book_count BIGINT NOT NULL,\
+          PRIMARY KEY (stat_kind, stat_value));",
+      "DELETE FROM book_stats",
+      REBUILD_GENRE_STATS,
+      REBUILD_WRITER_STATS]),
+    (6, 'Add revision of the last change to every record',
+     # The index holds the rowid as well, which is the key.
+     ["ALTER TABLE books ADD COLUMN book_revision BIGINT NOT NULL DEFAULT 0",
+      "CREATE INDEX IF NOT EXISTS idx_books_revision ON books (book_revision)",
+      CREATE_REVISION_TABLE,
+      "DELETE FROM book_revision",
+      "INSERT INTO book_revision (revision) VALUES (0)"]),
+    (7, 'Add hash of the details of every record',
+     ["ALTER TABLE books ADD COLUMN book_hash CHAR(16) NULL",
+      # Only index the record again when the indexed columns change, not when the hash or the genre does.
+      "DROP TRIGGER IF EXISTS books_fts_update",
+      "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF book_name, book_writer ON books BEGIN\
+          INSERT INTO books_fts (books_fts, rowid, book_name, book_writer)\
+          VALUES ('delete', old.rowid, old.book_name, old.book_writer);\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END",
+      lambda connection, cursor: backfill_book_hashes(connection, cursor, placeholder='?')]),
+]
+
+# The indexes of the books table other than the primary key, as created by the migrations above, as
+# (drop statement, create statement) pairs. They are dropped and created again around a bulk load.
+# Keep them in step with the migrations when an index is added.
+MYSQL_SECONDARY_INDEXES = [
+    ("DROP INDEX idx_books_writer ON books", "CREATE INDEX idx_books_writer ON books (book_writer)"),
+    ("DROP INDEX idx_books_genre ON books", "CREATE INDEX idx_books_genre ON books (book_genre)"),
+    ("DROP INDEX idx_books_isbn ON books", "CREATE INDEX idx_books_isbn ON books (book_ISBN)"),
+    ("DROP INDEX idx_books_revision ON books", "CREATE INDEX idx_books_revision ON books (book_revision)"),
+    ("DROP INDEX ftx_books_name_writer ON books",
+     "CREATE FULLTEXT INDEX ftx_books_name_writer ON books (book_name, book_writer)"),
+]
+
+# The same for SQLite. The full-text table is kept in step by a trigger, which is dropped instead,
+# and the full-text table is indexed again in one pass at the end.
+SQLITE_SECONDARY_INDEXES = [
+    ("DROP INDEX IF EXISTS idx_books_writer", "CREATE INDEX IF NOT EXISTS idx_books_writer ON books (book_writer)"),
+    ("DROP INDEX IF EXISTS idx_books_genre", "CREATE INDEX IF NOT EXISTS idx_books_genre ON books (book_genre)"),
+    ("DROP INDEX IF EXISTS idx_books_isbn", "CREATE INDEX IF NOT EXISTS idx_books_isbn ON books (book_ISBN)"),
+    ("DROP INDEX IF EXISTS idx_books_revision",
+     "CREATE INDEX IF NOT EXISTS idx_books_revision ON books (book_revision)"),
+    ("DROP TRIGGER IF EXISTS books_fts_insert",
+     "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN\
+          INSERT INTO books_fts (rowid, book_name, book_writer)\
+          VALUES (new.rowid, new.book_name, new.book_writer);\
+      END"),
+    (None, "INSERT INTO books_fts (books_fts) VALUES ('rebuild')"),
+]
+
+# Table recording the migrations applied to the database.
+CREATE_VERSION_TABLE = "CREATE TABLE IF NOT EXISTS schema_version (\
+                          version INT NOT NULL,\
+                          description VARCHAR(200) NOT NULL,\
+                          applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,\
+                          PRIMARY KEY (version));"
+
+# Databases whose schema was brought up to date by this process, by the schema key of the handler.
+_ready_schemas = set()
+_schema_lock = threading.Lock()
+
+
+def keyed_isbn_batches(cursor, key_query, placeholder='%s'):
+    """This method reads the ISBNs of the books table in order, one batch at a time, and yields each batch as a list
+    of (key, ISBN to store, ISBN stored) tuples. key_query returns the ISBN and the key already set, if any.
+    A valid ISBN is keyed by its ISBN-13 as a number and stored as the ISBN-13. The first record keeps the key when
+    several records are forms of the same ISBN. The later ones and the records whose ISBN is not valid are kept
+    as they are, with negative keys which no ISBN has, and reported so they can be corrected. """
+    used_keys = set()
+    legacy_key = 0
+    legacy_count = 0
+    last_isbn = None
+    while True:
+        # Seek past the last ISBN read, so that each batch is a short query on the primary key.
+        if last_isbn is None:
+            cursor.execute((key_query + " ORDER BY book_ISBN LIMIT {0}").format(placeholder), (BACKFILL_BATCH_SIZE,))
+        else:
+            cursor.execute((key_query + " WHERE book_ISBN > {0} ORDER BY book_ISBN LIMIT {0}").format(placeholder),
+                           (last_isbn, BACKFILL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_isbn = rows[-1][0]
+        batch = []
+        for book_ISBN, book_key in rows:
+            if book_key is not None:
+                # Keyed by an earlier run which was interrupted.
+                used_keys.add(book_key)
+                legacy_key = min(legacy_key, book_key)
+                continue
+            try:
+                stored_isbn = normalize_isbn(book_ISBN)
+                book_key = int(stored_isbn)
+            except ValueError:
+                book_key = None
+            if book_key is None or book_key in used_keys:
+                legacy_key -= 1
+                legacy_count += 1
+                book_key = legacy_key
+                stored_isbn = book_ISBN
+            used_keys.add(book_key)
+            batch.append((book_key, stored_isbn, book_ISBN))
+        yield batch
+    if legacy_count:
+        print("Records kept with an invalid or repeated ISBN:", legacy_count)
+
+
+def backfill_mysql_book_keys(connection, cursor):
+    """This method sets the key of every record of the MySQL table, one batch per transaction,
+    so that the records stay writable while the migration runs. """
+    for batch in keyed_isbn_batches(cursor, "SELECT book_ISBN, book_key FROM books"):
+        # The ISBN is the primary key until the key replaces it, so the ISBNs are rewritten afterwards.
+        cursor.executemany("UPDATE books SET book_key = %s WHERE book_ISBN = %s",
+                           [(book_key, book_ISBN) for book_key, stored_isbn, book_ISBN in batch])
+        connection.commit()
+
+
+def copy_sqlite_book_keys(connection, cursor):
+    """This method copies every record of the SQLite table to the new table with its key. """
+    for batch in keyed_isbn_batches(cursor, "SELECT book_ISBN, NULL FROM books", placeholder='?'):
+        cursor.executemany("INSERT INTO books_keyed (book_key, book_ISBN, book_name, book_writer, book_genre) "
+                           "SELECT ?, ?, book_name, book_writer, book_genre FROM books WHERE book_ISBN = ?", batch)
+
+
+def backfill_book_hashes(connection, cursor, placeholder='%s'):
+    """This method sets the hash of every record which has none, one batch per transaction,
+    so that the records stay writable while the migration runs. """
+    last_key = None
+    while True:
+        # Seek past the last key read, so that each batch is a short query on the primary key.
+        if last_key is None:
+            cursor.execute(("SELECT book_key, book_name, book_writer, book_genre FROM books WHERE book_hash IS NULL "
+                            "ORDER BY book_key LIMIT {0}").format(placeholder), (BACKFILL_BATCH_SIZE,))
+        else:
+            cursor.execute(("SELECT book_key, book_name, book_writer, book_genre FROM books "
+                            "WHERE book_key > {0} AND book_hash IS NULL ORDER BY book_key LIMIT {0}")
+                           .format(placeholder), (last_key, BACKFILL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_key = rows[-1][0]
+        cursor.executemany("UPDATE books SET book_hash = {0} WHERE book_key = {0}".format(placeholder),
+                           [(content_hash(book_name, book_writer, book_genre), book_key)
+                            for book_key, book_name, book_writer, book_genre in rows])
+        connection.commit()
+
+
+def get_applied_version(connection):
+    """This method returns the highest migration version recorded in the database, 0 if none. """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CREATE_VERSION_TABLE)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def apply_migrations(connection, migrations, placeholder='%s', ignore_error=None):
+    """This method applies the migrations which are not yet recorded in the database and returns the version.
+    ignore_error is called with an error raised by a statement and returns True if the error only means that
+    the statement was already applied by an earlier run, e.g. an index which already exists. """
+    applied_version = get_applied_version(connection)
+    cursor = connection.cursor()
+    try:
+        for version, description, statements in migrations:
+            if version <= applied_version:
+                continue
+            print("Applying schema migration", version, "-", description)
+            for statement in statements:
+                try:
+                    if callable(statement):
+                        statement(connection, cursor)
+                    else:
+                        cursor.execute(statement)
+                except Exception as e:
+                    if ignore_error is None or not ignore_error(e):
+                        raise
+            # Record the version so that the migration is not applied again.
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES ({0}, {0})".format(placeholder),
+                           (version, description))
+            connection.commit()
+            applied_version = version
+        return applied_version
+    finally:
+        cursor.close()
+
+
+def ensure_schema(repository):
+    """This method brings the schema of the database of a handler up to date once per process.
+    Later calls return at once. It returns True when the schema is up to date and False if the migration failed. """
+    schema_key = repository.schema_key()
+    if schema_key in _ready_schemas:
+        return True
+    with _schema_lock:
+        if schema_key not in _ready_schemas:
+            try:
+                repository.migrate_schema()
+                _ready_schemas.add(schema_key)
+            except repository.Error as e:
+                print("Error while migrating schema", e)
+    return schema_key in _ready_schemas
+
+
+# To bring the schema up to date without starting the application, run this module from command.
+if __name__ == '__main__':
+    from bookrecords.bookrepository import create_handler
+    schema_handler = create_handler()
+    try:
+        schema_handler.ensure_connection()
+        print("Schema version", schema_handler.migrate_schema())
+    finally:
+        schema_handler.close_connection()
@@ -1,213 +1,144 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+from bookrecords import dbconfig
 from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import INSERT_QUERY, BookRepository
+# The helpers below moved to bookrepository. They are imported here so that existing imports keep working.
+from bookrecords.bookrepository import SEARCH_FIELDS, build_search_criteria, decode_page_token, encode_page_token
+from bookrecords.connectionpool import ConnectionPool, get_shared_pool
+from bookrecords.schema import MYSQL_MIGRATIONS, MYSQL_SECONDARY_INDEXES, apply_migrations
 
+# Error number of MySQL when a row with the same primary key already exists.
+DUPLICATE_ENTRY = 1062
+# Error number of MySQL when an index with the same name already exists.
+DUPLICATE_KEY_NAME = 1061
+# Error number of MySQL when a column with the same name already exists.
+DUPLICATE_FIELD_NAME = 1060
 
-class SQLHandler:
-    """This class contains the variables and methods to interact with database through SQL queries. """
 
-    def __init__(self):
-        """This is the constructor method. It initiates the connection instance with the database. """
-        try:
-            # Create the connection instance as a class level variable by calling "connect" method
-            # and supplying the connection details and credentials.
-            self.connection = mysql.connector.connect(host='localhost',
-                                                      port='3306',
-                                                      database='pythonapps',
-                                                      user='pythonuser',
-                                                      password='Welcome1')
-            if self.connection.is_connected():
-                db_Info = self.connection.get_server_info()
-                print("Connected to MySQL Server version ", db_Info)
-
-        # Handle exception if connectivity fails
-        except Error as e:
-            print("Error while connecting to MySQL", e)
-
-    def create_book_table(self):
-        """This method handles creation of the required table in database. """
-        # Check that the connection is already established.
-        # If not, call the class constructor to initiate connection.
-        if not self.connection.is_connected():
-            self.__init__()
-        # Get cursor from connection.
+def connect_mysql():
+    """This method opens a new connection to the MySQL server with the configured details. """
+    connection = mysql.connector.connect(**dbconfig.MYSQL_CONFIG)
+    print("Connected to MySQL Server version ", connection.get_server_info())
+    return connection
+
+
+def create_mysql_pool():
+    """This method creates the connection pool of the MySQL server. """
+    return ConnectionPool(connect=connect_mysql,
+                          # A cheap round trip to the server which does not reconnect by itself.
+                          ping=lambda connection: connection.ping(reconnect=False),
+                          error_class=Error,
+                          exhausted_error=PoolError)
+
+
+class SQLHandler(BookRepository):
+    """This class contains the variables and methods to interact with MySQL database through SQL queries. """
+
+    Error = Error
+    placeholder = '%s'
+    backend_name = 'mysql'
+    stats_upsert_query = "INSERT INTO book_stats (stat_kind, stat_value, book_count) VALUES (%s, %s, %s) " \
+                         "ON DUPLICATE KEY UPDATE book_count = book_count + VALUES(book_count)"
+    merge_upsert_query = INSERT_QUERY + " ON DUPLICATE KEY UPDATE book_name = VALUES(book_name), " \
+                                        "book_writer = VALUES(book_writer), book_genre = VALUES(book_genre), " \
+                                        "book_revision = VALUES(book_revision), book_hash = VALUES(book_hash)"
+    secondary_indexes = MYSQL_SECONDARY_INDEXES
+    # The row count kept by InnoDB in the table statistics. It is refreshed by the server as the table changes
+    # and may be off by some percent, but it is read without touching the rows.
+    estimate_count_query = "SELECT TABLE_ROWS FROM information_schema.TABLES " \
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'books'"
+
+    def get_default_pool(self):
+        """This method returns the process-wide connection pool of the MySQL server. """
+        return get_shared_pool(self.schema_key(), create_mysql_pool)
+
+    def schema_key(self):
+        """This method returns a key which identifies the configured MySQL database. """
+        return 'mysql:{host}:{port}/{database}'.format(**dbconfig.MYSQL_CONFIG)
+
+    def migrate_schema(self):
+        """This method applies the migrations which are not yet recorded in the database and returns the version.
+        A named lock on the server keeps two processes from migrating at the same time. """
         cursor = self.connection.cursor()
-        # Set the creation query as a variable. Notice that the query itself checks for existence of the table.
-        # Checking the existence of the table in database is cheaper than checking in application.
-        # Set the "book_ISBN" attribute as the primary key
-        create_query = "CREATE TABLE IF NOT EXISTS books (\
-                          book_ISBN VARCHAR(20) NOT NULL,\
-                          book_name VARCHAR(100) NOT NULL,\
-                          book_writer VARCHAR(100) NOT NULL,\
-                          book_genre VARCHAR(100) NOT NULL,\
-                          PRIMARY KEY (book_ISBN));"
-        # Enclose database call within try and except block
         try:
-            # Execute the create query
-            cursor.execute(create_query)
-            # Return true to indicate that creation was successful
-            return True
-        except Error as e:
-            print("Error while creating table", e)
-            # Close the cursor if error.
+            cursor.execute("SELECT GET_LOCK('bookrecords_schema', 30)")
+            cursor.fetchone()
+            # An index or a column may have been created by an earlier run which failed before recording the version.
+            return apply_migrations(self.connection, MYSQL_MIGRATIONS,
+                                    ignore_error=lambda e: getattr(e, 'errno', None) in (DUPLICATE_KEY_NAME,
+                                                                                         DUPLICATE_FIELD_NAME))
+        finally:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK('bookrecords_schema')")
+                cursor.fetchone()
+            except Error:
+                # The lock is released by the server anyway when the connection is gone.
+                pass
             cursor.close()
-            # Return false on failure
-            return False
-
-    def insert_book_to_db(self, book_data):
-        """This method handles inserting a new record into database.
-        It takes a DTO as input which contains the required details for the record. """
-        # Check that the data been passed as input is a new record to be inserted into database.
-        if book_data.store_flag == "new":
-            # Set the insertion query as a variable.
-            # Use placeholders for the values.
-            # The values will be passed with a parameter to the cursor.execute method as a tuple.
-            # This way, SQL injection will be avoided by passing the values through MySQL library method.
-            insert_query = "INSERT INTO books " \
-                           "(book_ISBN, book_name, book_writer, book_genre) " \
-                           "VALUES (%s, %s, %s, %s)"
-            
-            # Always call the create_book_table method to create the table.
-            # Checking whether the table exists or not is handled within create_book_table method.
-            if self.create_book_table():
-                # Get cursor instance.
-                cursor = self.connection.cursor()
-                # Enclose the database call within try and except
-                try:
-                    # Execute the insert query
-                    # Pass the values as a parameter
-                    cursor.execute(insert_query, tuple(book_data.get_as_list()))
-                    # Remember to commit if successful
-                    self.connection.commit()
-                    # Set the flag in the DTO to indicate that storing was successful
-                    book_data.store_flag = "inserted"
-                except Error as e:
-                    # Check for duplicate record.
-                    # Checking through database failure is cheaper as we can check with single database call.
-                    # The error number 1062 is specific to duplicate record failure if primary key (book_ISBN)
-                    # is already present.
-                    if e.errno == 1062:
-                        print("Error while inserting record - duplicate record", e)
-                        # Close the cursor
-                        cursor.close()
-                        # Set the flag in DTO to indicate failure due to duplicate record.
-                        book_data.store_flag = "duplicate"
-                    else:
-                        # For other errors, close the cursor and set the DTO flag as normal failure.
-                        # If further specific failures need to be captured, the best way would be to check
-                        # the error number and handle like duplicate record block.
-                        print("Error while inserting record", e)
-                        cursor.close()
-                        book_data.store_flag = "insert failed"
-            else:
-                # Set flag in DTO if creation of table itself had failed.
-                book_data.store_flag = "create failed"
-        # Return the DTO with the flag set
-        return book_data
-
-    def get_all_books(self):
-        """This method handles retrieving all the records in the database table. """
-        # Create a list for the records. This will be a list of the DTO objects
-        all_books = []
-        # Set the query as a variable
-        get_all_query = "SELECT * FROM books LIMIT 0,500"
-        # Get the cursor instance
-        cursor = self.connection.cursor()
-        # Enclose the database call within try and except
+
+    def is_duplicate_error(self, error):
+        """This method tells whether an error was raised because the primary key (book_key) is already present. """
+        # The error number 1062 is specific to duplicate record failure.
+        return error.errno == DUPLICATE_ENTRY
+
+    def is_existing_index_error(self, error):
+        """This method tells whether an error was raised because an index with the same name already exists. """
+        return getattr(error, 'errno', None) == DUPLICATE_KEY_NAME
+
+    def build_keyword_query(self, keywords, limit):
+        """This method returns the query and values of a keyword search on the full-text index,
+        ranked by the relevance computed by MySQL. """
+        keyword_query = "SELECT book_ISBN, book_name, book_writer, book_genre FROM books " \
+                        "WHERE MATCH (book_name, book_writer) AGAINST (%s IN NATURAL LANGUAGE MODE) " \
+                        "ORDER BY MATCH (book_name, book_writer) AGAINST (%s IN NATURAL LANGUAGE MODE) DESC " \
+                        "LIMIT %s"
+        return keyword_query, (keywords, keywords, limit)
+
+    def get_streaming_cursor(self):
+        """This method returns an unbuffered cursor, so the server sends the records as they are fetched. """
+        return self.connection.cursor(buffered=False)
+
+    def close_streaming_cursor(self, cursor):
+        """This method closes an unbuffered cursor. The records not fetched are read and dropped first,
+        as the connection cannot run another query while a result is unread. """
         try:
-            # Execute the query
-            cursor.execute(get_all_query)
-            # Get the field names from the result
-            field_names = [i[0] for i in cursor.description]
-            # get all records
-            records = cursor.fetchall()
-            print("Total number of rows in table: ", cursor.rowcount)
-            # Insert the field names as first row in the records to be returned.
-            records.insert(0, field_names)
-            print("\nPrinting each row")
-            # Temp DTO variable for each record
-            # book_data = None
-            for row in records:
-                # Temp DTO variable for each record
-                book_data = BookDTO()
-                book_data.book_ISBN = row[0]
-                book_data.book_name = row[1]
-                book_data.book_writer = row[2]
-                book_data.book_genre = row[3]
-                all_books.append(book_data)
-        except Error as e:
-            # Catch exception and close the cursor
-            print("Error while reading data", e)
+            if self.connection.unread_result:
+                self.connection.consume_results()
             cursor.close()
-        # Return the list of DTOs
-        return all_books
-
-    def close_connection(self):
-        """This method closes the connection instance in the class. """
-        # Check if the connection is active and close it.
-        if self.connection.is_connected():
-            self.connection.close()
-            print("MySQL connection is closed")
-
-    def search_book_on_db(self, book_data):
-        """This method handles retrieving records matching the search criteria.
-        The search criteria is passed as a DTO"""
-        # Create a list for the records. This will be a list of the DTO objects
-        all_books = []
-        # Count of criteria needed to form the query correctly
-        criteria_count = 0
-        # Create the query as a variable.
-        search_query = "SELECT * FROM books WHERE "
-        # Check if the attribute is present in the criteria and append to the search query.
-        # Use the counter to determine whether to append "AND" between criteria
-        if book_data.book_ISBN != '':
-            search_query += 'book_ISBN = ' + book_data.book_ISBN
-            criteria_count += 1
-        if book_data.book_name != '':
-            if criteria_count > 0:
-                search_query += ' AND '
-            search_query += 'book_name = "' + book_data.book_name + '"'
-            criteria_count += 1
-        if book_data.book_writer != '':
-            if criteria_count > 0:
-                search_query += ' AND '
-            search_query += 'book_writer = "' + book_data.book_writer + '"'
-            criteria_count += 1
-        if book_data.book_genre != '':
-            if criteria_count > 0:
-                search_query += ' AND '
-            search_query += 'book_genre = "' + book_data.book_genre + '"'
-            criteria_count += 1
-        # Get the cursor instance
-        cursor = self.connection.cursor()
-        # Enclose the database call within try and except
-        try:
-            # Execute the query
-            cursor.execute(search_query)
-            # Get the field names from the result
-            field_names = [i[0] for i in cursor.description]
-            # get all records
-            records = cursor.fetchall()
-            print("Total number of rows in table: ", cursor.rowcount)
-            # Insert the field names as first row in the records to be returned.
-            records.insert(0, field_names)
-            print("\nPrinting each row")
-            # book_data = None
-            # Iterate through the records and append to the list of DTOs
-            for row in records:
-                # Temp DTO variable for each record
-                book_data = BookDTO()
-                book_data.book_ISBN = row[0]
-                book_data.book_name = row[1]
-                book_data.book_writer = row[2]
-                book_data.book_genre = row[3]
-                all_books.append(book_data)
         except Error as e:
-            # Catch exception and close the cursor
-            print("Error while reading data", e)
-            cursor.close()
-        # Return the list of DTOs
-        return all_books
+            print("Error while closing cursor", e)
+
+    def get_prepared_cursor(self, query):
+        """This method returns a prepared-statement cursor for the query.
+        The cursors are kept with the pooled connection, so the statement is parsed and planned by the server
+        once per connection and only the values are sent on the following executions. """
+        self.ensure_connection()
+        prepared_cursors = getattr(self.connection, 'prepared_cursors', None)
+        if prepared_cursors is None:
+            prepared_cursors = {}
+            self.connection.prepared_cursors = prepared_cursors
+        cursor = prepared_cursors.get(query)
+        if cursor is None:
+            cursor = self.connection.cursor(prepared=True)
+            prepared_cursors[query] = cursor
+        return cursor
+
+    def release_prepared_cursor(self, query, cursor):
+        """This method keeps the prepared-statement cursor open for the next execution of the query. """
+        pass
+
+    def forget_prepared_cursor(self, query, cursor=None):
+        """This method closes and forgets the prepared-statement cursor of a query, e.g. after an error. """
+        prepared_cursors = getattr(self.connection, 'prepared_cursors', None) or {}
+        cursor = prepared_cursors.pop(query, cursor)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Error:
+                pass
 
 
 # To run this program as standalone and test the methods, sample code can be executed as below.
@@ -215,7 +146,7 @@ class SQLHandler:
 if __name__ == '__main__':
     sql_handler = SQLHandler()
     book_dto = BookDTO()
-    book_dto.book_ISBN = '123456'
+    book_dto.book_ISBN = '0-7475-4215-5'
     book_dto.book_name = 'Harry Potter and Prisoner of Azkaban'
     book_dto.book_writer = 'J K Rowling'
     book_dto.book_genre = 'Fiction'
@@ -224,7 +155,7 @@ if __name__ == '__main__':
         book_dto = sql_handler.insert_book_to_db(book_dto)
         print('store_flag ->', book_dto.store_flag)
         books = sql_handler.get_all_books()
-        print('Books ->', *books)
+        print('Books ->', *books.to_dtos())
     except Error as e:
         print("Error while executing", e)
     finally:
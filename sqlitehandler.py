@@ -0,0 +1,116 @@
+import os
+import sqlite3
+
+from bookrecords import dbconfig
+from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import INSERT_QUERY, BookRepository
+from bookrecords.connectionpool import ConnectionPool, get_shared_pool
+from bookrecords.schema import SQLITE_MIGRATIONS, SQLITE_SECONDARY_INDEXES, apply_migrations
+
+# Seconds a connection waits for the lock of another writer before giving up.
+BUSY_TIMEOUT = 10
+# Number of compiled statements kept by each connection, so the same query is not parsed again.
+CACHED_STATEMENTS = 256
+# Settings applied to every new connection.
+# With write-ahead logging readers do not block the writer and the writer does not block readers.
+# Syncing to disk at checkpoints only is safe with write-ahead logging and much faster for many small writes.
+# The page cache of 64 MB (negative means KB) and the memory mapping of 256 MB keep the hot pages off the disk.
+CONNECTION_PRAGMAS = ["PRAGMA journal_mode = WAL",
+                      "PRAGMA synchronous = NORMAL",
+                      "PRAGMA temp_store = MEMORY",
+                      "PRAGMA cache_size = -65536",
+                      "PRAGMA mmap_size = 268435456"]
+
+
+def connect_sqlite(path):
+    """This method opens a new connection to the SQLite database file with the settings above. """
+    # The connection is borrowed from the pool by different threads, but only by one at a time.
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                 cached_statements=CACHED_STATEMENTS)
+    for pragma in CONNECTION_PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+class SQLiteHandler(BookRepository):
+    """This class contains the variables and methods to interact with an embedded SQLite database file.
+    It needs no database server, so the application can run and be tested on a machine without MySQL. """
+
+    Error = sqlite3.Error
+    placeholder = '?'
+    backend_name = 'sqlite'
+    explain_prefix = 'EXPLAIN QUERY PLAN '
+    stats_upsert_query = "INSERT INTO book_stats (stat_kind, stat_value, book_count) VALUES (%s, %s, %s) " \
+                         "ON CONFLICT (stat_kind, stat_value) " \
+                         "DO UPDATE SET book_count = book_count + excluded.book_count"
+    merge_upsert_query = INSERT_QUERY + " ON CONFLICT (book_key) DO UPDATE SET book_name = excluded.book_name, " \
+                                        "book_writer = excluded.book_writer, book_genre = excluded.book_genre, " \
+                                        "book_revision = excluded.book_revision, book_hash = excluded.book_hash"
+    secondary_indexes = SQLITE_SECONDARY_INDEXES
+    # SQLite keeps no row count of its tables, so the estimate adds up the counts per genre of the summary table,
+    # which has one row per genre instead of one per record.
+    estimate_count_query = "SELECT SUM(book_count) FROM book_stats WHERE stat_kind = 'genre'"
+
+    def __init__(self, path=None, pool=None, cache=None):
+        """This is the constructor method. The database file is taken from dbconfig unless a path is passed. """
+        self.path = os.path.abspath(path if path is not None else dbconfig.SQLITE_PATH)
+        super().__init__(pool=pool, cache=cache)
+
+    def get_default_pool(self):
+        """This method returns the process-wide connection pool of the database file. """
+        return get_shared_pool(self.schema_key(),
+                               lambda: ConnectionPool(connect=lambda: connect_sqlite(self.path),
+                                                      error_class=sqlite3.Error,
+                                                      exhausted_error=sqlite3.OperationalError))
+
+    def schema_key(self):
+        """This method returns a key which identifies the database file. """
+        return 'sqlite:' + self.path
+
+    def migrate_schema(self):
+        """This method applies the migrations which are not yet recorded in the database and returns the version.
+        SQLite locks the whole file while writing, so two processes never migrate at the same time. """
+        # A column may have been added by an earlier run which failed before recording the version.
+        return apply_migrations(self.connection, SQLITE_MIGRATIONS, placeholder='?',
+                                ignore_error=lambda e: 'duplicate column name' in str(e))
+
+    def is_duplicate_error(self, error):
+        """This method tells whether an error was raised because the primary key (book_key) is already present. """
+        return isinstance(error, sqlite3.IntegrityError) and \
+            ('UNIQUE' in str(error) or 'PRIMARY KEY' in str(error))
+
+    def is_existing_index_error(self, error):
+        """This method tells whether an error was raised because an index already exists. """
+        return isinstance(error, sqlite3.OperationalError) and 'already exists' in str(error)
+
+    def build_keyword_query(self, keywords, limit):
+        """This method returns the query and values of a keyword search on the FTS5 table,
+        ranked by the bm25 relevance of SQLite. A record matches if it contains any of the keywords,
+        like the natural language mode of MySQL. """
+        # Quote every keyword so that characters with a meaning in the FTS5 syntax are taken literally.
+        terms = ['"' + keyword.replace('"', '""') + '"' for keyword in keywords.split()]
+        keyword_query = "SELECT books.book_ISBN, books.book_name, books.book_writer, books.book_genre " \
+                        "FROM books_fts JOIN books ON books.rowid = books_fts.rowid " \
+                        "WHERE books_fts MATCH ? ORDER BY bm25(books_fts) LIMIT ?"
+        return keyword_query, (' OR '.join(terms) or '""', limit)
+
+
+# To run this program as standalone and test the methods, sample code can be executed as below.
+# Check whether the is executed from command
+if __name__ == '__main__':
+    sql_handler = SQLiteHandler()
+    book_dto = BookDTO()
+    book_dto.book_ISBN = '0-7475-4215-5'
+    book_dto.book_name = 'Harry Potter and Prisoner of Azkaban'
+    book_dto.book_writer = 'J K Rowling'
+    book_dto.book_genre = 'Fiction'
+    book_dto.store_flag = 'new'
+    try:
+        book_dto = sql_handler.insert_book_to_db(book_dto)
+        print('store_flag ->', book_dto.store_flag)
+        books = sql_handler.get_all_books()
+        print('Books ->', *books.to_dtos())
+    except sqlite3.Error as e:
+        print("Error while executing", e)
+    finally:
+        sql_handler.close_connection()
@@ -0,0 +1,73 @@
+import tkinter
+from tkinter import ttk
+
+from bookrecords.instrumentation import get_instrumentation
+
+# Columns of the table of operations, as (key of the statistics, heading).
+OPERATION_COLUMNS = (('calls', 'Calls'), ('errors', 'Errors'), ('rows', 'Rows'),
+                     ('p50_ms', 'p50 ms'), ('p95_ms', 'p95 ms'), ('max_ms', 'Max ms'))
+
+
+class StatsPanel:
+    """This class shows the statistics of the instrumentation in a window of its own:
+    the latency percentiles, rows and errors per operation, the connection acquire time, and the counters of
+    the query cache and the connection pool. The window refreshes itself while it is open.
+    The statistics are read from memory, so the panel never waits for the database. """
+
+    def __init__(self, parent, refresh_interval=1000):
+        """This is the constructor method. It creates the window and its widgets.
+        refresh_interval is the number of milliseconds between two refreshes. """
+        self.refresh_interval = refresh_interval
+        self.after_id = None
+        self.window = tkinter.Toplevel(parent)
+        self.window.title("Database statistics")
+        self.window.geometry('640x420+940+10')
+        # Stop refreshing when the window is closed.
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+        # Create a LabelFrame with a TreeView with one row per operation.
+        operations_container = ttk.LabelFrame(self.window, text="Operations")
+        self.tree = ttk.Treeview(operations_container, columns=[key for key, _ in OPERATION_COLUMNS])
+        self.tree.heading('#0', text='Operation')
+        self.tree.column('#0', width=150)
+        for key, heading in OPERATION_COLUMNS:
+            self.tree.heading(key, text=heading)
+            self.tree.column(key, anchor=tkinter.E, width=70)
+        self.tree.pack(fill=tkinter.BOTH, expand=True)
+        operations_container.place(x=10, y=10, height=260, width=620)
+
+        # Create a label for the acquire time and the counters of the cache and the pool.
+        self.counters_variable = tkinter.StringVar(self.window)
+        tkinter.Label(self.window, textvariable=self.counters_variable, font=("bold", 10),
+                      justify="left", anchor='nw').place(x=10, y=280, height=130, width=620)
+        self.refresh()
+
+    def refresh(self):
+        """This method shows the current statistics and schedules the next refresh. """
+        stats = get_instrumentation().get_stats()
+        for operation, operation_stats in stats['operations'].items():
+            values = [operation_stats[key] for key, _ in OPERATION_COLUMNS]
+            # The operation is used as the item identifier, so its row is updated in place.
+            if self.tree.exists(operation):
+                self.tree.item(operation, values=values)
+            else:
+                self.tree.insert('', tkinter.END, iid=operation, text=operation, values=values)
+
+        lines = ['Connection acquire: {calls} calls, p50 {p50_ms} ms, p95 {p95_ms} ms, {errors} failed'
+                 .format(**stats['acquire']),
+                 'Slow queries logged: {}'.format(stats['slow_queries'])]
+        if 'cache' in stats:
+            lines.append('Cache: {entries} results, {rows} rows, {hits} hits, {misses} misses, '
+                         '{evictions} evictions, {invalidations} invalidations'.format(**stats['cache']))
+        if 'pool' in stats:
+            lines.append('Pool: {open} of {pool_size} open, {borrowed} borrowed, {idle} idle, {created} created, '
+                         '{evicted} evicted, {replaced} replaced'.format(**stats['pool']))
+        self.counters_variable.set('\n'.join(lines))
+        self.after_id = self.window.after(self.refresh_interval, self.refresh)
+
+    def close(self):
+        """This method stops the refreshes and closes the window. """
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+            self.after_id = None
+        self.window.destroy()
@@ -0,0 +1,80 @@
+import pytest
+
+from bookrecords.bookrepository import decode_change_token, encode_change_token
+from bookrecords.booksdto import BookDTO
+from bookrecords.sqlitehandler import SQLiteHandler
+
+
+def make_book(isbn='', name='', writer='', genre=''):
+    book_data = BookDTO()
+    book_data.book_ISBN = isbn
+    book_data.book_name = name
+    book_data.book_writer = writer
+    book_data.book_genre = genre
+    return book_data
+
+
+@pytest.fixture
+def handler(tmp_path):
+    sql_handler = SQLiteHandler(path=str(tmp_path / 'books.db'))
+    yield sql_handler
+    sql_handler.close_connection()
+
+
+def changed_isbns(changes):
+    return [row[0] for row in changes]
+
+
+def test_change_token_round_trip():
+    assert decode_change_token(encode_change_token(7, 9780747532699)) == (7, 9780747532699)
+
+
+def test_every_write_takes_the_next_revision(handler):
+    cursor = handler.connection.cursor()
+    try:
+        first_revision = handler.next_revision(cursor)
+        assert handler.next_revision(cursor) == first_revision + 1
+        handler.connection.commit()
+    finally:
+        cursor.close()
+    assert decode_change_token(handler.get_change_token())[0] == first_revision + 1
+
+
+def test_changes_since_token(handler):
+    handler.insert_book_to_db(make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy'))
+    token = handler.get_change_token()
+    changes, token, more = handler.get_changes_since(token)
+    assert (len(changes), more) == (0, False)
+    list(handler.insert_books_to_db([make_book('9780451524935', '1984', 'George Orwell', 'Fiction'),
+                                     make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Romance')]))
+    list(handler.merge_books_to_db([make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Children')]))
+    changes, token, more = handler.get_changes_since(token)
+    # The records of one batch share a revision and come in order of key.
+    assert changed_isbns(changes) == ['9780141439518', '9780451524935', '9780747532699']
+    assert not more
+    changes, _, _ = handler.get_changes_since(token)
+    assert len(changes) == 0
+
+
+def test_changes_are_read_in_pages_within_a_revision(handler):
+    token = handler.get_change_token()
+    list(handler.insert_books_to_db([make_book('9780451524935', '1984', 'George Orwell', 'Fiction'),
+                                     make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Romance'),
+                                     make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy')]))
+    changes, token, more = handler.get_changes_since(token, limit=2)
+    assert changed_isbns(changes) == ['9780141439518', '9780451524935']
+    assert more
+    changes, token, more = handler.get_changes_since(token, limit=2)
+    assert changed_isbns(changes) == ['9780747532699']
+    assert not more
+
+
+def test_bulk_load_changes_show_once_finished(handler):
+    token = handler.get_change_token()
+    handler.start_bulk_load()
+    list(handler.insert_books_to_db([make_book('9780451524935', '1984', 'George Orwell', 'Fiction')]))
+    changes, _, _ = handler.get_changes_since(token)
+    assert len(changes) == 0
+    handler.finish_bulk_load(handler.take_bulk_stats())
+    changes, _, _ = handler.get_changes_since(token)
+    assert changed_isbns(changes) == ['9780451524935']
@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from bookrecords.connectionpool import ConnectionPool
+from bookrecords.sqlitehandler import connect_sqlite
+
+
+@pytest.fixture
+def make_pool(tmp_path):
+    pools = []
+
+    def create_pool(**kwargs):
+        settings = {'pool_size': 2, 'idle_timeout': 60, 'health_check_after': 0, 'acquire_timeout': 0.05}
+        settings.update(kwargs)
+        pool = ConnectionPool(connect=lambda: connect_sqlite(str(tmp_path / 'books.db')),
+                              ping=lambda connection: connection.execute('SELECT 1'),
+                              error_class=sqlite3.Error, exhausted_error=sqlite3.OperationalError, **settings)
+        pools.append(pool)
+        return pool
+
+    yield create_pool
+    for pool in pools:
+        pool.close_all()
+
+
+def test_idle_connection_is_reused(make_pool):
+    pool = make_pool()
+    connection = pool.get_connection()
+    pool.release_connection(connection)
+    assert pool.get_connection() is connection
+    assert pool.get_stats()['created'] == 1
+
+
+def test_exhausted_pool_raises_after_the_timeout(make_pool):
+    pool = make_pool()
+    connections = [pool.get_connection(), pool.get_connection()]
+    started = time.monotonic()
+    with pytest.raises(sqlite3.OperationalError):
+        pool.get_connection()
+    assert time.monotonic() - started >= 0.05
+    assert pool.get_stats()['borrowed'] == 2
+    pool.release_connection(connections[0])
+    assert pool.get_connection() is connections[0]
+
+
+def test_waiting_borrower_gets_the_released_connection(make_pool):
+    pool = make_pool(pool_size=1, acquire_timeout=5)
+    connection = pool.get_connection()
+    releaser = threading.Timer(0.05, pool.release_connection, (connection,))
+    releaser.start()
+    try:
+        assert pool.get_connection() is connection
+    finally:
+        releaser.join()
+
+
+def test_broken_idle_connection_is_replaced(make_pool):
+    pool = make_pool()
+    connection = pool.get_connection()
+    pool.release_connection(connection)
+    # The connection is lost while idle, e.g. dropped by the server.
+    connection.close()
+    replacement = pool.get_connection()
+    assert replacement is not connection
+    replacement.execute('SELECT 1')
+    stats = pool.get_stats()
+    assert (stats['created'], stats['replaced'], stats['open']) == (2, 1, 1)
+
+
+def test_broken_connection_is_discarded_on_release(make_pool):
+    pool = make_pool(pool_size=1)
+    connection = pool.get_connection()
+    connection.close()
+    pool.release_connection(connection)
+    assert pool.get_stats()['open'] == 0
+    # The slot of the broken connection is free for a new one.
+    assert pool.get_connection() is not connection
+
+
+def test_idle_connections_are_closed_after_the_timeout(make_pool):
+    pool = make_pool(idle_timeout=0.01)
+    pool.release_connection(pool.get_connection())
+    time.sleep(0.05)
+    pool.get_connection()
+    stats = pool.get_stats()
+    assert (stats['evicted'], stats['created'], stats['open']) == (1, 2, 1)
@@ -0,0 +1,40 @@
+import pytest
+
+from bookrecords.isbn import clean_isbn, is_valid_isbn, isbn10_check_digit, isbn13_check_digit, isbn_key, \
+    normalize_isbn
+
+
+def test_check_digits():
+    assert isbn10_check_digit('074753269') == '9'
+    assert isbn10_check_digit('043942089') == 'X'
+    assert isbn13_check_digit('978074753269') == '9'
+    assert isbn13_check_digit('979109044981') == '7'
+
+
+def test_clean_drops_separators_and_prefix():
+    assert clean_isbn(' ISBN: 0-7475-3269-9 ') == '0747532699'
+    assert clean_isbn('0-439-42089-x') == '043942089X'
+
+
+def test_isbn10_is_converted_to_isbn13():
+    assert normalize_isbn('0-7475-3269-9') == '9780747532699'
+    assert normalize_isbn('043942089x') == '9780439420891'
+
+
+def test_isbn13_is_kept():
+    assert normalize_isbn('978-0-7475-3269-9') == '9780747532699'
+    assert normalize_isbn('9791090449817') == '9791090449817'
+
+
+@pytest.mark.parametrize('text', ['0747532698', '9780747532698', '979109044981X', '9770747532699', '12345',
+                                  'not an isbn', ''])
+def test_invalid_isbns_are_rejected(text):
+    with pytest.raises(ValueError):
+        normalize_isbn(text)
+    assert not is_valid_isbn(text)
+
+
+def test_both_forms_have_the_same_key():
+    assert isbn_key('0-7475-3269-9') == isbn_key('9780747532699') == 9780747532699
+    with pytest.raises(ValueError):
+        isbn_key('0747532698')
@@ -0,0 +1,73 @@
+import pytest
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.sqlitehandler import SQLiteHandler
+
+
+def make_book(isbn='', name='', writer='', genre=''):
+    book_data = BookDTO()
+    book_data.book_ISBN = isbn
+    book_data.book_name = name
+    book_data.book_writer = writer
+    book_data.book_genre = genre
+    return book_data
+
+
+@pytest.fixture
+def handler(tmp_path):
+    sql_handler = SQLiteHandler(path=str(tmp_path / 'books.db'))
+    yield sql_handler
+    sql_handler.close_connection()
+
+
+def merge(sql_handler, books, **kwargs):
+    return [book_data.store_flag for book_data in sql_handler.merge_books_to_db(books, **kwargs)]
+
+
+def stored_names(sql_handler):
+    return [row[1] for row in sql_handler.get_all_books()]
+
+
+def test_merge_inserts_updates_and_skips_unchanged(handler):
+    assert merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy'),
+                           make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Romance')]) == \
+        ['inserted', 'inserted']
+    assert merge(handler, [make_book('0-7475-3269-9', 'Harry Potter', 'J K Rowling', 'Fantasy'),
+                           make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Classics'),
+                           make_book('9780451524935', '1984', 'George Orwell', 'Fiction')]) == \
+        ['unchanged', 'updated', 'inserted']
+    assert stored_names(handler) == ['Pride and Prejudice', '1984', 'Harry Potter']
+    assert handler.count_books(make_book(genre='Classics')) == 1
+    assert handler.count_books(make_book(genre='Romance')) == 0
+
+
+def test_unchanged_records_are_written_when_asked(handler):
+    merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy')])
+    token = handler.get_change_token()
+    assert merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy')],
+                 skip_unchanged=False) == ['updated']
+    changes, _, _ = handler.get_changes_since(token)
+    assert len(changes) == 1
+
+
+def test_unchanged_records_are_not_written(handler):
+    merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy')])
+    token = handler.get_change_token()
+    assert merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy')]) == ['unchanged']
+    changes, _, _ = handler.get_changes_since(token)
+    assert len(changes) == 0
+
+
+def test_invalid_and_repeated_records_are_not_merged(handler):
+    assert merge(handler, [make_book('0747532698', 'Bad check digit', 'Nobody', 'None'),
+                           make_book('9780747532699', 'Old name', 'J K Rowling', 'Fantasy'),
+                           make_book('0-7475-3269-9', 'Harry Potter', 'J K Rowling', 'Fantasy')]) == \
+        ['invalid', 'duplicate', 'inserted']
+    assert stored_names(handler) == ['Harry Potter']
+
+
+def test_merge_keeps_the_genre_counts(handler):
+    merge(handler, [make_book('9780747532699', 'Harry Potter', 'J K Rowling', 'Fantasy'),
+                    make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Romance')])
+    merge(handler, [make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Fantasy')])
+    assert dict(handler.get_book_stats('genre')) == {'Fantasy': 2}
@@ -0,0 +1,106 @@
+import pytest
+
+from bookrecords import querycache
+from bookrecords.booksdto import BookDTO
+from bookrecords.querycache import QueryCache, make_count_key, make_search_key, search_key_matches
+from bookrecords.sqlitehandler import SQLiteHandler
+
+
+def make_book(isbn='', name='', writer='', genre=''):
+    book_data = BookDTO()
+    book_data.book_ISBN = isbn
+    book_data.book_name = name
+    book_data.book_writer = writer
+    book_data.book_genre = genre
+    return book_data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(querycache, 'time', fake_clock)
+    return fake_clock
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryCache(max_entries=2, max_rows=100, ttl=60)
+    cache.put('a', 'A', 1)
+    cache.put('b', 'B', 1)
+    # Reading "a" makes "b" the least recently used.
+    assert cache.get('a') == 'A'
+    cache.put('c', 'C', 1)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_entries_are_evicted_to_bound_the_rows():
+    cache = QueryCache(max_entries=10, max_rows=10, ttl=60)
+    cache.put('a', 'A', 6)
+    cache.put('b', 'B', 6)
+    assert cache.get('a') is None
+    assert cache.get_stats()['rows'] == 6
+    # A value larger than the cache is not kept at all.
+    cache.put('c', 'C', 11)
+    assert cache.get('c') is None
+    assert cache.get('b') == 'B'
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = QueryCache(max_entries=10, max_rows=100, ttl=60)
+    cache.put('a', 'A', 1)
+    cache.put('b', 'B', 1, ttl=10)
+    clock.now += 30
+    assert cache.get('a') == 'A'
+    assert cache.get('b') is None
+    clock.now += 31
+    assert cache.get('a') is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_search_key_matches_exact_values():
+    harry = make_book('0-7475-3269-9', "Harry Potter and the Philosopher's Stone", 'J K Rowling', 'Fantasy')
+    assert search_key_matches(make_search_key(make_book(writer=' j k rowling ')), harry)
+    assert search_key_matches(make_search_key(make_book(isbn='9780747532699')), harry)
+    assert not search_key_matches(make_search_key(make_book(writer='J K Rowling', genre='Romance')), harry)
+
+
+def test_write_invalidates_matching_results():
+    cache = QueryCache(max_entries=10, max_rows=100, ttl=60)
+    harry = make_book('9780747532699', "Harry Potter and the Philosopher's Stone", 'J K Rowling', 'Fantasy')
+    matching_key = make_search_key(make_book(writer='J K Rowling'))
+    other_key = make_search_key(make_book(writer='Jane Austen'))
+    for key in (matching_key, other_key, make_count_key(), ('page', None, 500), ('estimate',)):
+        cache.put(key, [], 0)
+    cache.invalidate_books([harry])
+    assert cache.get(matching_key) is None
+    assert cache.get(make_count_key()) is None
+    assert cache.get(('page', None, 500)) is None
+    assert cache.get(other_key) == []
+    # The estimate is only dropped when it expires.
+    assert cache.get(('estimate',)) == []
+
+
+def test_insert_through_handler_invalidates_cached_search(tmp_path):
+    cache = QueryCache(max_entries=10, max_rows=100, ttl=60)
+    sql_handler = SQLiteHandler(path=str(tmp_path / 'books.db'), cache=cache)
+    try:
+        criteria = make_book(writer='J K Rowling')
+        assert len(sql_handler.search_book_on_db(criteria)) == 0
+        assert sql_handler.count_books(criteria) == 0
+        assert cache.get(make_search_key(criteria)) is not None
+        sql_handler.insert_book_to_db(make_book('9780747532699', "Harry Potter and the Philosopher's Stone",
+                                                'J K Rowling', 'Fantasy'))
+        assert len(sql_handler.search_book_on_db(criteria)) == 1
+        assert sql_handler.count_books(criteria) == 1
+    finally:
+        sql_handler.close_connection()
@@ -0,0 +1,124 @@
+import pytest
+
+from bookrecords.booksdto import BookDTO
+from bookrecords.bookrepository import build_search_criteria
+from bookrecords.querycache import QueryCache, make_count_key, make_search_key, search_key_matches
+from bookrecords.sqlitehandler import SQLiteHandler
+
+
+def make_book(isbn='', name='', writer='', genre=''):
+    book_data = BookDTO()
+    book_data.book_ISBN = isbn
+    book_data.book_name = name
+    book_data.book_writer = writer
+    book_data.book_genre = genre
+    return book_data
+
+
+def test_prefix_criteria_builds_like():
+    where_clause, params = build_search_criteria(make_book(name='Harry*'))
+    assert where_clause == " WHERE book_name LIKE %s ESCAPE '!'"
+    assert params == ('Harry%',)
+
+
+def test_prefix_criteria_escapes_wildcards():
+    _, params = build_search_criteria(make_book(name='100%_!*'))
+    assert params == ('100!%!_!!%',)
+
+
+def test_lone_wildcard_is_no_criteria():
+    assert build_search_criteria(make_book(name='*')) == ('', ())
+    assert make_search_key(make_book(name='*')) == make_search_key(make_book())
+
+
+def test_isbn_prefix_drops_separators():
+    _, params = build_search_criteria(make_book(isbn='978-0-7475*'))
+    assert params == ('97807475%',)
+
+
+def test_multi_value_isbns_use_keys():
+    where_clause, params = build_search_criteria(make_book(isbn=('0-7475-3269-9', '9780141439518')))
+    assert where_clause == ' WHERE book_key IN (%s, %s)'
+    assert params == (9780747532699, 9780141439518)
+
+
+def test_multi_value_criteria_builds_in():
+    where_clause, params = build_search_criteria(make_book(genre=['Fantasy', 'Romance', 'Fantasy']))
+    assert where_clause == ' WHERE book_genre IN (%s, %s)'
+    assert params == ('Fantasy', 'Romance')
+
+
+def test_criteria_shapes_are_combined():
+    where_clause, params = build_search_criteria(make_book(name='Harry*', writer=('J K Rowling', 'Jane Austen')))
+    assert where_clause == " WHERE book_name LIKE %s ESCAPE '!' AND book_writer IN (%s, %s)"
+    assert params == ('Harry%', 'J K Rowling', 'Jane Austen')
+
+
+HARRY = make_book('9780747532699', "Harry Potter and the Philosopher's Stone", 'J K Rowling', 'Fantasy')
+PRIDE = make_book('9780141439518', 'Pride and Prejudice', 'Jane Austen', 'Romance')
+
+
+def test_criteria_shapes_have_their_own_keys():
+    keys = {make_search_key(make_book(name='Harry')),
+            make_search_key(make_book(name='Harry*')),
+            make_search_key(make_book(name=['Harry'])),
+            make_count_key(make_book(name='Harry*'))}
+    assert len(keys) == 4
+    assert make_search_key(make_book(genre=['Romance', 'fantasy'])) == \
+        make_search_key(make_book(genre=('FANTASY', ' Romance ')))
+
+
+def test_search_key_matches_prefix_and_multi_value():
+    assert search_key_matches(make_search_key(make_book(name='harry*')), HARRY)
+    assert not search_key_matches(make_search_key(make_book(name='harry*')), PRIDE)
+    assert search_key_matches(make_search_key(make_book(genre=['Romance', 'Fiction'])), PRIDE)
+    assert not search_key_matches(make_search_key(make_book(genre=['Romance', 'Fiction'])), HARRY)
+
+
+def test_insert_invalidates_prefix_and_multi_value_searches():
+    cache = QueryCache(max_entries=10, max_rows=100, ttl=60)
+    prefix_key = make_search_key(make_book(name='Harry*'))
+    multi_key = make_count_key(make_book(genre=['Romance', 'Fantasy']))
+    other_key = make_search_key(make_book(name='Pride*'))
+    for key in (prefix_key, multi_key, other_key):
+        cache.put(key, [], 0)
+    cache.invalidate_books([HARRY])
+    assert cache.get(prefix_key) is None
+    assert cache.get(multi_key) is None
+    assert cache.get(other_key) == []
+
+
+BOOKS = [HARRY,
+         make_book('9780747538493', 'Harry Potter and the Chamber of Secrets', 'J K Rowling', 'Fantasy'),
+         PRIDE,
+         make_book('9780451524935', '1984', 'George Orwell', 'Fiction'),
+         make_book('9780000000002', '100% Fiction_Stories', 'Various', 'Fiction')]
+
+
+@pytest.fixture
+def handler(tmp_path):
+    sql_handler = SQLiteHandler(path=str(tmp_path / 'books.db'))
+    books = [make_book(book.book_ISBN, book.book_name, book.book_writer, book.book_genre) for book in BOOKS]
+    assert [book.store_flag for book in sql_handler.insert_books_to_db(books)] == ['inserted'] * len(BOOKS)
+    yield sql_handler
+    sql_handler.close_connection()
+
+
+def found_names(sql_handler, book_data):
+    return sorted(row[1] for row in sql_handler.search_book_on_db(book_data))
+
+
+def test_search_by_prefix(handler):
+    assert found_names(handler, make_book(name='harry p*')) == [BOOKS[1].book_name, HARRY.book_name]
+    assert found_names(handler, make_book(name='100%*')) == [BOOKS[4].book_name]
+    # The wildcards of LIKE in the value are matched as themselves.
+    assert found_names(handler, make_book(name='100_*')) == []
+    assert handler.count_books(make_book(writer='J K*')) == 2
+
+
+def test_search_by_multiple_values(handler):
+    assert found_names(handler, make_book(genre=['Romance', 'Fiction'])) == \
+        ['100% Fiction_Stories', '1984', 'Pride and Prejudice']
+    assert found_names(handler, make_book(writer=('Jane Austen', 'George Orwell'))) == ['1984', 'Pride and Prejudice']
+    assert found_names(handler, make_book(isbn=['0-7475-3269-9', '9780451524935'])) == ['1984', HARRY.book_name]
+    assert handler.count_books(make_book(writer=['Jane Austen', 'George Orwell'])) == 2
@@ -0,0 +1,283 @@
+import json
+import os
+import threading
+import time
+
+from bookrecords.booksdto import BookDTO
+
+# Attributes of the DTO kept in the journal.
+JOURNAL_FIELDS = ('book_ISBN', 'book_name', 'book_writer', 'book_genre')
+# Store flags of the records whose outcome is final, which are marked as done in the journal.
+DONE_FLAGS = ('inserted', 'duplicate', 'invalid')
+# Number of lines of records done after which the journal is written again with only the records not done.
+COMPACT_AFTER_LINES = 1000
+# Longest wait in milliseconds before a record which failed to insert is tried again.
+MAX_RETRY_DELAY = 60000
+
+
+def store_entries(sql_handler, books, maybe_stored, batch_size):
+    """This method stores the records of a flush on the background worker and returns their DTOs with the flags set.
+    maybe_stored are the DTOs which an earlier attempt may have stored without its outcome reaching the journal,
+    e.g. the records replayed after a crash. Such a record is found as a duplicate of itself, so it is flagged as
+    inserted when the record stored with its key has the same details. """
+    books = list(sql_handler.insert_books_to_db(books, batch_size))
+    duplicates = [book_data for book_data in maybe_stored if book_data.store_flag == 'duplicate']
+    if duplicates:
+        # The ISBN of a duplicate was turned into its ISBN-13 form, whose number is the key of the record.
+        stored_hashes = sql_handler.get_stored_hashes([int(book_data.book_ISBN) for book_data in duplicates])
+        for book_data in duplicates:
+            if stored_hashes.get(int(book_data.book_ISBN)) == book_data.get_content_hash():
+                book_data.store_flag = 'inserted'
+    return books
+
+
+class EntryJournal:
+    """This class keeps the records entered but not yet stored in an append-only file, one JSON object per line.
+    A record is written with an "add" line when it is entered and an "done" line once the database returned its
+    outcome. The records with an "add" line and no "done" line are the ones to store after a restart,
+    so no record entered is lost when the application closes before they are stored.
+    The file is emptied whenever every record in it is done, and written again with only the records not done once
+    enough records are done, so it stays small even while some records keep failing. """
+
+    def __init__(self, path, sync=True):
+        """This is the constructor method. The file is opened on first use.
+        With sync set, every record is forced to disk before it is reported as queued. """
+        self.path = path
+        self.sync = sync
+        self.journal_file = None
+        self.lock = threading.Lock()
+        # Number of lines in the file, to know when it is worth writing it again.
+        self.line_count = 0
+
+    def write_lines(self, entries):
+        """This method appends JSON lines to the file and forces them to disk. """
+        with self.lock:
+            if self.journal_file is None:
+                self.journal_file = open(self.path, 'a', encoding='utf-8')
+            self.journal_file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+            self.journal_file.flush()
+            if self.sync:
+                os.fsync(self.journal_file.fileno())
+            self.line_count += len(entries)
+
+    def get_add_line(self, entry_id, book_data):
+        """This method returns the line which records a record entered. """
+        return {'op': 'add', 'id': entry_id, 'record': {field: getattr(book_data, field) for field in JOURNAL_FIELDS}}
+
+    def rewrite(self, entries):
+        """This method replaces the file with one holding only the records passed, as (entry id, DTO) pairs.
+        The new file is written next to the old one and then moved over it, so a crash leaves one or the other. """
+        with self.lock:
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+            if not entries:
+                # Nothing is pending, so an empty file is as good as the old one whatever happens.
+                open(self.path, 'w', encoding='utf-8').close()
+                self.line_count = 0
+                return
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as journal_file:
+                journal_file.write(''.join(json.dumps(self.get_add_line(entry_id, book_data)) + '\n'
+                                           for entry_id, book_data in entries))
+                journal_file.flush()
+                if self.sync:
+                    os.fsync(journal_file.fileno())
+            os.replace(temporary_path, self.path)
+            self.line_count = len(entries)
+
+    def load(self):
+        """This method reads the file and returns the records not done, as (entry id, DTO) pairs in entry order.
+        A line cut short by a crash while it was written is ignored. """
+        pending = {}
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                self.line_count += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('op') == 'add':
+                    book_data = BookDTO()
+                    for field in JOURNAL_FIELDS:
+                        setattr(book_data, field, entry['record'][field])
+                    pending[entry['id']] = book_data
+                elif entry.get('op') == 'done':
+                    pending.pop(entry['id'], None)
+        return sorted(pending.items())
+
+    def add(self, entry_id, book_data):
+        """This method records a record entered. """
+        self.write_lines([self.get_add_line(entry_id, book_data)])
+
+    def mark_done(self, outcomes, remaining):
+        """This method records the outcome of records as (entry id, store flag) pairs.
+        remaining are the records of the file which are not done, as (entry id, DTO) pairs. When none is left the
+        file is emptied, and when the lines of records done pile up the file is written again with only them. """
+        if not remaining:
+            self.rewrite([])
+            return
+        self.write_lines([{'op': 'done', 'id': entry_id, 'store_flag': store_flag}
+                          for entry_id, store_flag in outcomes])
+        if self.line_count - len(remaining) >= COMPACT_AFTER_LINES:
+            self.rewrite(remaining)
+
+    def close(self):
+        """This method closes the file. """
+        with self.lock:
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+
+
+class WriteBehindQueue:
+    """This class takes the records entered and stores them in the background, in multi-row transactions.
+    Each record is written to the journal first, so it is safe as soon as it is queued, and the clerk can enter
+    the next one without waiting for the database. The queue is stored when it holds batch_size records or
+    every flush_interval milliseconds, whichever comes first, by a job of the background worker.
+    A record which failed to insert is tried again after a wait which doubles with every failure.
+    The outcome of every record is passed to on_status on the Tk thread. """
+
+    def __init__(self, journal, worker, batch_size=50, flush_interval=2000):
+        """This is the constructor method. The records left in the journal by an earlier run are queued again. """
+        self.journal = journal
+        self.worker = worker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Records queued and not yet stored, as (entry id, DTO) pairs.
+        self.pending = journal.load()
+        self.next_entry_id = max([entry_id for entry_id, _ in self.pending], default=0) + 1
+        # Records being stored by the worker, while a flush runs.
+        self.in_flight = []
+        # Records which failed to insert, as (time to try again, entry id, DTO) tuples, and the number of failures
+        # per entry id.
+        self.failed = []
+        self.failure_counts = {}
+        # Entry ids of the records which may have been stored without their outcome reaching the journal.
+        # The records left by an earlier run are among them, as it may have closed right after storing them.
+        self.maybe_stored_ids = {entry_id for entry_id, _ in self.pending}
+        self.root = None
+        self.after_id = None
+        # Method called with the entry id and the DTO whenever the state of a record changes.
+        # The store flag of the DTO is "queued" until the record is stored.
+        self.on_status = None
+
+    def attach(self, root):
+        """This method sets the Tk root whose "after" is used for the flush timer.
+        It must be called again whenever the root is re-initialised. """
+        self.root = root
+        self.after_id = None
+        self.schedule_flush()
+
+    def submit(self, book_data):
+        """This method queues a record entered and returns its entry id. """
+        entry_id = self.next_entry_id
+        self.next_entry_id += 1
+        self.journal.add(entry_id, book_data)
+        book_data.store_flag = 'queued'
+        self.pending.append((entry_id, book_data))
+        self.notify(entry_id, book_data)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return entry_id
+
+    def get_unstored(self):
+        """This method returns the records not stored yet, whether queued, being stored or waiting to be tried again,
+        as (entry id, DTO) pairs in entry order. """
+        return sorted(self.pending + self.in_flight + [(entry_id, book_data) for _, entry_id, book_data in self.failed],
+                      key=lambda entry: entry[0])
+
+    def notify(self, entry_id, book_data):
+        """This method passes the state of a record to on_status, if set. """
+        if self.on_status is not None:
+            self.on_status(entry_id, book_data)
+
+    def schedule_flush(self):
+        """This method schedules the next flush by the timer. """
+        if self.root is not None and self.after_id is None:
+            self.after_id = self.root.after(self.flush_interval, self.timer_fired)
+
+    def timer_fired(self):
+        """This method is called by the timer on the Tk thread. """
+        self.after_id = None
+        self.flush()
+        self.schedule_flush()
+
+    def flush(self):
+        """This method stores the queued records on the background worker, unless a flush is running already.
+        The records queued meanwhile are stored by the next flush, so the records are stored in entry order.
+        The records which failed to insert and waited long enough are queued again first. """
+        now = time.monotonic()
+        if any(retry_at <= now for retry_at, _, _ in self.failed):
+            retried = [(entry_id, book_data) for retry_at, entry_id, book_data in self.failed if retry_at <= now]
+            self.failed = [failure for failure in self.failed if failure[0] > now]
+            for entry_id, book_data in retried:
+                book_data.store_flag = 'queued'
+                self.notify(entry_id, book_data)
+            self.pending = sorted(retried + self.pending, key=lambda entry: entry[0])
+        if self.in_flight or not self.pending:
+            return
+        self.in_flight = self.pending[:self.batch_size]
+        self.pending = self.pending[self.batch_size:]
+        books = []
+        maybe_stored = []
+        for entry_id, book_data in self.in_flight:
+            book_data.store_flag = 'new'
+            books.append(book_data)
+            if entry_id in self.maybe_stored_ids:
+                maybe_stored.append(book_data)
+        self.worker.submit(lambda sql_handler: store_entries(sql_handler, books, maybe_stored, self.batch_size),
+                           self.flush_done, self.flush_failed)
+
+    def flush_done(self, books):
+        """This method is called on the Tk thread with the DTOs of a flush, with their flags set.
+        Only the records with a final outcome are marked as done in the journal. The records of a flush which
+        could not create the table are put back in front of the queue, like for a failed flush, and the records
+        which failed to insert stay in the journal and are tried again after a wait. """
+        stored, self.in_flight = self.in_flight, []
+        done = [(entry_id, book_data) for entry_id, book_data in stored if book_data.store_flag in DONE_FLAGS]
+        retried = [(entry_id, book_data) for entry_id, book_data in stored if book_data.store_flag == 'create failed']
+        failed = [(entry_id, book_data) for entry_id, book_data in stored
+                  if book_data.store_flag not in DONE_FLAGS and book_data.store_flag != 'create failed']
+        for entry_id, book_data in retried:
+            book_data.store_flag = 'queued'
+        self.pending = retried + self.pending
+        for entry_id, book_data in done:
+            self.failure_counts.pop(entry_id, None)
+            self.maybe_stored_ids.discard(entry_id)
+        now = time.monotonic()
+        for entry_id, book_data in failed:
+            # Wait twice as long after every failure, so that a record which cannot be stored does not keep
+            # the database busy.
+            failure_count = self.failure_counts.get(entry_id, 0) + 1
+            self.failure_counts[entry_id] = failure_count
+            retry_delay = min(self.flush_interval * 2 ** failure_count, MAX_RETRY_DELAY)
+            self.failed.append((now + retry_delay / 1000, entry_id, book_data))
+        self.journal.mark_done([(entry_id, book_data.store_flag) for entry_id, book_data in done],
+                               self.get_unstored())
+        for entry_id, book_data in stored:
+            self.notify(entry_id, book_data)
+        # Store the next batch at once if enough records are waiting, unless the database is failing.
+        if not retried and len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush_failed(self, error):
+        """This method is called on the Tk thread when a flush raised an error, e.g. the database is unreachable.
+        The records are put back in front of the queue and tried again by the next flush. """
+        print("Error while storing queued entries", error)
+        failed, self.in_flight = self.in_flight, []
+        for entry_id, book_data in failed:
+            # The error may have come after the records were stored, e.g. when the connection dropped.
+            self.maybe_stored_ids.add(entry_id)
+            book_data.store_flag = 'queued'
+            self.notify(entry_id, book_data)
+        self.pending = failed + self.pending
+
+    def close(self):
+        """This method stops the timer and closes the journal. Records not yet stored stay in the journal. """
+        if self.root is not None and self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        self.journal.close()